@@ -8,6 +8,7 @@ void setup(){
   analogReadResolution(12);                 
   analogSetPinAttenuation(PIN_PPG, ADC_11db); 
 }
+uint32_t lastSum = 0;   // somma delle 20 letture, inviata nei blocchi PPG grezzi
 float readsensor(){
   static float last=0.0f;
   float sum=0.0f;
@@ -16,6 +17,7 @@ float readsensor(){
     sum += analogRead(PIN_PPG);
     delay(1);
   };
+  lastSum = (uint32_t)sum;
   last = ALPHA * (sum / 20.0f) + (1.0f - ALPHA) * last;
   return last;           
 }
@@ -35,6 +37,41 @@ unsigned long lastBeatMs = 0, lastIBI = 800, lastToggleMs = 0;
 float bpmToSend = 0.0f, lastGoodBPM = 0.0f;
 int   contatore = 0; 
 
+// ================== PROTOCOLLO BINARIO ==================
+// Frame: A5 5A | len u16 | tipo u8 | millis u32 | payload | crc16 (CCITT-FALSE su tipo+millis+payload)
+// Attivato con CMD:BIN, CMD:TXT torna alle righe di testo. Gli ACK restano sempre righe di testo.
+static const uint8_t FR_BPM = 0x01, FR_METRICS = 0x02, FR_PPG = 0x03;
+static const int PPG_BLOCK = 25;              // campioni per frame (~0.5 s)
+bool binMode = false, rawMode = false;
+struct PpgSample { uint32_t t_ms; uint32_t somma; };
+PpgSample ppgBuf[PPG_BLOCK];
+int ppgN = 0;
+
+uint16_t crc16(const uint8_t* d, size_t n, uint16_t crc){
+  while (n--){
+    crc ^= (uint16_t)(*d++) << 8;
+    for (int i=0;i<8;i++) crc = (crc & 0x8000) ? (uint16_t)((crc << 1) ^ 0x1021) : (uint16_t)(crc << 1);
+  }
+  return crc;
+}
+void sendFrame(uint8_t type, const void* payload, uint16_t len){
+  uint8_t head[9] = {0xA5, 0x5A, (uint8_t)(len & 0xFF), (uint8_t)(len >> 8), type};
+  uint32_t ms = millis();
+  memcpy(head + 5, &ms, 4);                   // ESP32 è little-endian come il protocollo
+  uint16_t crc = crc16(head + 4, 5, 0xFFFF);
+  crc = crc16((const uint8_t*)payload, len, crc);
+  Serial.write(head, 9);
+  Serial.write((const uint8_t*)payload, len);
+  Serial.write((const uint8_t*)&crc, 2);
+}
+void pushPpgSample(unsigned long t, uint32_t somma){
+  ppgBuf[ppgN].t_ms = t; ppgBuf[ppgN].somma = somma;
+  if (++ppgN == PPG_BLOCK){
+    sendFrame(FR_PPG, ppgBuf, sizeof(ppgBuf));
+    ppgN = 0;
+  }
+}
+
 // ================== ORTOSTATICO ==================
 enum State { IDLE, BASELINE, POST_STAND, DONE };
 State state = IDLE;
@@ -110,6 +147,12 @@ void tick1Hz(){
     // stampa finale
     if (baselineDone && peakDone && recovDone) {
       dHR = HR_peak - HR_baseline;
+      if (binMode){
+        float m[5] = {HR_baseline, HR_peak, dHR, (float)t_peak_ms/1000.0f, HR_recov60};
+        sendFrame(FR_METRICS, m, sizeof(m));
+        state = DONE;
+        return;
+      }
       Serial.print("METRICS ");
       Serial.print("baseline="); Serial.print(HR_baseline, 1);
       Serial.print(" peak=");    Serial.print(HR_peak, 1);
@@ -141,6 +184,18 @@ void handleCommand(const String& cmd){
     baseline = 0; noiseEMA = 0; prevY = 0; armed = true; lastIBI = 800;
     t_startBaseline = millis();
     Serial.println("ACK:START");
+  } else if (cmd == "CMD:BIN"){
+    Serial.println("ACK:BIN");
+    binMode = true; ppgN = 0;
+  } else if (cmd == "CMD:TXT"){
+    binMode = false; rawMode = false;
+    Serial.println("ACK:TXT");
+  } else if (cmd == "CMD:RAW"){              // campioni grezzi, solo in modalità binaria
+    rawMode = true; ppgN = 0;
+    Serial.println("ACK:RAW");
+  } else if (cmd == "CMD:NORAW"){
+    rawMode = false;
+    Serial.println("ACK:NORAW");
   } else if (cmd == "CMD:STAND"){
     if (state == BASELINE){
       state = POST_STAND;
@@ -175,6 +230,7 @@ void loop(){
 
   // 1) acquisizione  
   float y = readsensor();
+  if (binMode && rawMode) pushPpgSample(now, lastSum);
 
   // 2) rimozione DC + stima rumore
   float dy = y - prevY;
@@ -205,8 +261,12 @@ void loop(){
         bpmToSend = 0.6f * bpmToSend + 0.4f * bpm;
         lastGoodBPM = bpmToSend;
 
-        Serial.print("BPM: ");
-        Serial.println(bpmToSend, 1);
+        if (binMode){
+          sendFrame(FR_BPM, &bpmToSend, sizeof(bpmToSend));
+        } else {
+          Serial.print("BPM: ");
+          Serial.println(bpmToSend, 1);
+        }
       }
     }
     lastBeatMs = now;
@@ -0,0 +1,99 @@
+"""Tempi di avvio della GUI e dell'acquisizione headless, ognuno in un interprete nuovo.
+
+Uso:  python benchmark/bench_avvio.py [--ripetizioni 5] [--uscita avvio.json]
+
+Misura l'import di interface4 e di monitor (e quali moduli pesanti caricano), il costo dei
+moduli che ora si importano solo al primo uso (Matplotlib col backend Tk, pandas, openpyxl),
+il tempo da lancio a "pronto" di monitor.py e, se c'è un display, da lancio a finestra e a
+grafico disegnato di interface4.py. Per ogni voce si riporta la mediana delle ripetizioni.
+"""
+import argparse, json, os, statistics, subprocess, sys, time
+
+RADICE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PESANTI = ("matplotlib", "pandas", "openpyxl", "pyarrow", "tkinter")
+
+CODICE_IMPORT = """
+import sys, time
+t = time.perf_counter()
+import {modulo}
+print(time.perf_counter() - t)
+print(",".join(m for m in {pesanti!r} if m in sys.modules))
+"""
+
+
+def _python(codice):
+    r = subprocess.run([sys.executable, "-c", codice], capture_output=True, text=True, cwd=RADICE, timeout=120)
+    if r.returncode:
+        raise RuntimeError(r.stderr.strip().splitlines()[-1] if r.stderr.strip() else f"uscita {r.returncode}")
+    return r.stdout.split("\n")
+
+
+def tempo_import(modulo, ripetizioni):
+    tempi, caricati = [], ""
+    for _ in range(ripetizioni):
+        uscita = _python(CODICE_IMPORT.format(modulo=modulo, pesanti=PESANTI))
+        tempi.append(float(uscita[0]))
+        caricati = uscita[1]
+    return {"s": round(statistics.median(tempi), 4), "moduli_pesanti": caricati.split(",") if caricati else []}
+
+
+def tempo_fino_a(argomenti, segnali, ripetizioni, timeout=60):
+    """Secondi dal lancio del processo a ciascuna riga di segnali stampata su stdout."""
+    tempi = {s: [] for s in segnali}
+    for _ in range(ripetizioni):
+        t0 = time.perf_counter()
+        proc = subprocess.Popen([sys.executable] + argomenti, cwd=RADICE, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, text=True)
+        try:
+            for riga in proc.stdout:
+                riga = riga.strip()
+                if riga in tempi:
+                    tempi[riga].append(time.perf_counter() - t0)
+            proc.wait(timeout=timeout)
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+        if proc.returncode:
+            raise RuntimeError(proc.stderr.read().strip().splitlines()[-1])
+    return {s: round(statistics.median(v), 4) for s, v in tempi.items() if v}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--ripetizioni", type=int, default=5)
+    ap.add_argument("--uscita", help="file JSON dove salvare i risultati")
+    args = ap.parse_args()
+    n = args.ripetizioni
+
+    risultati = {"python": sys.version.split()[0], "ripetizioni": n, "import": {}, "al_primo_uso": {}, "avvio": {}}
+    for modulo in ("interface4", "monitor"):
+        try:
+            risultati["import"][modulo] = tempo_import(modulo, n)
+        except RuntimeError as e:
+            risultati["import"][modulo] = {"errore": str(e)}
+    # quello che prima si pagava all'avvio e ora solo quando serve
+    for nome, modulo in (("matplotlib_tkagg", "matplotlib.figure, matplotlib.backends.backend_tkagg"),
+                         ("pandas", "pandas"), ("openpyxl", "openpyxl")):
+        try:
+            risultati["al_primo_uso"][nome] = tempo_import(modulo, n)["s"]
+        except RuntimeError as e:
+            risultati["al_primo_uso"][nome] = {"errore": str(e)}
+
+    risultati["avvio"]["monitor"] = tempo_fino_a(["monitor.py", "--misura-avvio", "--senza-registrazione"], ("pronto",), n)
+    if os.environ.get("DISPLAY") or sys.platform in ("win32", "darwin"):
+        try:
+            risultati["avvio"]["gui"] = tempo_fino_a(["interface4.py", "--misura-avvio"], ("finestra", "grafico"), n)
+        except RuntimeError as e:
+            risultati["avvio"]["gui"] = {"errore": str(e)}
+    else:
+        risultati["avvio"]["gui"] = {"errore": "nessun display"}
+
+    testo = json.dumps(risultati, indent=2, ensure_ascii=False)
+    print(testo)
+    if args.uscita:
+        with open(args.uscita, "w") as f:
+            f.write(testo + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+"""Benchmark della pipeline host: parser, coda, latenza su pty, grafico ed export.
+
+Uso:  python benchmark/bench_pipeline.py [--uscita risultati.json] [--solo parser,pty,grafico,export,soglie,diagnostica,diffusione]
+
+Gira senza display: il grafico usa il backend Agg e la sorgente seriale è un pseudo-terminale
+locale servito dal MotoreAcquisizione, come farebbe una porta vera. I risultati sono scritti
+in JSON (su stdout e, se indicato, in --uscita) per confrontare versioni diverse di interface4.py.
+"""
+import argparse, datetime, json, os, platform, subprocess, sys, tempfile, threading, time, tty
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from parser_seriale import estrai_eventi, CodaEventi
+from motore_acquisizione import MotoreAcquisizione
+from valutazione import riga_risultato
+
+SEZIONI = ("parser", "pty", "grafico", "export", "soglie", "diagnostica", "diffusione")
+
+
+def percentili_ms(valori):
+    if not valori:
+        return {"p50": None, "p99": None, "max": None}
+    a = np.asarray(valori) * 1000
+    return {"p50": round(float(np.percentile(a, 50)), 3), "p99": round(float(np.percentile(a, 99)), 3),
+            "max": round(float(a.max()), 3)}
+
+
+# ---- parser e coda ----
+def bench_parser(n=200000, blocco=4096):
+    dati = b"".join(b"BPM: %.1f\r\n" % (60 + (i % 600) / 10) for i in range(n))
+    buff, eventi, coda = bytearray(), [], CodaEventi()
+    t0 = time.perf_counter()
+    for i in range(0, len(dati), blocco):
+        buff.extend(dati[i:i + blocco])
+        eventi.clear()
+        estrai_eventi(buff, eventi)
+        coda.put_lotto(eventi)
+    dt = time.perf_counter() - t0
+    # lato GUI: un tick di leggi_coda con la coda piena
+    coda = CodaEventi()
+    coda.put_lotto([("STATUS", "x"), ("BPM", 70.0)] * (coda.capacita // 2))
+    t1 = time.perf_counter()
+    coda.preleva_tutto()
+    return {"righe": n, "righe_al_s": round(n / dt), "tick_gui_coda_piena_ms": round((time.perf_counter() - t1) * 1000, 4)}
+
+
+# ---- pty: latenza e portata ----
+def _apri_pty(percorso, _baud):
+    return open(percorso, "r+b", buffering=0)
+
+
+def bench_pty(ritmi=(100, 1000, 10000, 50000, 100000), durata=2.0):
+    risultati = []
+    for ritmo in ritmi:
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        motore = MotoreAcquisizione(apri=_apri_pty, attesa_reset=0)
+        motore.start()
+        disp = motore.aggiungi(os.ttyname(slave))
+        time.sleep(0.1)
+        n = int(ritmo * durata)
+        t_scrittura = np.zeros(n)
+        latenze, fine = [], threading.Event()
+
+        def consumatore():
+            while not fine.is_set():
+                for typ, val in disp.coda.preleva_tutto():
+                    if typ == "BPM":
+                        latenze.append(time.perf_counter() - t_scrittura[int(val)])
+                time.sleep(0.001)
+
+        th = threading.Thread(target=consumatore, daemon=True)
+        th.start()
+        per_ms = max(1, ritmo // 1000)
+        t0 = time.perf_counter()
+        for i in range(0, n, per_ms):
+            attesa = t0 + i / ritmo - time.perf_counter()
+            if attesa > 0:
+                time.sleep(attesa)
+            k = min(n, i + per_ms)
+            t_scrittura[i:k] = time.perf_counter()
+            os.write(master, b"".join(b"BPM: %d.0\n" % j for j in range(i, k)))
+        scritto = time.perf_counter() - t0
+        limite = time.perf_counter() + 2.0
+        while disp.righe_lette < n and time.perf_counter() < limite:
+            time.sleep(0.01)
+        fine.set()
+        th.join()
+        risultati.append({
+            "ritmo_righe_s": ritmo, "inviate": n, "lette": disp.righe_lette,
+            "ritmo_effettivo": round(n / scritto), "latenza_ms": percentili_ms(latenze),
+            "bpm_fusi": disp.coda.fusi, "scartati": disp.coda.scartati,
+            "al_passo": disp.righe_lette == n,
+        })
+        motore.ferma()
+        motore.join(2)
+        os.close(master)
+        os.close(slave)
+    return risultati
+
+
+# ---- grafico ----
+def bench_grafico(frame=1000, completi=50, ore_storia=24):
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from grafico import GraficoBPM
+
+    figura = Figure(figsize=(8.7, 3.8), dpi=100)
+    assi = figura.add_subplot(111)
+    tela = FigureCanvasAgg(figura)
+    g = GraficoBPM(figura, assi, tela)
+    tela.draw()
+    t0 = time.time()
+    for i in range(300):
+        g.serie.aggiungi(t0 + i, 70.0)
+    g.aggiorna()
+    g.tempi_frame.clear()
+    for i in range(frame):
+        g.serie.aggiungi(t0 + 300 + i, 70 + (i % 20))
+        g.aggiorna()
+    blit = list(g.tempi_frame)
+    t1 = time.perf_counter()
+    for _ in range(completi):
+        tela.draw()
+    completo = (time.perf_counter() - t1) / completi
+    t1 = time.perf_counter()
+    for _ in range(frame):
+        g.aggiorna()  # nessun dato nuovo
+    risultati = {"frame_blit_ms": percentili_ms(blit), "disegno_completo_ms": round(completo * 1000, 3),
+                 "tick_senza_dati_us": round((time.perf_counter() - t1) / frame * 1e6, 3),
+                 "ridisegni_completi": g.ridisegni_completi}
+
+    # storia lunga: un BPM al secondo per ore_storia ore, poi pan/zoom come dalla barra di navigazione
+    from serie_temporale import SerieTemporale
+    serie = SerieTemporale()
+    n = int(ore_storia * 3600)
+    valori = 72 + 10 * np.sin(np.arange(n) / 600)
+    t1 = time.perf_counter()
+    for i in range(n):
+        serie.aggiungi(t0 + i, valori[i])
+    risultati["serie_aggiungi_us"] = round((time.perf_counter() - t1) / n * 1e6, 3)
+    risultati["serie_memoria_kb"] = serie.nbyte() // 1024
+    g.imposta_serie(serie)
+    zoom = {}
+    for nome, larghezza in (("1min", 60), ("5min", 300), ("1h", 3600), ("6h", 6 * 3600), (f"{ore_storia}h", n)):
+        tempi = []
+        for k in range(20):  # spostamenti lungo tutta la storia
+            x0 = t0 + (n - larghezza) * k / 19
+            t1 = time.perf_counter()
+            assi.set_xlim(x0, x0 + larghezza)
+            tela.draw()
+            tempi.append(time.perf_counter() - t1)
+        zoom[nome] = {"livello": g.livello, "punti": len(g.linea.get_xdata()), "pan_ms": percentili_ms(tempi)}
+    risultati["pan_zoom"] = zoom
+    return risultati
+
+
+# ---- export ----
+def righe_di_prova(n):
+    rng = np.random.default_rng(0)
+    base = rng.normal(72, 8, n)
+    picco = base + rng.normal(22, 10, n)
+    return [riga_risultato((b, p, p - b, t, b + r), dispositivo="bench", timestamp="2026-01-01T00:00:00")
+            for b, p, t, r in zip(base, picco, rng.uniform(5, 40, n), rng.normal(6, 6, n))]
+
+
+def bench_export(dimensioni=(1000, 10000, 100000), formati=(".xlsx", ".csv", ".parquet")):
+    from esportazione import scrivi
+    risultati = []
+    with tempfile.TemporaryDirectory() as cartella:
+        for n in dimensioni:
+            righe = righe_di_prova(n)
+            for est in formati:
+                percorso = os.path.join(cartella, f"export_{n}{est}")
+                t0 = time.perf_counter()
+                try:
+                    scrivi(righe, percorso)
+                except RuntimeError as e:  # dipendenza opzionale mancante (pyarrow)
+                    risultati.append({"formato": est[1:], "righe": n, "errore": str(e)})
+                    continue
+                risultati.append({"formato": est[1:], "righe": n, "secondi": round(time.perf_counter() - t0, 3),
+                                  "byte": os.path.getsize(percorso)})
+    return risultati
+
+
+# ---- valutazione soglie ----
+def bench_soglie(n=50000, valori_per_soglia=5):
+    from valutazione import SOGLIE_PREDEFINITE, esplora_soglie, griglia_intorno, rivaluta_righe, valuta_tabella
+    righe = righe_di_prova(n)
+    t0 = time.perf_counter()
+    valuta_tabella(righe)
+    tabella_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    rivaluta_righe(righe)
+    rivaluta_s = time.perf_counter() - t0
+    colonne = {c: np.array([r[c] for r in righe]) for c in ("baseline", "peak", "dHR", "t_peak_s", "recov60")}
+    passi = {"dhr_min": 2.0, "dhr_max": 5.0, "picco_max": 5.0, "margine_recupero": 2.0}
+    griglia = griglia_intorno(SOGLIE_PREDEFINITE, passi, valori_per_soglia // 2)
+    t0 = time.perf_counter()
+    conteggi = esplora_soglie(colonne, griglia)
+    esplora_s = time.perf_counter() - t0
+    return {"righe": n, "valuta_tabella_ms": round(tabella_s * 1000, 2), "rivaluta_righe_ms": round(rivaluta_s * 1000, 2),
+            "combinazioni": len(conteggi["OK"]), "esplora_ms": round(esplora_s * 1000, 2)}
+
+
+# ---- costo della diagnostica ----
+def bench_diagnostica(n=200000):
+    from diagnostica import Registro
+    from parser_seriale import ERRORI_PARSER
+    r = Registro()
+    c = r.contatore("prova", porta="bench")
+    h = r.istogramma("prova_s", porta="bench")
+    t0 = time.perf_counter()
+    for _ in range(n):
+        c.inc(64)
+    inc_ns = (time.perf_counter() - t0) / n * 1e9
+    t0 = time.perf_counter()
+    for i in range(n):
+        h.osserva(i * 1e-7)
+    osserva_ns = (time.perf_counter() - t0) / n * 1e9
+    # parser con e senza il conteggio degli errori, con il 10% di righe non riconosciute
+    dati = b"".join(b"BPM: 70.0\r\n" if i % 10 else b"DEBUG x\r\n" for i in range(n))
+    tempi = {}
+    for chiave, errori in (("senza", None), ("con", dict.fromkeys(ERRORI_PARSER, 0))):
+        buff, eventi = bytearray(), []
+        t0 = time.perf_counter()
+        for i in range(0, len(dati), 4096):
+            buff.extend(dati[i:i + 4096])
+            eventi.clear()
+            estrai_eventi(buff, eventi, errori=errori)
+        tempi[chiave] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    testo = r.testo_prometheus()
+    return {"inc_ns": round(inc_ns, 1), "osserva_ns": round(osserva_ns, 1),
+            "parser_senza_errori_s": round(tempi["senza"], 4), "parser_con_errori_s": round(tempi["con"], 4),
+            "testo_prometheus_us": round((time.perf_counter() - t0) * 1e6, 1), "byte_testo": len(testo)}
+
+
+# ---- diffusione in rete locale ----
+def bench_diffusione(clienti=8, ritmo=1000, durata=2.0):
+    """Abbonati TCP su localhost, più uno che non legge mai: latenza pubblica→ricezione e scarti."""
+    import socket
+    from diagnostica import Registro
+    from diffusione import Diffusore
+    diff = Diffusore("127.0.0.1", 0, None, registro=Registro())
+    diff.start()
+    connessioni = [socket.create_connection(diff.indirizzi["tcp"]) for _ in range(clienti)]
+    lento = socket.create_connection(diff.indirizzi["tcp"])
+    time.sleep(0.2)
+    latenze, ricevuti = [], [0] * clienti
+
+    def leggi(i, s):
+        for riga in s.makefile("rb"):
+            messaggio = json.loads(riga)
+            if messaggio["tipo"] == "STATUS":
+                return
+            latenze.append((time.perf_counter_ns() - messaggio["valore"]) / 1e9)
+            ricevuti[i] += 1
+
+    lettori = [threading.Thread(target=leggi, args=(i, s), daemon=True) for i, s in enumerate(connessioni)]
+    for t in lettori:
+        t.start()
+    n = int(ritmo * durata)
+    pubblica = []
+    t0 = time.perf_counter()
+    for i in range(n):
+        attesa = t0 + i / ritmo - time.perf_counter()
+        if attesa > 0:
+            time.sleep(attesa)
+        t1 = time.perf_counter()
+        # il campo "t" è arrotondato al ms: l'evento di prova porta l'istante d'invio in ns
+        diff.pubblica("bench", [("BENCH", time.perf_counter_ns())])
+        pubblica.append(time.perf_counter() - t1)
+    diff.pubblica("bench", [("STATUS", "fine")])
+    for t in lettori:
+        t.join(10)
+    diff.ferma()
+    diff.join()
+    lento.close()
+    return {"clienti": clienti, "eventi": n, "ricevuti_min": min(ricevuti), "latenza_ms": percentili_ms(latenze),
+            "pubblica_us": {k: (v * 1000 if v is not None else None) for k, v in percentili_ms(pubblica).items()},
+            "scartati": diff.scartati, "persi_ingresso": diff.persi_ingresso}
+
+
+def versione():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--uscita", help="file JSON dove salvare i risultati")
+    ap.add_argument("--solo", default=",".join(SEZIONI), help="sezioni da eseguire, separate da virgola")
+    ap.add_argument("--righe-export", default="1000,10000,100000")
+    args = ap.parse_args()
+    sezioni = [s for s in args.solo.split(",") if s]
+
+    risultati = {"versione": versione(), "data": datetime.datetime.now().isoformat(timespec="seconds"),
+                 "python": platform.python_version(), "piattaforma": platform.platform()}
+    if "parser" in sezioni:
+        risultati["parser"] = bench_parser()
+    if "pty" in sezioni:
+        risultati["pty"] = bench_pty()
+    if "grafico" in sezioni:
+        risultati["grafico"] = bench_grafico()
+    if "export" in sezioni:
+        risultati["export"] = bench_export(tuple(int(x) for x in args.righe_export.split(",")))
+    if "soglie" in sezioni:
+        risultati["soglie"] = bench_soglie()
+    if "diagnostica" in sezioni:
+        risultati["diagnostica"] = bench_diagnostica()
+    if "diffusione" in sezioni:
+        risultati["diffusione"] = bench_diffusione()
+
+    testo = json.dumps(risultati, indent=2, ensure_ascii=False)
+    print(testo)
+    if args.uscita:
+        with open(args.uscita, "w") as f:
+            f.write(testo + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Confronta il decoder a frame binari con il percorso testuale a regex.
+
+Uso:  python benchmark/bench_protocollo.py [--record 200000] [--blocco 4096]
+
+Genera lo stesso flusso di BPM/METRICS nei due formati, lo passa a estrai_eventi a
+blocchi come farebbe il lettore seriale e stampa i record decodificati al secondo.
+"""
+import argparse, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from parser_seriale import estrai_eventi
+from protocollo_binario import frame_bpm, frame_metriche, frame_ppg, DTYPE_PPG
+
+
+def flusso_testo(n):
+    righe = []
+    for i in range(n):
+        if i % 200 == 199:
+            righe.append(b"METRICS baseline=70.2 peak=95.1 dHR=24.9 tpeak=12.0 recov60=78.3\r\n")
+        else:
+            righe.append(b"BPM: %.1f\r\n" % (60 + (i % 600) / 10))
+    return b"".join(righe)
+
+
+def flusso_binario(n):
+    frame = []
+    for i in range(n):
+        if i % 200 == 199:
+            frame.append(frame_metriche(i * 1000, (70.2, 95.1, 24.9, 12.0, 78.3)))
+        else:
+            frame.append(frame_bpm(i * 1000, 60 + (i % 600) / 10))
+    return b"".join(frame)
+
+
+def flusso_ppg(n, per_blocco=25):
+    campioni = np.zeros(per_blocco, dtype=DTYPE_PPG)
+    campioni["t_ms"] = np.arange(per_blocco) * 20
+    campioni["somma"] = 40000
+    return frame_ppg(0, campioni) * (n // per_blocco)
+
+
+def misura(dati, blocco, campioni=None):
+    buff = bytearray()
+    eventi = []
+    t0 = time.perf_counter()
+    record = 0
+    for i in range(0, len(dati), blocco):
+        buff.extend(dati[i:i + blocco])
+        record += estrai_eventi(buff, eventi, campioni)
+    return record, time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--record", type=int, default=200000)
+    ap.add_argument("--blocco", type=int, default=4096, help="byte per lettura simulata")
+    args = ap.parse_args()
+
+    for nome, dati, camp in (("testo (regex)", flusso_testo(args.record), None),
+                             ("binario (struct)", flusso_binario(args.record), None),
+                             ("binario PPG (numpy)", flusso_ppg(args.record), [])):
+        record, dt = misura(dati, args.blocco, camp)
+        unita = record if camp is None else sum(len(c) for c in camp)
+        print(f"{nome:22s} {len(dati)/1e6:7.2f} MB  {unita:8d} record  {unita/dt:12,.0f} record/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""Contatori e istogrammi della pipeline, con esportazione in formato testo Prometheus.
+
+Pensati per restare sempre attivi: un incremento è una somma su un attributo, un'osservazione
+di istogramma una bisect su pochi limiti fissi, senza lock. Ogni metrica va aggiornata da un
+solo thread (il motore per le letture, il thread Tk per la GUI); chi legge (pannello, endpoint
+HTTP) può vedere somma e conteggio di un istogramma sfasati di un'osservazione, non di più.
+Le misure istantanee (profondità della coda) sono funzioni chiamate solo al momento della lettura.
+
+    python -c "import urllib.request; print(urllib.request.urlopen('http://127.0.0.1:9108/metrics').read().decode())"
+"""
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFISSO = "ky039_"
+PORTA_HTTP = 9108
+
+# limiti superiori dei bucket (Prometheus: le = "minore o uguale")
+LIMITI_DURATA = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+LIMITI_INTERVALLO = (0.1, 0.105, 0.11, 0.125, 0.15, 0.2, 0.3, 0.5, 1.0, 2.0)  # intorno ai 100 ms di leggi_coda
+LIMITI_BYTE = (16, 64, 256, 1024, 4096, 16384, 65536)
+
+
+class Contatore:
+    """Valore che cresce soltanto; con funzione() si legge un contatore già tenuto altrove."""
+
+    def __init__(self, funzione=None):
+        self.funzione = funzione
+        self._valore = 0
+
+    def inc(self, n=1):
+        self._valore += n
+
+    @property
+    def valore(self):
+        return self.funzione() if self.funzione else self._valore
+
+
+class Misura:
+    """Valore istantaneo: impostato con imposta() oppure letto da funzione() al momento della lettura."""
+
+    def __init__(self, funzione=None):
+        self.funzione = funzione
+        self._valore = 0.0
+
+    def imposta(self, v):
+        self._valore = v
+
+    @property
+    def valore(self):
+        return self.funzione() if self.funzione else self._valore
+
+
+class Istogramma:
+    def __init__(self, limiti):
+        self.limiti = tuple(limiti)
+        self.conteggi = [0] * (len(self.limiti) + 1)  # l'ultimo è +Inf
+        self.somma = 0.0
+        self.n = 0
+
+    def osserva(self, v):
+        self.conteggi[bisect_left(self.limiti, v)] += 1
+        self.somma += v
+        self.n += 1
+
+    def quantile(self, q):
+        """Stima del quantile per interpolazione lineare dentro il bucket, come histogram_quantile."""
+        if not self.n:
+            return None
+        obiettivo = q * self.n
+        cumulato = 0
+        for i, c in enumerate(self.conteggi):
+            if cumulato + c >= obiettivo and c:
+                if i == len(self.limiti):
+                    return self.limiti[-1]  # oltre l'ultimo limite non si sa di più
+                basso = self.limiti[i - 1] if i else 0.0
+                return basso + (self.limiti[i] - basso) * (obiettivo - cumulato) / c
+            cumulato += c
+        return self.limiti[-1]
+
+    def media(self):
+        return self.somma / self.n if self.n else None
+
+
+class _Famiglia:
+    def __init__(self, tipo, aiuto):
+        self.tipo = tipo
+        self.aiuto = aiuto
+        self.serie = {}  # tupla ordinata di (etichetta, valore) -> metrica
+
+
+class Registro:
+    """Insieme delle metriche; contatore/misura/istogramma restituiscono quella esistente se c'è già."""
+
+    def __init__(self, prefisso=PREFISSO):
+        self.prefisso = prefisso
+        self._famiglie = {}
+        self._lock = threading.Lock()  # solo per creazione e lettura dell'elenco, non per gli aggiornamenti
+
+    def _metrica(self, tipo, nome, aiuto, etichette, crea):
+        chiave = tuple(sorted(etichette.items()))
+        with self._lock:
+            famiglia = self._famiglie.get(nome)
+            if famiglia is None:
+                famiglia = self._famiglie[nome] = _Famiglia(tipo, aiuto)
+            elif famiglia.tipo != tipo:
+                raise ValueError(f"metrica {nome!r} già registrata come {famiglia.tipo}")
+            metrica = famiglia.serie.get(chiave)
+            if metrica is None:
+                metrica = famiglia.serie[chiave] = crea()
+            return metrica
+
+    def contatore(self, nome, aiuto="", funzione=None, **etichette):
+        c = self._metrica("counter", nome, aiuto, etichette, Contatore)
+        if funzione is not None:
+            c.funzione = funzione
+        return c
+
+    def istogramma(self, nome, aiuto="", limiti=LIMITI_DURATA, **etichette):
+        return self._metrica("histogram", nome, aiuto, etichette, lambda: Istogramma(limiti))
+
+    def misura(self, nome, aiuto="", funzione=None, **etichette):
+        m = self._metrica("gauge", nome, aiuto, etichette, Misura)
+        if funzione is not None:
+            m.funzione = funzione
+        return m
+
+    def elementi(self):
+        """Elenco di (nome, tipo, etichette dict, metrica), ordinato per nome."""
+        with self._lock:
+            famiglie = [(n, f.tipo, list(f.serie.items())) for n, f in sorted(self._famiglie.items())]
+        return [(n, tipo, dict(chiave), m) for n, tipo, serie in famiglie for chiave, m in serie]
+
+    def testo_prometheus(self):
+        righe = []
+        with self._lock:
+            famiglie = [(n, f.tipo, f.aiuto, list(f.serie.items())) for n, f in sorted(self._famiglie.items())]
+        for nome, tipo, aiuto, serie in famiglie:
+            nome = self.prefisso + nome + ("_total" if tipo == "counter" else "")
+            righe.append(f"# HELP {nome} {aiuto}")
+            righe.append(f"# TYPE {nome} {tipo}")
+            for chiave, m in serie:
+                if tipo != "histogram":
+                    righe.append(f"{nome}{_etichette(chiave)} {_numero(m.valore)}")
+                    continue
+                cumulato = 0
+                conteggi = list(m.conteggi)
+                for limite, c in zip(m.limiti + (float("inf"),), conteggi):
+                    cumulato += c
+                    le = "+Inf" if limite == float("inf") else _numero(limite)
+                    righe.append(f"{nome}_bucket{_etichette(chiave + (('le', le),))} {cumulato}")
+                righe.append(f"{nome}_sum{_etichette(chiave)} {_numero(m.somma)}")
+                righe.append(f"{nome}_count{_etichette(chiave)} {cumulato}")
+        return "\n".join(righe) + "\n"
+
+
+def _etichette(chiave):
+    if not chiave:
+        return ""
+    parti = (f'{k}="{_escape(str(v))}"' for k, v in chiave)
+    return "{" + ",".join(parti) + "}"
+
+
+def _escape(v):
+    return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _numero(v):
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+REGISTRO = Registro()  # registro di processo usato da motore e GUI
+
+
+class ServerMetriche:
+    """Endpoint HTTP locale: GET /metrics restituisce il testo Prometheus del registro."""
+
+    def __init__(self, registro=REGISTRO, porta=PORTA_HTTP, host="127.0.0.1"):
+        class Gestore(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                corpo = registro.testo_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(corpo)))
+                self.end_headers()
+                self.wfile.write(corpo)
+
+            def log_message(self, *args):  # niente log su stderr per ogni richiesta
+                pass
+
+        self._server = ThreadingHTTPServer((host, porta), Gestore)
+        self._server.daemon_threads = True
+        self.indirizzo = self._server.server_address
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def chiudi(self):
+        self._server.shutdown()
+        self._server.server_close()
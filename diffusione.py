@@ -0,0 +1,289 @@
+"""Diffusione in rete locale degli eventi in diretta (BPM, ACK, METRICS, BATTITO, stato) a molti abbonati.
+
+Due porte: TCP semplice (una riga JSON per evento) e WebSocket (un frame di testo per evento,
+per i cruscotti nel browser). Esempio di messaggio:
+
+    {"porta": "/dev/ttyUSB0", "tipo": "BPM", "valore": 72.4, "t": 1760000000.123}
+
+pubblica() si limita ad accodare gli eventi: non fa I/O e non blocca mai il thread di
+acquisizione. Un thread con un selettore codifica ogni evento una volta sola (riga JSON e
+frame WebSocket) e mette lo stesso oggetto bytes nella coda di uscita di ogni client. Le code
+sono limitate: se un client non legge, i messaggi più vecchi non ancora iniziati vengono
+scartati (quello in corso d'invio viene completato, così lo stream resta valido).
+
+Ascolto da terminale:  python diffusione.py --host 127.0.0.1 --porta 9109
+"""
+import argparse, base64, hashlib, json, selectors, socket, struct, sys, threading, time
+from collections import deque
+
+from diagnostica import REGISTRO
+
+PORTA_TCP = 9109
+PORTA_WS = 9110
+CAPACITA_CLIENTE = 1024   # messaggi in attesa per client prima di scartare i più vecchi
+CAPACITA_INGRESSO = 8192  # eventi pubblicati non ancora distribuiti
+BLOCCO_INVIO = 64         # messaggi distribuiti tra due tentativi di invio
+GUID_WS = b"258EAFA5-E914-47DA-95CA-C5AB0DC11B65"
+METRICHE = ("baseline", "peak", "dHR", "t_peak_s", "recov60")
+CAMPI_BATTITO = ("t_ms", "ibi_ms", "bpm")  # battiti rilevati sull'host dai campioni grezzi
+
+
+def codifica_evento(porta, typ, payload, t):
+    """Riga JSON (senza terminatore) di un evento, come bytes."""
+    if typ == "METRICS":
+        valore = dict(zip(METRICHE, payload))
+    elif typ == "BATTITO":
+        valore = dict(zip(CAMPI_BATTITO, payload))
+    else:
+        valore = payload
+    return json.dumps({"porta": porta, "tipo": typ, "valore": valore, "t": round(t, 3)},
+                      ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def frame_websocket(dati, opcode=0x1):
+    n = len(dati)
+    if n < 126:
+        testa = struct.pack("!BB", 0x80 | opcode, n)
+    elif n < 65536:
+        testa = struct.pack("!BBH", 0x80 | opcode, 126, n)
+    else:
+        testa = struct.pack("!BBQ", 0x80 | opcode, 127, n)
+    return testa + dati
+
+
+class _Cliente:
+    def __init__(self, sock, websocket, capacita):
+        self.sock = sock
+        self.websocket = websocket
+        self.pronto = not websocket  # i WebSocket ricevono dopo l'handshake
+        self.ingresso = bytearray()
+        self.uscita = deque()
+        self.capacita = capacita
+        self.corrente = None  # memoryview del messaggio in invio
+        self.scartati = 0
+        self.in_scrittura = False
+
+    def accoda(self, messaggio):
+        """Aggiunge il messaggio; restituisce 1 se per fargli posto è stato scartato il più vecchio."""
+        self.uscita.append(messaggio)
+        if len(self.uscita) > self.capacita:
+            self.uscita.popleft()
+            self.scartati += 1
+            return 1
+        return 0
+
+
+class Diffusore(threading.Thread):
+    """Server TCP/WebSocket che inoltra gli eventi pubblicati a tutti i client collegati."""
+
+    def __init__(self, host="127.0.0.1", porta_tcp=PORTA_TCP, porta_ws=PORTA_WS,
+                 capacita_cliente=CAPACITA_CLIENTE, registro=REGISTRO):
+        super().__init__(daemon=True)
+        self.capacita_cliente = capacita_cliente
+        self._selettore = selectors.DefaultSelector()
+        self._ascolto = []
+        self.indirizzi = {}
+        for tipo, porta in (("tcp", porta_tcp), ("ws", porta_ws)):
+            if porta is None:
+                continue
+            s = socket.create_server((host, porta))
+            s.setblocking(False)
+            self._selettore.register(s, selectors.EVENT_READ, tipo)
+            self._ascolto.append(s)
+            self.indirizzi[tipo] = s.getsockname()[:2]
+        self._sveglia_r, self._sveglia_w = socket.socketpair()
+        self._sveglia_r.setblocking(False)
+        self._sveglia_w.setblocking(False)
+        self._selettore.register(self._sveglia_r, selectors.EVENT_READ, None)
+        self._in_arrivo = deque(maxlen=CAPACITA_INGRESSO)  # (porta, typ, payload, t), scritta da altri thread
+        self._svegliato = False
+        self._ferma = False
+        self.clienti = set()
+        self.pubblicati = 0
+        self.persi_ingresso = 0  # eventi persi perché il thread di invio era indietro
+        self.scartati = 0        # messaggi scartati dalle code dei client lenti
+        registro.misura("diffusione_clienti", "abbonati collegati", funzione=lambda: len(self.clienti))
+        registro.contatore("diffusione_pubblicati", "eventi pubblicati", funzione=lambda: self.pubblicati)
+        registro.contatore("diffusione_persi_ingresso", "eventi persi prima della distribuzione",
+                           funzione=lambda: self.persi_ingresso)
+        registro.contatore("diffusione_scartati", "messaggi scartati per client lenti", funzione=lambda: self.scartati)
+
+    # ---- API thread-safe ----
+    def pubblica(self, porta, eventi):
+        """Accoda eventi (typ, payload) di una porta; costa un append per evento."""
+        t = time.time()
+        for typ, payload in eventi:
+            if len(self._in_arrivo) == self._in_arrivo.maxlen:
+                self.persi_ingresso += 1
+            self._in_arrivo.append((porta, typ, payload, t))
+        self.pubblicati += len(eventi)
+        if not self._svegliato:  # una sola scrittura sul socketpair finché il thread non si sveglia
+            self._svegliato = True
+            try:
+                self._sveglia_w.send(b"\0")
+            except OSError:
+                pass
+
+    def ferma(self):
+        self._ferma = True
+        try:
+            self._sveglia_w.send(b"\0")
+        except OSError:
+            pass
+
+    # ---- ciclo ----
+    def run(self):
+        while not self._ferma:
+            for chiave, maschera in self._selettore.select(timeout=1.0):
+                dato = chiave.data
+                if dato is None:
+                    try:
+                        while self._sveglia_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                elif dato in ("tcp", "ws"):
+                    self._accetta(chiave.fileobj, dato == "ws")
+                else:
+                    if maschera & selectors.EVENT_READ:
+                        self._leggi(dato)
+                    if maschera & selectors.EVENT_WRITE and dato in self.clienti:
+                        self._scrivi(dato)
+            self._distribuisci()
+        for cliente in list(self.clienti):
+            self._chiudi(cliente)
+        for s in self._ascolto:
+            s.close()
+        self._selettore.close()
+        self._sveglia_r.close()
+        self._sveglia_w.close()
+
+    def _accetta(self, ascolto, websocket):
+        try:
+            sock, _ = ascolto.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        cliente = _Cliente(sock, websocket, self.capacita_cliente)
+        self.clienti.add(cliente)
+        self._selettore.register(sock, selectors.EVENT_READ, cliente)
+
+    def _leggi(self, cliente):
+        try:
+            dati = cliente.sock.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            dati = b""
+        if not dati:
+            self._chiudi(cliente)
+            return
+        if not cliente.websocket:
+            return  # il client TCP non ha niente da dire: si ignora
+        if cliente.pronto:
+            if dati[0] & 0x0F == 0x8:  # frame di chiusura: si chiude senza altre cerimonie
+                self._chiudi(cliente)
+            return  # ping e testo dal browser non servono
+        cliente.ingresso.extend(dati)
+        if b"\r\n\r\n" in cliente.ingresso:
+            self._handshake(cliente)
+        elif len(cliente.ingresso) > 8192:
+            self._chiudi(cliente)
+
+    def _handshake(self, cliente):
+        chiave = None
+        for riga in bytes(cliente.ingresso).split(b"\r\n")[1:]:
+            nome, _, valore = riga.partition(b":")
+            if nome.strip().lower() == b"sec-websocket-key":
+                chiave = valore.strip()
+        if chiave is None:
+            cliente.sock.send(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+            self._chiudi(cliente)
+            return
+        accetta = base64.b64encode(hashlib.sha1(chiave + GUID_WS).digest())
+        # come messaggio in corso, non in coda: lo scarto dei più vecchi non può toglierlo
+        cliente.corrente = memoryview(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                                      b"Connection: Upgrade\r\nSec-WebSocket-Accept: " + accetta + b"\r\n\r\n")
+        cliente.ingresso.clear()
+        cliente.pronto = True
+        self._scrivi(cliente)
+
+    def _distribuisci(self):
+        self._svegliato = False
+        if not self._in_arrivo:
+            return
+        pronti = [c for c in self.clienti if c.pronto]
+        tcp = [c for c in pronti if not c.websocket]
+        ws = [c for c in pronti if c.websocket]
+        n = 0
+        while self._in_arrivo:
+            porta, typ, payload, t = self._in_arrivo.popleft()
+            if not pronti:
+                continue
+            n += 1
+            if n % BLOCCO_INVIO == 0:  # durante una raffica si svuotano le code a blocchi, non solo alla fine
+                for c in pronti:
+                    if c.uscita and not c.in_scrittura and c in self.clienti:
+                        self._scrivi(c)
+            riga = codifica_evento(porta, typ, payload, t)  # una codifica per evento, condivisa
+            if tcp:
+                messaggio = riga + b"\n"
+                for c in tcp:
+                    self.scartati += c.accoda(messaggio)
+            if ws:
+                messaggio = frame_websocket(riga)
+                for c in ws:
+                    self.scartati += c.accoda(messaggio)
+        for c in pronti:
+            if c.uscita and not c.in_scrittura and c in self.clienti:
+                self._scrivi(c)
+
+    def _scrivi(self, cliente):
+        sock = cliente.sock
+        try:
+            while True:
+                if cliente.corrente is None:
+                    if not cliente.uscita:
+                        break
+                    cliente.corrente = memoryview(cliente.uscita.popleft())
+                inviati = sock.send(cliente.corrente)
+                cliente.corrente = cliente.corrente[inviati:] if inviati < len(cliente.corrente) else None
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._chiudi(cliente)
+            return
+        occupato = cliente.corrente is not None or bool(cliente.uscita)
+        if occupato != cliente.in_scrittura:  # EVENT_WRITE solo finché c'è qualcosa in sospeso
+            cliente.in_scrittura = occupato
+            eventi = selectors.EVENT_READ | (selectors.EVENT_WRITE if occupato else 0)
+            self._selettore.modify(sock, eventi, cliente)
+
+    def _chiudi(self, cliente):
+        if cliente not in self.clienti:
+            return
+        self.clienti.discard(cliente)
+        try:
+            self._selettore.unregister(cliente.sock)
+        except (KeyError, ValueError):
+            pass
+        cliente.sock.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Abbonato TCP: stampa gli eventi diffusi da GUI o monitor.py")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--porta", type=int, default=PORTA_TCP)
+    args = ap.parse_args()
+    with socket.create_connection((args.host, args.porta)) as s, s.makefile("rb") as f:
+        try:
+            for riga in f:
+                sys.stdout.write(riga.decode(errors="replace"))
+                sys.stdout.flush()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
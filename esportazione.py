@@ -0,0 +1,136 @@
+"""Scrittura delle righe risultato su file (Excel, CSV, Parquet) in streaming.
+
+Ogni funzione accetta un iterabile di righe (dizionari con COLONNE_RISULTATI) e le scrive
+una alla volta, quindi funziona anche con un generatore che legge le sessioni registrate
+senza costruire prima la lista completa. progresso(n), se fornita, viene chiamata ogni
+BLOCCO_PROGRESSO righe con il numero di righe già scritte.
+"""
+import csv, datetime, os
+
+from valutazione import COLONNE_RISULTATI, riga_risultato
+from sessione import LettoreSessione, eventi_da_record
+
+BLOCCO_PROGRESSO = 1000
+METRICHE = ("baseline", "peak", "dHR", "t_peak_s", "recov60")
+# colonne float64 nel Parquet (le altre sono stringhe): metriche del dispositivo, quelle ricalcolate
+# sull'host e i conteggi della rianalisi; valori vuoti o non numerici diventano null
+NUMERICHE = frozenset(METRICHE + tuple(f"host_{m}" for m in METRICHE)
+                      + ("test", "n_bpm", "bpm_medio", "n_battiti_ppg"))
+FORMATI = {".xlsx": "Excel", ".csv": "CSV", ".parquet": "Parquet"}
+
+
+def _valori(riga, colonne):
+    return [riga.get(c, "") for c in colonne]
+
+
+def scrivi_excel(righe, nomefile, progresso=None, colonne=COLONNE_RISULTATI):
+    # writer in sola scrittura: memoria costante, le righe vanno su disco man mano
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.formatting.rule import FormulaRule
+    from openpyxl.styles import Font, PatternFill
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Risultati")
+    grassetto = Font(bold=True)  # uno stile condiviso, non uno per cella
+    intestazione = []
+    for nome in colonne:
+        cella = WriteOnlyCell(ws, value=nome)
+        cella.font = grassetto
+        intestazione.append(cella)
+    ws.append(intestazione)
+
+    n = 0
+    for riga in righe:
+        ws.append(_valori(riga, colonne))
+        n += 1
+        if progresso and n % BLOCCO_PROGRESSO == 0:
+            progresso(n)
+
+    # colori delle righe con due regole di formattazione condizionale sulla colonna "esito"
+    if n and "esito" in colonne:
+        col_esito = get_column_letter(colonne.index("esito") + 1)
+        area = f"A2:{get_column_letter(len(colonne))}{n + 1}"
+        verde = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
+        rosso = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
+        ws.conditional_formatting.add(area, FormulaRule(formula=[f'${col_esito}2="OK"'], fill=verde))
+        ws.conditional_formatting.add(area, FormulaRule(formula=[f'${col_esito}2<>"OK"'], fill=rosso))
+    wb.save(nomefile)
+    return n
+
+
+def scrivi_csv(righe, nomefile, progresso=None, colonne=COLONNE_RISULTATI):
+    n = 0
+    with open(nomefile, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(colonne)
+        for riga in righe:
+            w.writerow(_valori(riga, colonne))
+            n += 1
+            if progresso and n % BLOCCO_PROGRESSO == 0:
+                progresso(n)
+    return n
+
+
+def scrivi_parquet(righe, nomefile, progresso=None, colonne=COLONNE_RISULTATI, blocco=10000):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("l'export Parquet richiede il pacchetto pyarrow")
+    # tipi dichiarati, non dedotti dalla prima riga: le colonne host_* sono spesso vuote all'inizio
+    numeriche = NUMERICHE.intersection(colonne)
+    schema = pa.schema([(c, pa.float64() if c in numeriche else pa.string()) for c in colonne])
+    n = 0
+    valori = {c: [] for c in colonne}
+    with pq.ParquetWriter(nomefile, schema) as writer:
+        def scarica():
+            writer.write_batch(pa.record_batch([valori[c] for c in colonne], schema=schema))
+            for lista in valori.values():
+                lista.clear()
+        for riga in righe:
+            for c in colonne:
+                v = riga.get(c)
+                if c in numeriche:
+                    v = v if isinstance(v, (int, float)) else None
+                elif v is not None:
+                    v = str(v)
+                valori[c].append(v)
+            n += 1
+            if n % blocco == 0:
+                scarica()
+            if progresso and n % BLOCCO_PROGRESSO == 0:
+                progresso(n)
+        if n % blocco:
+            scarica()
+    return n
+
+
+SCRITTORI = {".xlsx": scrivi_excel, ".csv": scrivi_csv, ".parquet": scrivi_parquet}
+
+
+def scrivi(righe, nomefile, progresso=None, colonne=COLONNE_RISULTATI):
+    """Sceglie il formato dall'estensione del file."""
+    est = os.path.splitext(nomefile)[1].lower()
+    if est not in SCRITTORI:
+        raise ValueError(f"formato non supportato: {est or nomefile}")
+    return SCRITTORI[est](righe, nomefile, progresso, colonne=colonne)
+
+
+def righe_da_sessioni(percorsi, soglie=None):
+    """Genera le righe risultato leggendo in streaming i METRICS delle sessioni registrate."""
+    for percorso in percorsi:
+        lettore = LettoreSessione(percorso)
+        nome = os.path.basename(percorso)
+        try:
+            eventi = []
+            for tipo, _t_mono, t_wall, payload in lettore:
+                eventi_da_record(tipo, payload, eventi)
+                for typ, metriche in eventi:
+                    if typ == "METRICS":
+                        ts = datetime.datetime.fromtimestamp(t_wall).isoformat(timespec="seconds")
+                        yield riga_risultato(metriche, dispositivo=nome, timestamp=ts, soglie=soglie)
+                eventi.clear()
+        finally:
+            lettore.chiudi()
@@ -0,0 +1,157 @@
+"""Grafico BPM sull'orario dell'host, ridisegnato solo quando arrivano dati nuovi, con blitting.
+
+I dati vengono da una SerieTemporale: dal vivo si seguono gli ultimi FINESTRA_DAL_VIVO secondi,
+e l'asse scorre a scatti di un quarto di finestra (un disegno completo ogni tanto, blitting
+per il resto). Con la barra di navigazione di Matplotlib si può spostare e zoomare su tutta
+la storia: a ogni cambio dei limiti si prende dalla serie il livello adatto allo zoom, con la
+fascia minimo–massimo quando i punti sono riassunti.
+"""
+import time
+from collections import deque
+
+import numpy as np
+from matplotlib.patches import Polygon
+from matplotlib.ticker import FuncFormatter
+
+from serie_temporale import SerieTemporale
+
+FINESTRA_DAL_VIVO = 300.0  # secondi visibili mentre si seguono i dati in arrivo
+MARGINE_Y = 10             # bpm di margine sopra e sotto i dati quando si riscala
+
+
+def _etichetta_ora(x, _pos=None):
+    lt = time.localtime(x)
+    return time.strftime("%H:%M:%S" if lt.tm_sec else "%H:%M", lt)
+
+
+class GraficoBPM:
+    def __init__(self, figura, assi, tela, serie=None, finestra=FINESTRA_DAL_VIVO):
+        self.figura, self.assi, self.tela = figura, assi, tela
+        self.serie = serie if serie is not None else SerieTemporale()  # può esistere già prima del grafico
+        self.finestra = finestra
+        self.linea, = assi.plot([], [], animated=True)  # disegnate a parte con il blitting
+        self.fascia = Polygon([[0, 0]], closed=True, animated=True, visible=False, linewidth=0,
+                              alpha=0.25, facecolor=self.linea.get_color())  # minimo–massimo dei livelli ridotti
+        assi.add_patch(self.fascia)
+        assi.xaxis.set_major_formatter(FuncFormatter(_etichetta_ora))
+        adesso = time.time()
+        assi.set_xlim(adesso - 0.75 * finestra, adesso + 0.25 * finestra)
+        assi.set_ylim(50, 110)
+        self.dal_vivo = True    # False quando l'utente sposta o zooma l'asse dei tempi
+        self.livello = 0        # livello della serie mostrato (0 = valori grezzi)
+        self._sfondo = None
+        self._versione_disegnata = -1
+        self._limiti_nostri = False
+        tela.mpl_connect("draw_event", self._su_draw)
+        assi.callbacks.connect("xlim_changed", self._su_limiti)
+        # contatori dei frame
+        self.tempi_frame = deque(maxlen=200)  # durata degli ultimi frame disegnati (s)
+        self.frame_disegnati = 0
+        self.frame_saltati = 0      # tick senza dati nuovi
+        self.ridisegni_completi = 0  # frame che hanno cambiato i limiti degli assi
+
+    def _su_draw(self, _evento):
+        # dopo ogni disegno completo salva lo sfondo (senza la linea) e ci ridisegna la linea
+        self._sfondo = self.tela.copy_from_bbox(self.assi.bbox)
+        self.assi.draw_artist(self.fascia)
+        self.assi.draw_artist(self.linea)
+
+    def _su_limiti(self, _assi):
+        # pan/zoom dalla barra di navigazione: si smette di seguire e si ricarica il livello giusto
+        if self._limiti_nostri:
+            return
+        self.dal_vivo = False
+        self._carica()
+
+    def _imposta_xlim(self, x0, x1):
+        self._limiti_nostri = True
+        try:
+            self.assi.set_xlim(x0, x1)
+        finally:
+            self._limiti_nostri = False
+
+    def segui(self):
+        """Torna a seguire i dati in arrivo."""
+        self.dal_vivo = True
+        self._versione_disegnata = -1
+        if self.serie.t_ultimo is not None:
+            t = self.serie.t_ultimo
+            self._imposta_xlim(t - 0.75 * self.finestra, t + 0.25 * self.finestra)
+            self._carica()
+            self.tela.draw_idle()
+
+    def imposta_serie(self, serie):
+        """Mostra un'altra serie (cambio di stazione) e torna dal vivo."""
+        self.serie = serie
+        self.segui()
+
+    def _carica(self):
+        """Prende dalla serie i punti dei limiti correnti, al massimo circa due per pixel."""
+        x0, x1 = self.assi.get_xlim()
+        punti = max(200, 2 * int(self.assi.bbox.width))
+        t, minimo, massimo, media, self.livello = self.serie.finestra(x0, x1, punti)
+        self.linea.set_data(t, media)
+        if self.livello and len(t):
+            self.fascia.set_xy(np.column_stack((np.concatenate((t, t[::-1])),
+                                                np.concatenate((massimo, minimo[::-1])))))
+            self.fascia.set_visible(True)
+        else:
+            self.fascia.set_visible(False)
+        return minimo, massimo
+
+    def _riscala_se_serve(self):
+        cambiato = False
+        t = self.serie.t_ultimo
+        x0, x1 = self.assi.get_xlim()
+        if t is not None and (t > x1 or t < x0):
+            # l'asse avanza di un quarto di finestra alla volta (l'ultimo punto torna a tre quarti), non a ogni punto
+            self._imposta_xlim(t - 0.75 * self.finestra, t + 0.25 * self.finestra)
+            cambiato = True
+        minimo, massimo = self._carica()
+        y0, y1 = self.assi.get_ylim()
+        if len(minimo) and (minimo.min() < y0 or massimo.max() > y1):
+            # margine largo così piccole oscillazioni non costringono a un nuovo disegno completo
+            ymin = max(30, int(minimo.min()) - MARGINE_Y)
+            ymax = min(200, int(massimo.max()) + MARGINE_Y)
+            if ymin >= ymax: ymax = ymin + 5
+            self.assi.set_ylim(ymin, ymax)
+            cambiato = True
+        return cambiato
+
+    def aggiorna(self):
+        """Ridisegna se ci sono campioni nuovi; restituisce True se ha disegnato."""
+        if self.serie.versione == self._versione_disegnata:
+            self.frame_saltati += 1
+            return False
+        t0 = time.perf_counter()
+        self._versione_disegnata = self.serie.versione
+        if self.dal_vivo:
+            cambiato = self._riscala_se_serve()
+        else:  # si guarda la storia: i limiti sono dell'utente, si aggiornano solo i dati
+            self._carica()
+            cambiato = False
+        if cambiato or self._sfondo is None:
+            self.tela.draw()  # disegno completo: _su_draw aggiorna lo sfondo
+            self.ridisegni_completi += 1
+        else:
+            self.tela.restore_region(self._sfondo)
+            self.assi.draw_artist(self.fascia)
+            self.assi.draw_artist(self.linea)
+            self.tela.blit(self.assi.bbox)
+        self.tempi_frame.append(time.perf_counter() - t0)
+        self.frame_disegnati += 1
+        return True
+
+    def tempo_medio_ms(self):
+        return 1000 * sum(self.tempi_frame) / len(self.tempi_frame) if self.tempi_frame else 0.0
+
+    def salva(self, path, **kwargs):
+        # savefig non disegna gli artisti animati: linea e fascia tornano normali per il salvataggio
+        for artista in (self.linea, self.fascia):
+            artista.set_animated(False)
+        try:
+            self.figura.savefig(path, **kwargs)
+        finally:
+            for artista in (self.linea, self.fascia):
+                artista.set_animated(True)
+            self.tela.draw()
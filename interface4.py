@@ -1,81 +1,34 @@
-import threading, time, re, queue, sys, os, datetime
-from collections import deque
+import threading, time, sys, os, datetime
 
 import tkinter as tk   
 from tkinter import ttk, messagebox, filedialog
 
-import serial
 import serial.tools.list_ports as lp
 
-import matplotlib
-matplotlib.use("TkAgg")
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from matplotlib.figure import Figure
-
-import pandas as pd  # per export Excel
+from parser_seriale import analizza_riga
+from motore_acquisizione import MotoreAcquisizione
+from valutazione import SOGLIE_PREDEFINITE, valuta, interpretazione, rivaluta_righe, valuta_tabella, esplora_soglie, griglia_intorno, soglie_complete
+from serie_temporale import SerieTemporale
+from esportazione import scrivi, righe_da_sessioni
+from metriche import PROTOCOLLI, PROTOCOLLO_30_30_120, carica_protocollo
+from sessione import LettoreSessione, RiproduzioneSessione, eventi_da_record, ESTENSIONE
+from diagnostica import REGISTRO, ServerMetriche, LIMITI_INTERVALLO
+from diffusione import Diffusore
 
 # ================== CONFIG BASE ==================
 BAUD_PREDEFINITO = 115200
 SUGGERIMENTI_PORTA_AUTO = ("usbmodem", "usbserial", "wch", "ch340")
-PUNTI_MASSIMI = 300  # punti nel grafico
-# Regex per il protocollo che usa il firmware Arduino
-REGEX_RIGA_BPM = re.compile(r"^\s*BPM:\s*([0-9]+(?:\.[0-9]+)?)")
-REGEX_METRICHE  = re.compile(r"METRICS\s+baseline=([0-9.]+)\s+peak=([0-9.]+)\s+dHR=([0-9.]+)\s+tpeak=([0-9.]+)\s+recov60=([0-9.]+)")
-
-# ================== THREAD LETTURA SERIALE ==================
-class SerialReader(threading.Thread):
-    def __init__(self, porta, baud, coda_uscita, su_errore):
-        super().__init__(daemon=True) 
-        #il thread daemon non impedisce al programma di chiudersi- se chiudo l'interfaccai si chiude anche il lettore seriale
-        self.porta = porta   # salvo sulla ISTANZA la porta seriale
-        self.baud = baud  # salvo il baud rate
-        self.coda_uscita = coda_uscita # coda thread-safe per comunicare con la GUI
-        self.su_errore = su_errore # funzione/callback per mostrare errori
-        self._ferma = False # flag interno per fermare il thread 
-        self.seriale = None # qui salverai l’oggetto serial.Serial quando lo apri
-
-    def ferma(self):        #serve per fermare la lettura seriale
-        self._ferma = True
-        try:
-            if self.seriale and self.seriale.is_open:
-                self.seriale.close()
-        except Exception:
-            pass
-
-    def esegui(self):  #ciclo usato per leggere la porta seriale
-        try:
-            self.seriale = serial.Serial(self.porta, self.baud, timeout=1) #apre la porta seriale 
-            time.sleep(2)  # e conta fino a due per il reset di ESP32
-            self.coda_uscita.put(("STATUS", f"Connesso a {self.porta} @ {self.baud}")) #messaggio ceh verrà mostrato
-        except Exception as e:
-            self.su_errore(f"Errore apertura seriale: {e}") #messaggio se non si connette
-            return
-
-        buff = bytearray()
-        while not self._ferma: #il ciclo gira finche stop vine messo true da stop()
-            try:
-                blocco = self.seriale.read(256) #legge fino a 256 byte del seriale,se non arriva nulla ricomincia altrimenti salva in buffer
-                if not blocco:
-                    continue
-                buff.extend(blocco)
-                while b"\n" in buff:
-                    linea, _, buff = buff.partition(b"\n") #legge la linea, mette il separatore e lascia lo spazio libero dopo ancora da processare 
-                    try:
-                        s = linea.decode(errors="ignore").strip() # .decode trasforma i byte in stringa e .strip toglie gli spazi
-                        self.coda_uscita.put(("LINE", s)) #imvia la riga all'interfacca in modo ripulito dagli spazi
-                    except Exception:
-                        pass
-            except Exception as e:
-                self.su_errore(f"Errore lettura seriale: {e}")
-                break
-
-    # Thread.start() chiama run(): lo manteniamo e deleghiamo a esegui()
-    def run(self):
-        self.esegui()
+CARTELLA_SESSIONI = os.path.join(os.path.expanduser("~"), "KY039_sessioni") # ogni porta collegata registra qui la sua sessione
+INTERVALLO_FSYNC = 1.0  # secondi tra due scritture su disco della sessione
+PORTA_METRICHE = 9108  # endpoint Prometheus su 127.0.0.1 (None per disattivarlo)
+DIFFUSIONE_ATTIVA = False  # eventi in diretta (dati del paziente) ad altri programmi: solo su richiesta, anche con --diffusione
+HOST_DIFFUSIONE = "127.0.0.1"  # solo questo PC; "0.0.0.0" per i cruscotti in rete locale (nessuna autenticazione)
+PORTE_DIFFUSIONE = (9109, 9110)  # TCP (righe JSON) e WebSocket
+PASSI_ESPLORAZIONE = {"dhr_min": 2.0, "dhr_max": 5.0, "picco_max": 5.0, "margine_recupero": 2.0} # passo della griglia intorno alle soglie del pannello
 
 # ================== APP TKINTER ==================
 class App(tk.Tk): #crea l'oggetto della finistra principale
-    def __init__(self): #la inizializza con titolo,dimensione e colore
+    def __init__(self, diffusione=DIFFUSIONE_ATTIVA): #la inizializza con titolo,dimensione e colore
         super().__init__()
         self.title("Arduino Heart Monitor-v3")
         self.geometry("1000x700")
@@ -93,29 +46,40 @@ class App(tk.Tk): #crea l'oggetto della finistra principale
         ttk.Button(top, text="Refresh", command=self.aggiorna_porte).pack(side="left", padx=(8,0))
         ttk.Button(top, text="Connetti", command=self.connetti).pack(side="left", padx=6) #chiama self.connect() che crea e avvia il thread 
         ttk.Button(top, text="Disconnetti", command=self.disconnetti).pack(side="left") #chiama self.disconnect() che ferma il thread e chiude porta
+        ttk.Label(top, text="Dispositivo:").pack(side="left", padx=(12,2))
+        self.combo_dispositivo = ttk.Combobox(top, width=22, state="readonly") #stazioni collegate, la vista mostra quella scelta
+        self.combo_dispositivo.pack(side="left")
+        self.combo_dispositivo.bind("<<ComboboxSelected>>", lambda _e: self.seleziona_dispositivo(
+            list(self.motore.dispositivi)[self.combo_dispositivo.current()])) #la voce può avere il segno di un risultato
         self.stato = tk.StringVar(value="Non connesso")
         ttk.Label(top, textvariable=self.stato).pack(side="right") # etichetta che visualizza il valore del self status
         controlli = ttk.Frame(self); controlli.pack(fill="x", padx=10, pady=6)
+        self.protocolli = dict(PROTOCOLLI) #nome -> definizione, si possono aggiungere da file
         self.var_bpm = tk.StringVar(value="--") # Variabile Tk che conterrà il BPM corrente 
         ttk.Label(controlli, textvariable=self.var_bpm, font=("Helvetica", 40)).pack(side="left") #Etichetta grande (font 40 pt) che mostra i BPM
         barra_strumenti = ttk.Frame(controlli); barra_strumenti.pack(side="right") #frame sulla destra che conterrà i pulsanti.
-        ttk.Button(barra_strumenti, text="Protocollo 30–30–120",command=self.esegui_protocollo).pack(side="left", padx=6) #Avvia la sequenza 
+        self.var_protocollo = tk.StringVar(value=PROTOCOLLO_30_30_120["nome"])
+        self.combo_protocollo = ttk.Combobox(barra_strumenti, width=14, state="readonly",
+                                             values=list(self.protocolli), textvariable=self.var_protocollo) #protocolli disponibili
+        self.combo_protocollo.pack(side="left")
+        ttk.Button(barra_strumenti, text="Avvia protocollo",command=self.esegui_protocollo).pack(side="left", padx=6) #Avvia la sequenza 
         ttk.Button(barra_strumenti, text="Start (Baseline)",
                    command=lambda: self.invia_comando("CMD:START")).pack(side="left", padx=6) #Manda manualmente il comando START al device 
         ttk.Button(barra_strumenti, text="Stand",
                    command=lambda: self.invia_comando("CMD:STAND")).pack(side="left", padx=6) #Manda manualmente STAND 
         ttk.Button(barra_strumenti, text="Reset device",
                    command=lambda: self.invia_comando("CMD:RESET")).pack(side="left", padx=6) #Manda RESET per riportare la macchina a IDLE 
-        ttk.Button(barra_strumenti, text="Esporta Excel…",
+        ttk.Button(barra_strumenti, text="Esporta…",
                    command=self.esporta_excel).pack(side="left", padx=6) #Apre il dialog “Salva con nome” ed esporta le metriche raccolte
         ttk.Button(barra_strumenti, text="Salva grafico PNG…",
                 command=self.salva_png).pack(side="left", padx=6) #salva grafico
         # ---- pannello soglie/allerta ----
         tune = ttk.LabelFrame(self, text="Soglie e allerta"); tune.pack(fill="x", padx=10, pady=6) #Crea un riquadro con titolo “Soglie e allerta”
-        self.soglia_dhr_min  = tk.DoubleVar(value=10.0)
-        self.soglia_dhr_max  = tk.DoubleVar(value=30.0)
-        self.soglia_picco_max = tk.DoubleVar(value=120.0)
-        self.soglia_margine_recupero = tk.DoubleVar(value=10.0)
+        #valori iniziali da valutazione.py: GUI, motore, monitor e rianalisi danno lo stesso verdetto
+        self.soglia_dhr_min  = tk.DoubleVar(value=SOGLIE_PREDEFINITE["dhr_min"])
+        self.soglia_dhr_max  = tk.DoubleVar(value=SOGLIE_PREDEFINITE["dhr_max"])
+        self.soglia_picco_max = tk.DoubleVar(value=SOGLIE_PREDEFINITE["picco_max"])
+        self.soglia_margine_recupero = tk.DoubleVar(value=SOGLIE_PREDEFINITE["margine_recupero"])
 
         for label, var in [("ΔHR min", self.soglia_dhr_min), ("ΔHR max", self.soglia_dhr_max),("Peak max", self.soglia_picco_max),("Recovmargin (+bpm)", self.soglia_margine_recupero)]:
             
@@ -143,45 +107,83 @@ class App(tk.Tk): #crea l'oggetto della finistra principale
     
         ttk.Label(met, textvariable=self.var_interpretazione,
                   font=("Helvetica", 11, "italic"), foreground="blue").pack(anchor="w", padx=6, pady=4) #mostra l’interpretazione , che viene aggiornata dalla funzione di valutazione soglie quando ricevi le metriche 
+        self.var_metriche_host = tk.StringVar(value="Host (live): —")
+        ttk.Label(met, textvariable=self.var_metriche_host).pack(anchor="w", padx=6, pady=(0,4)) #metriche calcolate sull'host durante il test, * = provvisoria
 
         # ---- grafico ----
-        self.figura = Figure(figsize=(8.7,3.8), dpi=100) #foglio del grafico
-        self.assi  = self.figura.add_subplot(111) #aggiunge assi
-        self.assi.set_xlabel("Campioni")
-        self.assi.set_ylabel("BPM")
-        self.linea, = self.assi.plot([], []) #sfruta gli elementi arrivati da plot()
-        self.assi.grid(True)
-
-        tela = FigureCanvasTkAgg(self.figura, master=self) #canvas Tkinter che contiene la figura Matplotlib
-        tela.draw() #disegna figura
-        tela.get_tk_widget().pack(fill="both", expand=True, padx=10, pady=6) #inserisce widget Tk del canvas dove both riempie in larghezza e altezza e expand ridimensiona quando riempi la finestra
-        self.tela = tela #salva il canvas
+        self.cornice_grafico = ttk.Frame(self, height=380) #posto riservato: la figura Matplotlib si crea dopo che la finestra è visibile
+        self.cornice_grafico.pack(fill="both", expand=True, padx=10, pady=6)
+        self.grafico = None
 
         # ---- menù ----
         barra_menu = tk.Menu(self) # crea la barra di menu in alto con le relative voci
         menu_test = tk.Menu(barra_menu, tearoff=0)
-        menu_test.add_command(label="Avvia protocollo 30–30–120", command=self.esegui_protocollo)
+        menu_test.add_command(label="Avvia protocollo", command=self.esegui_protocollo)
+        menu_test.add_command(label="Carica protocollo da file…", command=self.carica_protocollo)
         menu_test.add_command(label="Reset (device)", command=lambda: self.invia_comando("CMD:RESET"))
+        menu_test.add_separator()
+        menu_test.add_command(label="Modalità binaria (frame)", command=lambda: self.invia_comando("CMD:BIN")) #il firmware passa ai frame binari
+        menu_test.add_command(label="Modalità testo", command=lambda: self.invia_comando("CMD:TXT")) #ritorno alle righe BPM:/METRICS
         barra_menu.add_cascade(label="Test", menu=menu_test)
 
         menu_file = tk.Menu(barra_menu, tearoff=0)
-        menu_file.add_command(label="Esporta Excel…", command=self.esporta_excel)
+        menu_file.add_command(label="Esporta Excel/CSV/Parquet…", command=self.esporta_excel)
+        menu_file.add_command(label="Esporta da sessioni registrate…", command=self.esporta_sessioni)
+        menu_file.add_command(label="Apri sessione registrata…", command=self.apri_sessione)
         menu_file.add_separator()
         menu_file.add_command(label="Esci", command=self.alla_chiusura)
         menu_file.add_command(label="Salva grafico PNG…", command=self.salva_png)
         menu_file.add_separator()
         barra_menu.add_cascade(label="File", menu=menu_file)
+
+        menu_soglie = tk.Menu(barra_menu, tearoff=0)
+        menu_soglie.add_command(label="Rivaluta risultati con le soglie correnti", command=self.rivaluta_risultati)
+        menu_soglie.add_command(label="Esplora soglie sui risultati correnti", command=lambda: self.esplora_soglie(self.righe))
+        menu_soglie.add_command(label="Esplora soglie su file risultati…", command=self.esplora_soglie_da_file)
+        barra_menu.add_cascade(label="Soglie", menu=menu_soglie)
+
+        menu_strumenti = tk.Menu(barra_menu, tearoff=0)
+        menu_strumenti.add_command(label="Diagnostica…", command=self.mostra_diagnostica)
+        barra_menu.add_cascade(label="Strumenti", menu=menu_strumenti)
         self.config(menu=barra_menu) #Imposta la menubar appena creata come menu della finestra
+        basso = ttk.Frame(self); basso.pack(fill="x") #barra in fondo: avanzamento export e tempi del grafico
+        self.barra_export = ttk.Progressbar(basso, length=220) #visibile solo durante un export
+        self.var_frame = tk.StringVar(value="")
+        ttk.Label(basso, textvariable=self.var_frame, foreground="gray").pack(side="right", padx=10) #contatore tempi di disegno del grafico
 
         # ---- dati runtime ----
-        self.serie_bpm = deque(maxlen=PUNTI_MASSIMI) #crea coda per gli ultimi BPM letti limitando la lunghezza e scartando i vecchi
-        self.coda = queue.Queue() #Crea una coda thread-safe usata dal thread seriale per inviare messaggi alla GUI.
-        self.lettore = None #è il thread che legge la porta e riomane none finche non clicci connetti
-        self.righe = []  # dati per export Excel
+        self.serie_bpm = SerieTemporale() #storia BPM della stazione mostrata (quella del dispositivo, scritta dal motore); il grafico la legge
+        self.diffusore = None
+        if diffusione:
+            try:
+                self.diffusore = Diffusore(HOST_DIFFUSIONE, *PORTE_DIFFUSIONE) #pubblica BPM/METRICS/stato a tutti gli abbonati
+                self.diffusore.start()
+            except OSError as e: #porta occupata: l'acquisizione funziona lo stesso
+                self.stato.set(f"Diffusione in rete non disponibile: {e}")
+        self.motore = MotoreAcquisizione(cartella_sessioni=CARTELLA_SESSIONI, intervallo_fsync=INTERVALLO_FSYNC,
+                                         diffusore=self.diffusore) #un solo thread legge tutte le porte collegate e le registra
+        self.motore.start()
+        self.dispositivo = None #stazione mostrata nella finestra, None finche non clicchi connetti
+        self.riproduzione = None #(RiproduzioneSessione, Dispositivo) mentre si riproduce una sessione
+        self.segni = {} #porta -> segno accanto al nome nell'elenco per i risultati arrivati sulle stazioni non mostrate
+        self._timer_riproduzione = None #id dell'after del prossimo passo di riproduzione
+        self.export_in_corso = None #stato condiviso con il thread di export
+
+        # ---- diagnostica ----
+        self.m_intervallo_coda = REGISTRO.istogramma("intervallo_leggi_coda_s", "tempo tra due leggi_coda (obiettivo 0.1 s)", LIMITI_INTERVALLO)
+        self.m_durata_coda = REGISTRO.istogramma("durata_leggi_coda_s", "durata di leggi_coda nel thread Tk")
+        self.m_grafico = REGISTRO.istogramma("durata_aggiorna_grafico_s", "durata di aggiorna_grafico nel thread Tk")
+        self._ultima_lettura_coda = None
+        self.server_metriche = None
+        if PORTA_METRICHE:
+            try:
+                self.server_metriche = ServerMetriche(REGISTRO, PORTA_METRICHE)
+            except OSError as e: #porta occupata (es. seconda istanza): si continua senza endpoint
+                self.stato.set(f"Endpoint metriche non disponibile: {e}")
 
         self.aggiorna_porte()
         self.after(100, self.leggi_coda)
-        self.after(250, self.aggiorna_grafico)
+        self.after_idle(self._crea_grafico) #Matplotlib si importa qui, a finestra già disegnata
 
     # ===== connessione =====
     def aggiorna_porte(self):
@@ -199,114 +201,235 @@ class App(tk.Tk): #crea l'oggetto della finistra principale
         messagebox.showerror("Seriale", msg) #mostra messaggio errore
 
     def connetti(self):
-        if self.lettore: #evita di connettersi due volte
-            return
         porta = self.combo_porta.get().strip()
         if not porta:
             self.su_errore("Nessuna porta selezionata.")
             return #legge la porta scelta
+        disp = self.motore.dispositivi.get(porta)
+        if disp and disp.connesso: #evita di connettersi due volte alla stessa porta
+            self.seleziona_dispositivo(porta)
+            return
         baud = int(self.var_baud.get()) #legge il baud
-        self.lettore = SerialReader(porta, baud, self.coda, self.su_errore)
-        self.lettore.start() #legge il seriale e lo avvia start()
+        self.motore.aggiungi(porta, baud) #il motore apre la porta nel suo thread
+        self.aggiorna_elenco_dispositivi()
+        self.seleziona_dispositivo(porta)
         self.stato.set(f"Connessione a {porta}...") #aggiorna stato nella gui
 
+    def aggiorna_elenco_dispositivi(self):
+        self.combo_dispositivo["values"] = [f"{p} {self.segni[p]}" if p in self.segni else p
+                                            for p in self.motore.dispositivi]
+
     def disconnetti(self): 
-        if self.lettore: #se c'è porta attiva chiude il seriale
-            self.lettore.ferma()
-            self.lettore = None
+        if self.dispositivo: #se c'è porta attiva chiude il seriale
+            self.motore.scollega(self.dispositivo.porta)
         self.stato.set("Disconnesso") #aggiorna lo stato a disconnesso
 
+    def seleziona_dispositivo(self, porta): #cambia la stazione mostrata nella vista
+        disp = self.motore.dispositivi.get(porta)
+        if disp is None:
+            return
+        self.dispositivo = disp
+        self.segni.pop(porta, None) #il risultato ora è visibile nella vista
+        self.aggiorna_elenco_dispositivi()
+        self.combo_dispositivo.set(porta)
+        disp.coda.preleva_tutto() #lo stato attuale si ricarica dal dispositivo, gli eventi vecchi non servono
+        self.serie_bpm = disp.serie_bpm #nessuna copia: il grafico legge direttamente la storia del dispositivo
+        if self.grafico:
+            self.grafico.imposta_serie(self.serie_bpm)
+        self.var_bpm.set(f"{disp.ultimo_bpm:.1f}" if disp.ultimo_bpm is not None else "--")
+        self.var_metriche_host.set("Host (live): —") #leggi_coda mostra quelle del protocollo di questa stazione, se c'è
+        if disp.metriche:
+            self.mostra_metriche(disp.metriche)
+            b, p, d, tp, r = disp.metriche
+            self.var_interpretazione.set("Interpretazione: " + interpretazione(valuta(b, p, d, r, tp, self.soglie())))
+        else:
+            for var in (self.m_basale, self.m_picco, self.m_dhr, self.m_tpicco, self.m_recov):
+                var.set("—")
+            self.var_interpretazione.set("Interpretazione: —")
+        self.stato.set(f"{porta}: " + ("connesso" if disp.connesso else "non connesso"))
+
+    @property
+    def righe(self):  # dati per export Excel, di tutte le stazioni
+        return [r for disp in list(self.motore.dispositivi.values()) for r in disp.righe]
+
     def invia_comando(self, cmd): #invia comandi a ESP32
-        if not self.lettore or not self.lettore.seriale or not self.lettore.seriale.is_open: #controlla se esiste lettore e se porta è aperta
+        disp = self.dispositivo
+        if not disp or not (disp.connesso or disp.riconnetti): #controlla se esiste il dispositivo e se porta è aperta
             self.su_errore("Non connesso alla seriale.")
             return
         try:
-            self.lettore.seriale.write((cmd + "\n").encode()) #scrive comando su seriale
+            if not disp.invia(cmd): #porta in avvio o in riconnessione: il motore lo invia appena è pronta
+                self.stato.set(f"{cmd} in coda: {disp.porta} non è ancora pronta")
         except Exception as e:
             self.su_errore(f"Invio comando fallito: {e}")
 
+    # ===== sessioni registrate =====
+    def apri_sessione(self):
+        path = filedialog.askopenfilename(
+            initialdir=CARTELLA_SESSIONI if os.path.isdir(CARTELLA_SESSIONI) else None,
+            filetypes=[("Sessione KY-039", "*" + ESTENSIONE)]
+        )
+        if not path:
+            return
+        try:
+            lettore = LettoreSessione(path)
+        except (OSError, ValueError) as e:
+            self.su_errore(f"Apertura sessione fallita: {e}")
+            return
+        veloce = messagebox.askyesno("Riproduzione", "Riprodurre alla massima velocità?\n(No = tempo reale 1x)")
+        if self.riproduzione: #una sola riproduzione alla volta: si ferma quella in corso
+            self.after_cancel(self._timer_riproduzione)
+            self.riproduzione[0].lettore.chiudi()
+            self.riproduzione = None
+        nome = "sessione:" + os.path.basename(path)
+        disp = self.motore.dispositivo_virtuale(nome) #la sessione diventa un dispositivo come gli altri
+        disp.azzera() #riprodurre di nuovo la stessa sessione non deve duplicare serie e righe da esportare
+        self.aggiorna_elenco_dispositivi()
+        self.seleziona_dispositivo(nome)
+        self.riproduzione = (RiproduzioneSessione(lettore, None if veloce else 1.0), disp)
+        self.stato.set(f"Riproduzione {os.path.basename(path)}…")
+        self._timer_riproduzione = self.after(0, self._passo_riproduzione)
+
+    def _passo_riproduzione(self):
+        if not self.riproduzione:
+            return
+        rip, disp = self.riproduzione
+        eventi, tempi = [], []
+        for tipo, _t_mono, t_wall, payload in rip.prossimi():
+            eventi_da_record(tipo, payload, eventi)
+            tempi.extend([t_wall] * (len(eventi) - len(tempi))) #il grafico mostra gli orari originali della sessione
+        disp.applica(eventi, inoltra=False, tempi=tempi) #stato e righe del dispositivo
+        if disp is self.dispositivo:
+            for evento in eventi: #la vista riceve ogni evento, senza fondere i BPM
+                self.gestisci_evento(*evento)
+        if rip.finita:
+            rip.lettore.chiudi()
+            self.riproduzione = None
+            self.stato.set("Riproduzione terminata")
+            return
+        self._timer_riproduzione = self.after(50, self._passo_riproduzione)
+
     # ===== protocollo ===== #serve per rannare il protocollo
     def esegui_protocollo(self):
-        self.invia_comando("CMD:START")
-        self.stato.set("Baseline in corso… (30 s)")
-        self.after(30000, self._protocollo_stand)
+        protocollo = self.protocolli.get(self.var_protocollo.get())
+        if not protocollo:
+            return
+        disp = self.dispositivo
+        if not disp or not (disp.connesso or disp.riconnetti):
+            self.su_errore("Non connesso alla seriale.")
+            return
+        #fasi, comandi e metriche host restano legati a questa stazione anche se poi se ne mostra un'altra
+        self.motore.avvia_protocollo(disp, protocollo)
+        self.var_metriche_host.set("Host (live): —")
 
-    def _protocollo_stand(self):
-        self.invia_comando("CMD:STAND")
-        self.stato.set("Post-stand… (picco entro 30 s, recupero 60–120 s)")
-        
-    # =====  righe =====
-    def leggi_coda(self):  #metodo per leggere la coda del seriale
+    def carica_protocollo(self):
+        path = filedialog.askopenfilename(filetypes=[("Protocollo JSON", "*.json")])
+        if not path:
+            return
         try:
-            while True:
-                typ, payload = self.coda.get_nowait() #legge
-                if typ == "STATUS":
-                    self.stato.set(payload) #aggiorna etichetta
-                elif typ == "LINE":
-                    self.gestisci_riga(payload) #se è una linea la passa a parser gestisci_riga()
-        except queue.Empty:
-            pass
-        self.after(100, self.leggi_coda) #ripianifica se stessa
+            protocollo = carica_protocollo(path)
+        except (OSError, ValueError, KeyError) as e:
+            self.su_errore(f"Protocollo non valido: {e}")
+            return
+        self.protocolli[protocollo["nome"]] = protocollo
+        self.combo_protocollo["values"] = list(self.protocolli)
+        self.var_protocollo.set(protocollo["nome"])
 
-    def gestisci_riga(self, s): #interpreta i dati ricevuti da arduino e li salva per esportarli su excel(s è una stringa ricevuta dal seriale)
-        m = REGEX_RIGA_BPM.match(s)
-        if m:
-            bpm = float(m.group(1)) #prende valore numero e lo converte in numero
-            self.serie_bpm.append(bpm) #aggiunge a serie di valori per il grafico
-            self.var_bpm.set(f"{bpm:.1f}") 
+    def mostra_metriche_host(self, protocollo):
+        valori, provvisorie, completo = protocollo.metriche_host #istantanea calcolata dal motore
+        if not valori:
             return
+        testo = " · ".join(f"{k} {v:.1f}{'*' if k in provvisorie else ''}" for k, v in valori.items())
+        self.var_metriche_host.set(("Host: " if completo else "Host (live): ") + testo)
 
-        m2 = REGEX_METRICHE.search(s) #se la riga ricevuta è del tipo METRICS
-        if m2:
-            b, p, d, tp, r = map(float, m2.groups()) #converte tutto in variabili numeriche
-            self.m_basale.set(f"{b:.1f}")
-            self.m_picco.set(f"{p:.1f}")
-            self.m_dhr.set(f"{d:.1f}")
-            self.m_tpicco.set(f"{tp:.1f}")
-            self.m_recov.set(f"{r:.1f}")
-            # aggiorna etichette con valori calcolati
-            self.valuta_e_avvisa(b, p, d, r, tp) #confronta con soglie
-            # salva in memoria per Excel
-            esito = "OK" if "OK " in self.stato.get() else "ATTENZIONE"
-            self.righe.append({
-                "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
-                "baseline": round(b, 1),
-                "peak": round(p, 1),
-                "dHR": round(d, 1),
-                "t_peak_s": round(tp, 1),
-                "recov60": round(r, 1),
-                "esito": esito,
-                "interpretazione": self.var_interpretazione.get().replace("Interpretazione: ", "")
-            })
-            #aggiunge dati ad una lista che serve per esportare su excel
+    # =====  righe =====
+    def leggi_coda(self):  #metodo per leggere le code dei dispositivi
+        t0 = time.perf_counter()
+        if self._ultima_lettura_coda is not None:
+            self.m_intervallo_coda.osserva(t0 - self._ultima_lettura_coda) #ritardo del ciclo Tk rispetto ai 100 ms
+        self._ultima_lettura_coda = t0
+        ultimo_bpm = None
+        for disp in list(self.motore.dispositivi.values()):
+            eventi = disp.coda.preleva_tutto() #preleva tutti gli eventi in un colpo solo
+            if disp is not self.dispositivo: #le altre stazioni aggiornano solo il loro stato nel motore
+                for typ, payload in eventi:
+                    self.evento_in_secondo_piano(disp, typ, payload)
+                continue
+            for typ, payload in eventi:
+                if typ == "BPM": #la storia per il grafico l'ha già aggiornata il motore
+                    ultimo_bpm = payload
+                else:
+                    self.gestisci_evento(typ, payload)
+        if ultimo_bpm is not None:
+            self.var_bpm.set(f"{ultimo_bpm:.1f}") #l'etichetta si aggiorna una volta sola per tick
+        if self.dispositivo and self.dispositivo.protocollo: #metriche host del protocollo della stazione mostrata
+            self.mostra_metriche_host(self.dispositivo.protocollo)
+        self.m_durata_coda.osserva(time.perf_counter() - t0)
+        self.after(100, self.leggi_coda) #ripianifica se stessa
 
-    # ===== valutazione soglie + interpretazione =====
-    def valuta_e_avvisa(self, baseline, peak, dhr, recov60, tpeak):
-        reasons = []
+    def evento_in_secondo_piano(self, disp, typ, payload): #errori e risultati delle stazioni non mostrate
+        if typ == "ERRORE":
+            self.su_errore(payload)
+        elif typ == "STATUS" and payload.startswith("Protocollo"): #protocollo completato o interrotto
+            self.stato.set(f"{disp.porta}: {payload}")
+        elif typ == "METRICS":
+            b, p, d, tp, r = payload
+            reasons = valuta(b, p, d, r, tp, self.soglie())
+            self.segni[disp.porta] = "⚠" if reasons else "✓"
+            self.aggiorna_elenco_dispositivi()
+            if reasons:
+                self.stato.set(f"{disp.porta}: ATTENZIONE – {interpretazione(reasons)}")
+                self.lampeggia("#ffb3b3")
+                self.bell()
+            else:
+                self.stato.set(f"{disp.porta}: risultato OK (entro soglie)")
 
-        # HR_baseline
-        if baseline < 50:
-            reasons.append("Bradicardia (<50 bpm)")
-        elif baseline > 100:
-            reasons.append("Tachicardia a riposo (>100 bpm)")
+    def gestisci_riga(self, s): #interpreta una riga testuale ricevuta da arduino (s è una stringa ricevuta dal seriale)
+        evento = analizza_riga(s)
+        if evento:
+            self.gestisci_evento(*evento)
 
-        # ΔHR
-        if dhr < 10:
-            reasons.append("ΔHR troppo basso (<10) → sospetta ipotensione/disautonomia")
-        elif dhr > 40:
-            reasons.append("ΔHR troppo alto (>40) → possibile POTS/ansia")
+    def gestisci_evento(self, typ, payload): #applica un evento già analizzato alla vista
+        if typ == "STATUS":
+            self.stato.set(payload) #aggiorna etichetta
+            return
 
-        # HR_peak
-        if peak > 120:
-            reasons.append("Peak >120 bpm → iper-adrenergico")
+        if typ == "ERRORE":
+            self.su_errore(payload)
+            return
 
-        # t_peak
-        if tpeak > 30:
-            reasons.append("t_peak >30s → reattività simpatica lenta")
+        if typ == "BPM":
+            bpm = payload
+            self.var_bpm.set(f"{bpm:.1f}") 
+            return
+
+        if typ == "METRICS": #se la riga ricevuta è del tipo METRICS
+            b, p, d, tp, r = payload
+            self.mostra_metriche(payload) # aggiorna etichette con valori calcolati
+            self.valuta_e_avvisa(b, p, d, r, tp) #confronta con soglie
+            # la riga per Excel la salva il Dispositivo nel motore
 
-        # recupero
-        if (recov60 - baseline) > 15:
-            reasons.append("Recupero lento (>15 bpm sopra baseline a 60–120s)")
+    def mostra_metriche(self, metriche):
+        b, p, d, tp, r = metriche
+        self.m_basale.set(f"{b:.1f}")
+        self.m_picco.set(f"{p:.1f}")
+        self.m_dhr.set(f"{d:.1f}")
+        self.m_tpicco.set(f"{tp:.1f}")
+        self.m_recov.set(f"{r:.1f}")
+
+    # ===== valutazione soglie + interpretazione =====
+    def soglie(self): #soglie del pannello, le altre restano quelle predefinite di valutazione.py
+        soglie = {}
+        for nome, var in (("dhr_min", self.soglia_dhr_min), ("dhr_max", self.soglia_dhr_max),
+                          ("picco_max", self.soglia_picco_max), ("margine_recupero", self.soglia_margine_recupero)):
+            try:
+                soglie[nome] = float(var.get())
+            except (tk.TclError, ValueError):
+                pass #casella vuota o non numerica: vale il predefinito
+        return soglie
+
+    def valuta_e_avvisa(self, baseline, peak, dhr, recov60, tpeak):
+        reasons = valuta(baseline, peak, dhr, recov60, tpeak, self.soglie())
 
         if not reasons:
             self.stato.set("Risultato: OK (entro soglie)")
@@ -316,58 +439,148 @@ class App(tk.Tk): #crea l'oggetto della finistra principale
             self.stato.set("Risultato: ATTENZIONE ")
             self.lampeggia("#ffb3b3")
             self.bell()
-            self.var_interpretazione.set("Interpretazione: " + " | ".join(reasons))
+            self.var_interpretazione.set("Interpretazione: " + interpretazione(reasons))
+
+    def rivaluta_risultati(self): #applica le soglie correnti a tutte le righe raccolte
+        righe = self.righe
+        if not righe:
+            messagebox.showinfo("Soglie", "Nessun risultato da rivalutare.")
+            return
+        attenzione, _ = valuta_tabella(righe, self.soglie())
+        n_att = int(attenzione.sum())
+        messagebox.showinfo("Soglie", f"{len(righe)} risultati con le soglie correnti:\n"
+                                      f"OK: {len(righe) - n_att}   ATTENZIONE: {n_att}")
+
+    def esplora_soglie_da_file(self):
+        nomefile = filedialog.askopenfilename(
+            filetypes=[("Risultati", "*.xlsx *.csv *.parquet"), ("Tutti i file", "*")])
+        if not nomefile:
+            return
+        try:
+            import pandas as pd #serve solo qui, per leggere le tabelle esportate
+            est = os.path.splitext(nomefile)[1].lower()
+            lettori = {".xlsx": pd.read_excel, ".csv": pd.read_csv, ".parquet": pd.read_parquet}
+            if est not in lettori:
+                raise ValueError(f"formato non supportato: {est}")
+            tabella = lettori[est](nomefile)
+        except Exception as e:
+            self.su_errore(f"Lettura risultati fallita: {e}")
+            return
+        self.esplora_soglie(tabella, os.path.basename(nomefile))
+
+    def esplora_soglie(self, tabella, titolo="risultati correnti"):
+        #conta OK/ATTENZIONE per ogni combinazione di soglie intorno a quelle del pannello
+        if len(tabella) == 0:
+            messagebox.showinfo("Soglie", "Nessun risultato da analizzare.")
+            return
+        correnti = soglie_complete(self.soglie())
+        griglia = griglia_intorno(correnti, PASSI_ESPLORAZIONE)
+        try:
+            t0 = time.perf_counter()
+            conteggi = esplora_soglie(tabella, griglia, correnti)
+            durata = time.perf_counter() - t0
+        except (KeyError, ValueError) as e:
+            self.su_errore(f"Esplorazione soglie fallita: {e}")
+            return
+
+        finestra = tk.Toplevel(self)
+        finestra.title(f"Esplorazione soglie – {titolo}")
+        totale = int(conteggi["OK"][0] + conteggi["ATTENZIONE"][0])
+        ttk.Label(finestra, text=f"{totale} test completi · {len(conteggi['OK'])} combinazioni in "
+                                 f"{durata * 1000:.0f} ms · in grassetto le soglie correnti").pack(anchor="w", padx=8, pady=4)
+        colonne = list(griglia) + ["OK", "ATTENZIONE", "% OK"]
+        albero = ttk.Treeview(finestra, columns=colonne, show="headings", height=20)
+        for c in colonne:
+            albero.heading(c, text=c)
+            albero.column(c, width=100, anchor="e")
+        albero.tag_configure("correnti", font=("Helvetica", 10, "bold"))
+        for i in range(len(conteggi["OK"])):
+            soglie = [conteggi[n][i] for n in griglia]
+            ok = int(conteggi["OK"][i])
+            tag = ("correnti",) if all(v == correnti[n] for n, v in zip(griglia, soglie)) else ()
+            albero.insert("", "end", values=[f"{v:g}" for v in soglie] + [ok, totale - ok,
+                          f"{100 * ok / totale:.1f}" if totale else "—"], tags=tag)
+        scorrimento = ttk.Scrollbar(finestra, orient="vertical", command=albero.yview)
+        albero.configure(yscrollcommand=scorrimento.set)
+        albero.pack(side="left", fill="both", expand=True, padx=(8, 0), pady=(0, 8))
+        scorrimento.pack(side="right", fill="y", pady=(0, 8))
 
    
     # ===== export Excel =====
     def esporta_excel(self):
-        if not self.righe:
+        righe = rivaluta_righe(self.righe, self.soglie()) #istantanea delle righe di tutte le stazioni, con le soglie del pannello
+        if not righe:
             messagebox.showinfo("Export", "Nessun dato da esportare.")
             return
-        try:
-            df = pd.DataFrame(self.righe, columns=[
-                "timestamp","baseline","peak","dHR","t_peak_s","recov60","esito","interpretazione"
-            ]) 
-            #converte la lista di dizionari self.rows in un DataFrame pandas con le colonne nell’ordine desiderato.
-            nomefile = filedialog.asksaveasfilename(
-                defaultextension=".xlsx",
-                filetypes=[("Excel file","*.xlsx")],
-                initialfile=f"ortho_{datetime.datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"
-            ) #apre la finestra "salva con nome" e scegli dove metterlo
-            if not nomefile:
-                return
-           
-            # Scrittura con formattazione usando openpyxl
-            with pd.ExcelWriter(nomefile, engine="openpyxl") as writer:
-                df.to_excel(writer, index=False, sheet_name="Risultati")
-                ws = writer.sheets["Risultati"]
-            # dataFrame nel foglio “Risultati” 
-                # Stile intestazioni
-                from openpyxl.styles import Font, PatternFill
-                for cell in ws[1]:
-                    cell.font = Font(bold=True)
-
-                # Formattazione condizionale sulle righe
-                for row in ws.iter_rows(min_row=2, max_row=ws.max_row, min_col=1, max_col=ws.max_column):
-                    esito_cell = row[6]  # colonna "esito"
-                    if esito_cell.value == "OK":
-                        fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")  # verde
-                    else:
-                        fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")  # rosso
-                    for c in row:
-                        c.fill = fill
+        nomefile = self._chiedi_file_export()
+        if nomefile:
+            self._avvia_export(righe, nomefile, len(righe))
+
+    def esporta_sessioni(self): #export in streaming direttamente dalle sessioni registrate
+        percorsi = filedialog.askopenfilenames(
+            initialdir=CARTELLA_SESSIONI if os.path.isdir(CARTELLA_SESSIONI) else None,
+            filetypes=[("Sessione KY-039", "*" + ESTENSIONE)]
+        )
+        if not percorsi:
+            return
+        nomefile = self._chiedi_file_export()
+        if nomefile:
+            self._avvia_export(righe_da_sessioni(percorsi, self.soglie()), nomefile, None)
+
+    def _chiedi_file_export(self):
+        return filedialog.asksaveasfilename(
+            defaultextension=".xlsx",
+            filetypes=[("Excel file","*.xlsx"), ("CSV","*.csv"), ("Parquet","*.parquet")],
+            initialfile=f"ortho_{datetime.datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"
+        ) #apre la finestra "salva con nome" e scegli dove metterlo
+
+    def _avvia_export(self, righe, nomefile, totale):
+        # la scrittura gira in un thread: la finestra resta reattiva e la barra mostra l'avanzamento
+        if self.export_in_corso:
+            messagebox.showinfo("Export", "Un export è già in corso.")
+            return
+        stato = self.export_in_corso = {"fatte": 0, "esito": None}
 
+        def lavoro():
+            try:
+                n = scrivi(righe, nomefile, progresso=lambda k: stato.__setitem__("fatte", k))
+                stato["esito"] = ("ok", n)
+            except Exception as e:
+                stato["esito"] = ("errore", e)
+
+        threading.Thread(target=lavoro, daemon=True).start()
+        if totale:
+            self.barra_export.configure(mode="determinate", maximum=totale, value=0)
+        else:
+            self.barra_export.configure(mode="indeterminate")
+            self.barra_export.start(50)
+        self.barra_export.pack(side="left", padx=10)
+        self.stato.set(f"Export in corso: {os.path.basename(nomefile)}…")
+        self.after(100, self._controlla_export, nomefile)
+
+    def _controlla_export(self, nomefile):
+        stato = self.export_in_corso
+        if stato["esito"] is None:
+            if str(self.barra_export["mode"]) == "determinate":
+                self.barra_export["value"] = stato["fatte"]
+            self.after(100, self._controlla_export, nomefile)
+            return
+        self.barra_export.stop()
+        self.barra_export.pack_forget()
+        self.export_in_corso = None
+        esito, valore = stato["esito"]
+        if esito == "ok":
             self.stato.set(f"Esportato: {nomefile}")
-            messagebox.showinfo("Export", f"File salvato con formattazione:\n{nomefile}")
-        except Exception as e:
-            self.su_errore(f"Export fallito: {e}")
-            
+            messagebox.showinfo("Export", f"File salvato ({valore} righe):\n{nomefile}")
+        else:
+            self.su_errore(f"Export fallito: {valore}")
+
     # ===== grafico =====
     def salva_png(self, svg: bool = False):
         
         try:
             # Evita di salvare un grafico vuoto
-            if not self.serie_bpm:
+            if not self.serie_bpm or self.grafico is None:
                 messagebox.showinfo("Salva grafico", "Non ci sono dati nel grafico da salvare.")
                 return
 
@@ -387,26 +600,45 @@ class App(tk.Tk): #crea l'oggetto della finistra principale
 
             # Salvataggio (DPI più alto per PNG)
             if svg:
-                self.figura.savefig(path, bbox_inches="tight")
+                self.grafico.salva(path, bbox_inches="tight")
             else:
-                self.figura.savefig(path, dpi=200, bbox_inches="tight")
+                self.grafico.salva(path, dpi=200, bbox_inches="tight")
 
             self.stato.set(f"Grafico salvato: {path}")
             messagebox.showinfo("Salva grafico", f"Grafico salvato con successo:\n{path}")
 
         except Exception as e:
             self.su_errore(f"Salvataggio grafico fallito: {e}")
+    def _crea_grafico(self):
+        from matplotlib.figure import Figure #import pesanti, rimandati fino al primo uso
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+        from grafico import GraficoBPM
+
+        self.figura = Figure(figsize=(8.7,3.8), dpi=100) #foglio del grafico
+        self.assi  = self.figura.add_subplot(111) #aggiunge assi
+        self.assi.set_xlabel("Ora")
+        self.assi.set_ylabel("BPM")
+        self.assi.grid(True)
+
+        tela = FigureCanvasTkAgg(self.figura, master=self.cornice_grafico) #canvas Tkinter che contiene la figura Matplotlib
+        self.grafico = GraficoBPM(self.figura, self.assi, tela, self.serie_bpm) #linea e blitting sulla serie già in uso
+        self.linea = self.grafico.linea
+        barra = NavigationToolbar2Tk(tela, self.cornice_grafico, pack_toolbar=False) #sposta/zoom sulla storia; "Dal vivo" torna a seguire
+        ttk.Button(barra, text="Dal vivo", command=self.grafico.segui).pack(side="left", padx=6)
+        barra.pack(side="bottom", fill="x")
+        tela.draw() #disegna figura
+        tela.get_tk_widget().pack(fill="both", expand=True) #inserisce widget Tk del canvas dove both riempie in larghezza e altezza e expand ridimensiona quando riempi la finestra
+        self.tela = tela #salva il canvas
+        self.after(250, self.aggiorna_grafico)
+
     def aggiorna_grafico(self):
-        y = list(self.serie_bpm)
-        x = list(range(len(y)))
-        self.linea.set_data(x, y) #prende gli ultimi BPM memorizzati nella deque self.bpm_series  e costruisce un asse x corrispondente 
-        if y:
-            ymin = max(30, int(min(y)) - 5)
-            ymax = min(200, int(max(y)) + 5)
-            if ymin >= ymax: ymax = ymin + 5
-            self.assi.set_ylim(ymin, ymax)
-            self.assi.set_xlim(0, max(30, len(y)))
-        self.tela.draw_idle()
+        t0 = time.perf_counter()
+        self.grafico.aggiorna() #ridisegna solo se sono arrivati BPM nuovi, con blitting della sola linea
+        self.m_grafico.osserva(time.perf_counter() - t0)
+        g = self.grafico
+        if g.frame_disegnati and g.frame_disegnati % 5 == 0:
+            self.var_frame.set(f"frame {g.tempo_medio_ms():.1f} ms · disegnati {g.frame_disegnati} "
+                               f"(completi {g.ridisegni_completi}) · saltati {g.frame_saltati}")
         self.after(200, self.aggiorna_grafico) #ripianifica se stessa cosi si aggiorna in modo continuo
 
     def lampeggia(self, color, times=3, interval=180):
@@ -418,12 +650,65 @@ class App(tk.Tk): #crea l'oggetto della finistra principale
                 self.configure(bg=self._bg_base)
         _step(0) #fa lampeggiare lo sfondo della finestra
 
+    def mostra_diagnostica(self): #finestra con contatori e istogrammi, aggiornata ogni secondo
+        finestra = tk.Toplevel(self)
+        finestra.title("Diagnostica")
+        indirizzo = (f"http://{self.server_metriche.indirizzo[0]}:{self.server_metriche.indirizzo[1]}/metrics"
+                     if self.server_metriche else "endpoint non attivo")
+        ttk.Label(finestra, text=f"Prometheus: {indirizzo}").pack(anchor="w", padx=8, pady=4)
+        testo = tk.Text(finestra, width=110, height=32, font=("Courier", 10))
+        testo.pack(fill="both", expand=True, padx=8, pady=(0, 8))
+        precedenti = {} #valori dei contatori al giro prima, per le velocità
+
+        def aggiorna():
+            if not finestra.winfo_exists():
+                return
+            adesso = time.monotonic()
+            righe = []
+            for nome, tipo, etichette, m in REGISTRO.elementi():
+                chi = etichette.get("porta", "GUI")
+                if tipo == "histogram":
+                    if not m.n:
+                        continue
+                    scala, unita = (1, "B") if nome.endswith("_byte") else (1000, "ms")
+                    righe.append(f"{chi:<18} {nome:<28} n={m.n:<8} media={m.media() * scala:8.2f} "
+                                 f"p50={m.quantile(0.5) * scala:8.2f} p99={m.quantile(0.99) * scala:8.2f} {unita}")
+                    continue
+                v = m.valore
+                riga = f"{chi:<18} {nome:<28} {v}"
+                if tipo == "counter":
+                    prima = precedenti.get((nome, chi))
+                    if prima:
+                        riga += f"  ({(v - prima[0]) / max(1e-6, adesso - prima[1]):.1f}/s)"
+                    precedenti[(nome, chi)] = (v, adesso)
+                righe.append(riga)
+            testo.delete("1.0", "end")
+            testo.insert("end", "\n".join(righe) or "Nessuna metrica ancora.")
+            finestra.after(1000, aggiorna)
+
+        aggiorna()
+
     def alla_chiusura(self):
-        self.disconnetti()
+        self.motore.ferma() #chiude tutte le porte
+        self.motore.join(timeout=5) #aspetta che le sessioni siano scaricate su disco (i thread sono daemon)
+        if self.server_metriche:
+            self.server_metriche.chiudi()
+        if self.diffusore:
+            self.diffusore.ferma()
         self.destroy() #chiude porta seriale
 
 # ================== MAIN ==================
 if __name__ == "__main__":
-    app = App()
+    app = App(diffusione=DIFFUSIONE_ATTIVA or "--diffusione" in sys.argv[1:])
     app.protocol("WM_DELETE_WINDOW", app.alla_chiusura)
+    if "--misura-avvio" in sys.argv[1:]: #usato da benchmark/bench_avvio.py: segnala finestra e grafico pronti, poi esce
+        print("finestra", flush=True)
+        def _attendi_grafico():
+            if app.grafico is None:
+                app.after(5, _attendi_grafico)
+                return
+            app.update_idletasks()
+            print("grafico", flush=True)
+            app.alla_chiusura()
+        app.after(5, _attendi_grafico)
     app.mainloop()
\ No newline at end of file
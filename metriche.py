@@ -0,0 +1,218 @@
+"""Metriche ortostatiche calcolate sull'host, in modo incrementale, per protocolli configurabili.
+
+Un protocollo è una sequenza di fasi (nome, durata, comando da inviare all'inizio) e un
+elenco di finestre definite rispetto all'inizio di una fase: media o massimo dei BPM tra
+"da" e "a" secondi. Ogni campione costa O(1) per finestra: somme correnti per le medie e
+deque monotona per i massimi; le metriche sono disponibili (provvisorie) mentre il test
+è ancora in corso. Come nel firmware i BPM vengono campionati a 1 Hz mantenendo l'ultimo
+valore ricevuto, e una media richiede almeno MIN_CAMPIONI campioni.
+"""
+import json
+from collections import deque
+
+MIN_CAMPIONI = 5  # come avgHRwindow nel firmware
+
+PROTOCOLLO_30_30_120 = {
+    "nome": "30–30–120",
+    "fasi": [
+        {"nome": "baseline", "durata": 30, "comando": "CMD:START"},
+        {"nome": "stand", "durata": 120, "comando": "CMD:STAND"},
+    ],
+    "finestre": [
+        {"metrica": "baseline", "fase": "stand", "da": -30, "a": 0, "tipo": "media"},
+        {"metrica": "peak", "fase": "stand", "da": 0, "a": 30, "tipo": "massimo"},
+        {"metrica": "recov60", "fase": "stand", "da": 60, "a": 120, "tipo": "media"},
+    ],
+    "differenze": {"dHR": ["peak", "baseline"]},
+}
+
+PROTOCOLLO_TILT = {
+    "nome": "Tilt 5–10–5",
+    "fasi": [
+        {"nome": "supino", "durata": 300, "comando": "CMD:START"},
+        {"nome": "tilt", "durata": 600, "comando": "CMD:STAND"},
+        {"nome": "recupero", "durata": 300},
+    ],
+    "finestre": [
+        {"metrica": "baseline", "fase": "tilt", "da": -60, "a": 0, "tipo": "media"},
+        {"metrica": "peak", "fase": "tilt", "da": 0, "a": 60, "tipo": "massimo"},
+        {"metrica": "tilt_3_10", "fase": "tilt", "da": 180, "a": 600, "tipo": "media"},
+        {"metrica": "tilt_max", "fase": "tilt", "da": 0, "a": 600, "tipo": "massimo"},
+        {"metrica": "recupero", "fase": "recupero", "da": 60, "a": 300, "tipo": "media"},
+    ],
+    "differenze": {"dHR": ["peak", "baseline"], "dHR_tilt": ["tilt_3_10", "baseline"]},
+}
+
+PROTOCOLLI = {p["nome"]: p for p in (PROTOCOLLO_30_30_120, PROTOCOLLO_TILT)}
+
+
+def carica_protocollo(percorso):
+    """Legge un protocollo da JSON (stesso formato dei dizionari qui sopra) e lo controlla."""
+    with open(percorso, encoding="utf-8") as f:
+        protocollo = json.load(f)
+    nomi_fasi = {fase["nome"] for fase in protocollo.get("fasi", [])}
+    if not nomi_fasi:
+        raise ValueError("il protocollo non ha fasi")
+    for fin in protocollo.get("finestre", []):
+        if fin["fase"] not in nomi_fasi:
+            raise ValueError(f"finestra {fin['metrica']!r}: fase {fin['fase']!r} inesistente")
+        if fin["tipo"] not in ("media", "massimo") or fin["a"] <= fin["da"]:
+            raise ValueError(f"finestra {fin['metrica']!r} non valida")
+    protocollo.setdefault("nome", percorso)
+    protocollo.setdefault("differenze", {})
+    return protocollo
+
+
+class MediaMobile:
+    """Media dei valori con t in [t - durata, t]; durata None = nessuna scadenza."""
+
+    def __init__(self, durata=None):
+        self.durata = durata
+        self._valori = deque()
+        self.somma = 0.0
+
+    def aggiungi(self, t, v):
+        self._valori.append((t, v))
+        self.somma += v
+        if self.durata is not None:
+            while t - self._valori[0][0] >= self.durata:
+                self.somma -= self._valori.popleft()[1]
+
+    def __len__(self):
+        return len(self._valori)
+
+    def valore(self):
+        return self.somma / len(self._valori) if self._valori else None
+
+
+class MassimoMobile:
+    """Massimo (e suo istante) dei valori con t in [t - durata, t], con deque monotona."""
+
+    def __init__(self, durata=None):
+        self.durata = durata
+        self._deque = deque()  # (t, v) con v decrescente
+
+    def aggiungi(self, t, v):
+        d = self._deque
+        while d and d[-1][1] <= v:  # a parità vince il più recente, come maxHRwindow (dal nuovo al vecchio, >)
+            d.pop()
+        d.append((t, v))
+        if self.durata is not None:
+            while t - d[0][0] >= self.durata:
+                d.popleft()
+
+    def __len__(self):
+        return len(self._deque)
+
+    def valore(self):
+        return self._deque[0] if self._deque else None
+
+
+class _Finestra:
+    def __init__(self, definizione, t_rif):
+        self.metrica = definizione["metrica"]
+        self.tipo = definizione["tipo"]
+        self.t0 = t_rif + definizione["da"]
+        self.t1 = t_rif + definizione["a"]
+        self.t_rif = t_rif
+        self.agg = MediaMobile() if self.tipo == "media" else MassimoMobile()
+
+    def aggiungi(self, t, v):
+        if self.t0 <= t < self.t1:
+            self.agg.aggiungi(t, v)
+
+    def risultati(self, finale):
+        """Valori correnti: {metrica: valore} e, per i massimi, l'istante dal riferimento."""
+        if self.tipo == "media":
+            if len(self.agg) < MIN_CAMPIONI and (finale or len(self.agg) == 0):
+                return {}
+            return {self.metrica: self.agg.valore()}
+        massimo = self.agg.valore()
+        if massimo is None:
+            return {}
+        t, v = massimo
+        return {self.metrica: v, f"t_{self.metrica}": max(0.0, t - self.t_rif)}
+
+
+class CalcolatoreMetriche:
+    """Riceve BPM con timestamp host e gli inizi delle fasi; calcola le metriche del protocollo."""
+
+    def __init__(self, protocollo, passo=1.0):
+        self.protocollo = protocollo
+        self.passo = passo
+        finestre = protocollo.get("finestre", [])
+        # quanto passato serve conservare per le finestre che iniziano prima della loro fase
+        self._memoria = max([-f["da"] for f in finestre if f["da"] < 0], default=0)
+        self._storia = deque()
+        self._attive = []   # finestre della fase già iniziata, non ancora chiuse
+        self._chiuse = []
+        self._inizi = {}    # fase -> t di inizio
+        self._prossimo_tick = None
+        self._ultimo_bpm = None
+
+    def inizia_fase(self, nome, t):
+        self._inizi[nome] = t
+        for definizione in self.protocollo.get("finestre", []):
+            if definizione["fase"] != nome:
+                continue
+            fin = _Finestra(definizione, t)
+            for ts, v in self._storia:  # campioni già arrivati che cadono nella finestra
+                fin.aggiungi(ts, v)
+            self._attive.append(fin)
+
+    def aggiungi(self, t, bpm):
+        self.avanza(t)
+        if self._prossimo_tick is None:
+            self._prossimo_tick = t + self.passo
+        self._ultimo_bpm = bpm
+
+    def avanza(self, t):
+        """Emette i tick 1 Hz fino a t con l'ultimo BPM ricevuto, come storeHR1Hz del firmware."""
+        if self._prossimo_tick is None:
+            return
+        while self._prossimo_tick <= t:
+            self._campione(self._prossimo_tick, self._ultimo_bpm)
+            self._prossimo_tick += self.passo
+        ancora = []
+        for fin in self._attive:
+            (self._chiuse if t >= fin.t1 else ancora).append(fin)
+        self._attive = ancora
+
+    def _campione(self, t, v):
+        if not (0 < v < 220):
+            return
+        if self._memoria:
+            self._storia.append((t, v))
+            while t - self._storia[0][0] > self._memoria:
+                self._storia.popleft()
+        for fin in self._attive:
+            fin.aggiungi(t, v)
+
+    def metriche(self):
+        """Restituisce (valori, provvisorie): le metriche disponibili e i nomi di quelle non definitive."""
+        valori, provvisorie = {}, set()
+        for fin in self._chiuse:
+            valori.update(fin.risultati(finale=True))
+        for fin in self._attive:
+            r = fin.risultati(finale=False)
+            valori.update(r)
+            provvisorie.update(r)
+        for nome, (a, b) in self.protocollo.get("differenze", {}).items():
+            if a in valori and b in valori:
+                valori[nome] = valori[a] - valori[b]
+                if a in provvisorie or b in provvisorie:
+                    provvisorie.add(nome)
+        return valori, provvisorie
+
+    @property
+    def completo(self):
+        """True quando tutte le finestre del protocollo sono chiuse."""
+        return not self._attive and len(self._chiuse) == len(self.protocollo.get("finestre", []))
+
+
+def metriche_firmware(valori):
+    """Tupla (baseline, peak, dHR, tpeak, recov60) come la riga METRICS, se il protocollo le fornisce."""
+    try:
+        return (valori["baseline"], valori["peak"], valori["dHR"], valori["t_peak"], valori["recov60"])
+    except KeyError:
+        return None
@@ -0,0 +1,123 @@
+"""Acquisizione senza interfaccia grafica: registrazione delle sessioni e/o monitoraggio da terminale.
+
+Usa lo stesso MotoreAcquisizione della GUI ma non importa tkinter né Matplotlib, quindi parte
+in fretta e funziona anche su macchine senza display (chioschi, server, SSH).
+
+Uso:  python monitor.py /dev/ttyUSB0 [/dev/ttyUSB1 ...] [--solo-registrazione] [--comando CMD:START]
+      python monitor.py /dev/ttyUSB0 --senza-registrazione        # solo monitoraggio
+      python monitor.py /dev/ttyUSB0 --diffusione --host-diffusione 0.0.0.0   # anche ai cruscotti in rete (vedi diffusione.py)
+"""
+import argparse, datetime, os, signal, sys, time
+
+from motore_acquisizione import MotoreAcquisizione
+from valutazione import SOGLIE_PREDEFINITE, interpretazione, soglie_da_argomenti, valuta
+from diagnostica import REGISTRO, ServerMetriche
+from diffusione import Diffusore, PORTA_TCP, PORTA_WS
+
+BAUD_PREDEFINITO = 115200
+CARTELLA_SESSIONI = os.path.join(os.path.expanduser("~"), "KY039_sessioni")  # la stessa della GUI
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Acquisizione KY-039 senza interfaccia grafica")
+    ap.add_argument("porte", nargs="*", help="porte seriali da aprire")
+    ap.add_argument("--baud", type=int, default=BAUD_PREDEFINITO)
+    ap.add_argument("--cartella", default=CARTELLA_SESSIONI, help="dove registrare le sessioni .kys")
+    ap.add_argument("--senza-registrazione", action="store_true", help="solo monitoraggio, niente file di sessione")
+    ap.add_argument("--solo-registrazione", action="store_true", help="non stampa BPM e metriche, solo lo stato")
+    ap.add_argument("--comando", action="append", default=[], help="comando da inviare dopo l'apertura (ripetibile)")
+    ap.add_argument("--durata", type=float, default=None, help="secondi prima di fermarsi (default: fino a Ctrl+C)")
+    ap.add_argument("--intervallo-fsync", type=float, default=1.0)
+    ap.add_argument("--porta-metriche", type=int, default=None, help="endpoint Prometheus su 127.0.0.1")
+    ap.add_argument("--diffusione", action="store_true", help="pubblica gli eventi in rete (TCP e WebSocket)")
+    ap.add_argument("--host-diffusione", default="127.0.0.1", help="0.0.0.0 per la rete locale (nessuna autenticazione)")
+    ap.add_argument("--porte-diffusione", type=int, nargs=2, default=(PORTA_TCP, PORTA_WS), metavar=("TCP", "WS"))
+    ap.add_argument("--soglia", action="append", default=[], metavar="NOME=VALORE",
+                    help=f"sovrascrive una soglia ({', '.join(SOGLIE_PREDEFINITE)}); ripetibile")
+    ap.add_argument("--misura-avvio", action="store_true", help=argparse.SUPPRESS)  # benchmark/bench_avvio.py
+    args = ap.parse_args(argv)
+    if args.senza_registrazione and args.solo_registrazione:
+        ap.error("--senza-registrazione e --solo-registrazione si escludono")
+    try:
+        soglie = soglie_da_argomenti(args.soglia)
+    except ValueError as e:
+        ap.error(f"--soglia: {e}")
+
+    diffusore = None
+    if args.diffusione:
+        diffusore = Diffusore(args.host_diffusione, *args.porte_diffusione)
+        diffusore.start()
+    motore = MotoreAcquisizione(cartella_sessioni=None if args.senza_registrazione else args.cartella,
+                                intervallo_fsync=args.intervallo_fsync, diffusore=diffusore)
+    motore.start()
+    server = ServerMetriche(REGISTRO, args.porta_metriche) if args.porta_metriche else None
+    dispositivi = [motore.aggiungi(porta, args.baud) for porta in args.porte]
+    for disp in dispositivi:
+        for cmd in args.comando:
+            disp.invia(cmd)  # il motore li tiene in coda fino alla fine del reset della ESP32
+    if args.misura_avvio:
+        print("pronto", flush=True)
+        motore.ferma()
+        motore.join()
+        return
+
+    fermati = []
+    for segnale in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(segnale, lambda *_: fermati.append(True))
+    t_inizio = time.monotonic()
+    prossimo_riepilogo = t_inizio + 10
+    try:
+        while not fermati:
+            adesso = time.monotonic()
+            if args.durata is not None and adesso - t_inizio >= args.durata:
+                break
+            for disp in dispositivi:
+                for typ, payload in disp.coda.preleva_tutto():
+                    _stampa(disp, typ, payload, soglie, args.solo_registrazione)
+            if args.solo_registrazione and adesso >= prossimo_riepilogo:
+                for disp in dispositivi:
+                    scritti = disp.registratore.record_scritti if disp.registratore else 0
+                    print(f"{_ora()} {disp.porta} record letti {disp.righe_lette}, registrati {scritti}", flush=True)
+                prossimo_riepilogo = adesso + 10
+            time.sleep(0.1)
+    finally:
+        motore.ferma()
+        motore.join()  # chiude le porte e scarica su disco le sessioni
+        if server:
+            server.chiudi()
+        if diffusore:
+            diffusore.ferma()
+    for disp in dispositivi:
+        if disp.registratore:
+            print(f"sessione {disp.porta}: {disp.registratore.percorso}")
+
+
+def _ora():
+    return datetime.datetime.now().strftime("%H:%M:%S")
+
+
+def _stampa(disp, typ, payload, soglie, solo_stato):
+    if typ == "ERRORE":
+        print(f"{_ora()} {disp.porta} ERRORE {payload}", file=sys.stderr, flush=True)
+    elif typ == "STATUS":
+        print(f"{_ora()} {disp.porta} {payload}", flush=True)
+    elif solo_stato:
+        return
+    elif typ == "BPM":
+        print(f"{_ora()} {disp.porta} BPM {payload:.1f}", flush=True)
+    elif typ == "METRICS":
+        b, p, d, tp, r = payload
+        reasons = valuta(b, p, d, r, tp, soglie)
+        esito = "OK" if not reasons else "ATTENZIONE"
+        print(f"{_ora()} {disp.porta} METRICS baseline={b:.1f} peak={p:.1f} dHR={d:.1f} tpeak={tp:.1f} "
+              f"recov60={r:.1f} → {esito}: {interpretazione(reasons)}", flush=True)
+    elif typ == "ACK":
+        print(f"{_ora()} {disp.porta} ACK:{payload}", flush=True)
+    elif typ == "BATTITO":
+        t_ms, ibi, bpm = payload
+        testo_bpm = "—" if bpm is None else f"{bpm:.1f}"
+        print(f"{_ora()} {disp.porta} battito host t={t_ms} ms IBI={ibi} ms BPM {testo_bpm}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
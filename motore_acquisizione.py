@@ -0,0 +1,537 @@
+"""Motore di acquisizione headless: molte porte ESP32 servite da un solo thread.
+
+Tutte le porte aperte vengono registrate in un unico selettore (epoll/kqueue) e lette
+in modo non bloccante, senza un thread per porta. Ogni Dispositivo conserva la propria
+serie BPM, le ultime metriche e le righe risultato; la GUI ne legge la coda eventi.
+Se una porta già aperta cade (cavo USB staccato, reset) il motore la riapre da solo con
+attese crescenti; il Dispositivo, la sessione registrata e le righe restano quelli di prima.
+Su POSIX porte seriali e pseudo-terminali hanno un file descriptor selezionabile. Dove non
+c'è (pyserial su Windows) ogni porta ha un piccolo thread che fa solo letture bloccanti e
+passa i blocchi al motore: parsing, registrazione e stato restano comunque nel suo thread.
+"""
+import os, re, sys, threading, select, selectors, socket, datetime, time
+from collections import deque
+
+import numpy as np
+
+from parser_seriale import estrai_eventi, CodaEventi, ERRORI_PARSER
+from protocollo_binario import SYNC
+from diagnostica import REGISTRO, LIMITI_BYTE
+from valutazione import riga_risultato
+from rilevatore import RilevatoreBattiti
+from sessione import RegistratoreSessione, ESTENSIONE
+from serie_temporale import SerieTemporale
+from metriche import CalcolatoreMetriche
+
+DIMENSIONE_LETTURA = 65536
+ATTESA_RICONNESSIONE = 0.5      # primo tentativo dopo una caduta, poi raddoppia
+ATTESA_RICONNESSIONE_MAX = 10.0
+ATTESA_RESET = 2.0  # la ESP32 si riavvia all'apertura della porta: prima i comandi restano in coda
+TIMEOUT_SCRITTURA = 1.0  # un comando che non entra nel buffer della porta entro questo tempo è un errore
+TIMEOUT_THREAD_LETTURA = 0.1  # lettura bloccante delle porte non selezionabili
+INTERVALLO_METRICHE_HOST = 0.25  # ogni quanto si ricalcolano le metriche host mostrate dalla GUI
+ATTESA_FRAME_MAX = 0.5  # un frame incompleto fermo più a lungo è un falso sync: si salta (1 KB a 115200 baud ≈ 90 ms)
+
+
+def apri_seriale(porta, baud):
+    import serial  # importato qui così il motore si può usare anche senza pyserial (pty, test)
+    return serial.Serial(porta, baud, timeout=0)
+
+
+def _scrivi_tutto(fd, dati):
+    """os.write su un fd non bloccante può scrivere solo una parte: si continua finché serve."""
+    dati = memoryview(dati)
+    limite = time.monotonic() + TIMEOUT_SCRITTURA
+    while dati:
+        try:
+            dati = dati[os.write(fd, dati):]
+        except BlockingIOError:
+            if time.monotonic() > limite:
+                raise TimeoutError(f"{len(dati)} byte non scritti in {TIMEOUT_SCRITTURA:g} s")
+            select.select([], [fd], [], 0.05)
+
+
+class ProtocolloInCorso:
+    """Protocollo avviato su un dispositivo: fase corrente, scadenza della prossima e metriche host.
+
+    Vive nel thread del motore, che invia i comandi delle fasi alla porta del dispositivo e
+    passa al calcolatore i BPM con l'orario di arrivo. La GUI legge solo metriche_host, una
+    tupla (valori, provvisorie, completo) sostituita in blocco a ogni aggiornamento.
+    """
+
+    def __init__(self, protocollo):
+        self.protocollo = protocollo
+        self.calcolatore = CalcolatoreMetriche(protocollo)
+        self.fase = -1
+        self.prossima_fase = None  # time.monotonic() dell'inizio della fase successiva
+        self.metriche_host = ({}, set(), False)
+        self.prossimo_aggiornamento = 0.0
+
+    @property
+    def in_corso(self):
+        return self.prossima_fase is not None
+
+    def aggiorna_metriche(self):
+        valori, provvisorie = self.calcolatore.metriche()
+        self.metriche_host = (valori, provvisorie, self.calcolatore.completo)
+
+
+class Dispositivo:
+    """Stato di una stazione: serie BPM, metriche e righe risultato."""
+
+    def __init__(self, porta, baud=None, registro=REGISTRO):
+        self.porta = porta
+        self.baud = baud
+        self.seriale = None   # oggetto con fileno()/close() (serial.Serial o file del pty)
+        self.lettore = None   # _LettoreThread se la porta non si può mettere nel selettore
+        self.buff = bytearray()
+        self.frame_atteso_da = None  # time.monotonic() da cui buff inizia con lo stesso frame incompleto
+        self.coda = CodaEventi()  # eventi per la vista GUI
+        self.serie_bpm = SerieTemporale()  # storia BPM sull'orario dell'host, a più risoluzioni
+        self.ultimo_bpm = None
+        self.metriche = None
+        self.righe = []
+        self.righe_lette = 0
+        self.connesso = False
+        self.riconnetti = False   # True finché la porta deve restare aperta (fino a scollega)
+        self.pronto = False       # porta aperta e scheda avviata: i comandi si scrivono subito
+        self.pronto_alle = None   # time.monotonic() della fine del reset dopo l'apertura
+        self.comandi_in_attesa = deque()  # comandi chiesti prima che fosse pronta, inviati dal motore appena lo è
+        self._lock_invio = threading.Lock()  # mantiene l'ordine tra invii diretti e comandi in attesa
+        self.prossimo_tentativo = None  # time.monotonic() del prossimo tentativo di riapertura
+        self.attesa = ATTESA_RICONNESSIONE
+        self.rilevatore = RilevatoreBattiti()  # ricalcola i battiti dai campioni grezzi (CMD:RAW)
+        self.registratore = None  # RegistratoreSessione se la registrazione è attiva
+        self.errore_registrazione_notificato = False
+        self.protocollo = None    # ProtocolloInCorso dell'ultimo protocollo avviato su questa stazione
+        self.diffusore = None     # Diffusore se gli eventi vanno anche in rete
+        self.errori = dict.fromkeys(ERRORI_PARSER, 0)  # contati da estrai_eventi
+        self.aperture = 0
+        self._strumenta(registro)
+
+    def _strumenta(self, r):
+        # metriche aggiornate dal thread del motore (letture) o da chi chiama invia (scritture);
+        # quelle con funzione leggono lo stato già esistente solo quando qualcuno le consulta
+        p = self.porta
+        self.m_byte = r.contatore("byte_letti", "byte letti dalla porta", porta=p)
+        self.m_letture = r.istogramma("dimensione_lettura_byte", "byte restituiti da ogni lettura", LIMITI_BYTE, porta=p)
+        self.m_elaborazione = r.istogramma("durata_elaborazione_s", "parsing e smistamento di una lettura", porta=p)
+        self.m_scrittura = r.istogramma("latenza_scrittura_s", "durata della scrittura di un comando", porta=p)
+        r.contatore("record_letti", "righe e frame completi letti", funzione=lambda: self.righe_lette, porta=p)
+        for nome, aiuto in ERRORI_PARSER.items():
+            r.contatore(nome, aiuto, funzione=lambda n=nome: self.errori[n], porta=p)
+        r.misura("coda_eventi", "eventi in attesa della GUI", funzione=lambda: len(self.coda), porta=p)
+        r.contatore("coda_scartati", "eventi persi a coda piena", funzione=lambda: self.coda.scartati, porta=p)
+        r.contatore("coda_fusi", "BPM sostituiti prima della lettura", funzione=lambda: self.coda.fusi, porta=p)
+        r.contatore("riconnessioni", "aperture della porta dopo la prima", funzione=lambda: max(0, self.aperture - 1), porta=p)
+        r.misura("connesso", "1 se la porta è aperta", funzione=lambda: int(self.connesso), porta=p)
+        r.contatore("sessione_record_persi", "record non registrati per un errore di scrittura",
+                    funzione=lambda: self.registratore.record_persi if self.registratore else 0, porta=p)
+        r.contatore("sessione_record_troncati", "record registrati troncati perché troppo lunghi",
+                    funzione=lambda: self.registratore.record_troncati if self.registratore else 0, porta=p)
+        r.misura("sessione_in_errore", "1 se la registrazione si è fermata per un errore",
+                 funzione=lambda: int(bool(self.registratore and self.registratore.errore)), porta=p)
+
+    def applica(self, eventi, inoltra=True, tempi=None):
+        """Aggiorna lo stato con eventi già analizzati e (se inoltra) li passa alla coda della GUI.
+
+        tempi: orari (time.time()) dei singoli eventi, per esempio quelli registrati in una
+        sessione; se manca i BPM prendono l'orario di arrivo.
+        """
+        adesso = time.time()
+        adesso_mono = time.monotonic()
+        calcolatore = self.protocollo.calcolatore if self.protocollo and not tempi else None
+        for i, (typ, payload) in enumerate(eventi):
+            if typ == "BPM":
+                self.serie_bpm.aggiungi(tempi[i] if tempi else adesso, payload)
+                if calcolatore:  # metriche host del protocollo, con l'orario di arrivo
+                    calcolatore.aggiungi(adesso_mono, payload)
+                self.ultimo_bpm = payload
+            elif typ == "METRICS":
+                self.metriche = payload
+                self.righe.append(riga_risultato(payload, dispositivo=self.porta))
+            elif typ == "ACK" and payload in ("START", "RESET"):
+                self.rilevatore.reset()  # il firmware azzera il suo rilevatore sugli stessi comandi
+        if inoltra:
+            self.coda.put_lotto(eventi)
+            if self.diffusore:
+                self.diffusore.pubblica(self.porta, eventi)
+
+    def notifica(self, evento):
+        """Messaggio di stato o errore per la GUI (e per gli abbonati in rete)."""
+        self.coda.put(evento)
+        if self.diffusore:
+            self.diffusore.pubblica(self.porta, (evento,))
+
+    def azzera(self):
+        """Dimentica serie, metriche e righe (per esempio prima di riprodurre di nuovo una sessione)."""
+        self.serie_bpm.svuota()
+        self.ultimo_bpm = None
+        self.metriche = None
+        self.righe.clear()
+        self.rilevatore.reset()
+
+    def elabora_campioni(self, blocchi):
+        """Passa i blocchi PPG grezzi al rilevatore host in un'unica chiamata vettoriale.
+
+        Ogni battito rilevato diventa un evento ("BATTITO", (t_ms, ibi_ms, bpm)) per la GUI e la rete;
+        bpm è None quando l'IBI è fuori intervallo (il firmware in quel caso non invia BPM).
+        """
+        campioni = blocchi[0] if len(blocchi) == 1 else np.concatenate(blocchi)
+        battiti = self.rilevatore.elabora(campioni["t_ms"], campioni["somma"])
+        if len(battiti.t_ms):
+            bpm = [None if v != v else v for v in battiti.bpm.tolist()]  # NaN non è JSON valido
+            self.applica([("BATTITO", b) for b in zip(battiti.t_ms.tolist(), battiti.ibi_ms.tolist(), bpm)])
+
+    def invia(self, cmd):
+        """Scrive il comando, oppure lo mette in coda se la porta si sta aprendo, riaprendo dopo
+        una caduta o la scheda si sta avviando. Restituisce True se è partito subito."""
+        with self._lock_invio:
+            if not self.pronto or self.comandi_in_attesa:
+                self.comandi_in_attesa.append(cmd)
+                return False
+            self._scrivi(cmd)
+            return True
+
+    def invia_in_attesa(self):
+        with self._lock_invio:
+            while self.comandi_in_attesa:
+                self._scrivi(self.comandi_in_attesa.popleft())
+
+    def _scrivi(self, cmd):
+        t0 = time.perf_counter()
+        dati = (cmd + "\n").encode()
+        if self.lettore:
+            self.seriale.write(dati)  # pyserial scrive tutto (write_timeout None)
+        else:
+            _scrivi_tutto(self.seriale.fileno(), dati)
+        self.m_scrittura.osserva(time.perf_counter() - t0)
+
+    def __repr__(self):
+        return f"Dispositivo({self.porta!r})"
+
+
+class _LettoreThread(threading.Thread):
+    """Letture bloccanti di una porta senza file descriptor selezionabile; i blocchi vanno al motore."""
+
+    def __init__(self, motore, disp, seriale):
+        super().__init__(daemon=True)
+        self.motore, self.disp, self.seriale = motore, disp, seriale
+        self.attivo = True
+
+    def run(self):
+        s = self.seriale
+        s.timeout = TIMEOUT_THREAD_LETTURA
+        while self.attivo:
+            try:
+                blocco = s.read(max(1, getattr(s, "in_waiting", 0)))
+            except Exception as e:
+                if self.attivo:
+                    self.motore._consegna(self, e)
+                return
+            if blocco:
+                self.motore._consegna(self, blocco)
+
+
+class MotoreAcquisizione(threading.Thread):
+    def __init__(self, apri=apri_seriale, cartella_sessioni=None, intervallo_fsync=1.0, registro=REGISTRO,
+                 diffusore=None, attesa_reset=ATTESA_RESET):
+        super().__init__(daemon=True)
+        self.attesa_reset = attesa_reset  # 0 per sorgenti che non si riavviano (pty, simulatore)
+        self.registro = registro  # metriche di diagnostica (vedi diagnostica.py)
+        self.diffusore = diffusore  # se impostato gli eventi di ogni porta vengono pubblicati in rete
+        self.apri = apri  # funzione (porta, baud) -> oggetto con fileno()/close()
+        self.cartella_sessioni = cartella_sessioni  # se impostata ogni dispositivo registra la sua sessione
+        self.intervallo_fsync = intervallo_fsync
+        self.dispositivi = {}  # porta -> Dispositivo
+        self._selettore = selectors.DefaultSelector()
+        self._sveglia_r, self._sveglia_w = socket.socketpair()
+        self._sveglia_r.setblocking(False)
+        self._selettore.register(self._sveglia_r, selectors.EVENT_READ, None)
+        self._richieste = deque()  # operazioni chieste da altri thread, eseguite nel ciclo
+        self._blocchi = deque()    # (lettore, bytes o eccezione) dai _LettoreThread
+        self._ferma = False
+
+    # ---- API thread-safe ----
+    def aggiungi(self, porta, baud=None):
+        disp = self.dispositivi.get(porta)
+        if disp is None:
+            disp = Dispositivo(porta, baud, self.registro)
+            disp.diffusore = self.diffusore
+            self.dispositivi[porta] = disp
+        self._richiedi(self._apri, disp)
+        return disp
+
+    def scollega(self, porta):
+        # chiude la porta ma conserva il Dispositivo (serie e righe restano disponibili)
+        disp = self.dispositivi.get(porta)
+        if disp is not None:
+            self._richiedi(self._scollega, disp, "Disconnesso")
+        return disp
+
+    def dispositivo_virtuale(self, nome):
+        # dispositivo senza porta, alimentato dall'esterno (es. riproduzione di una sessione)
+        disp = self.dispositivi.get(nome)
+        if disp is None:
+            disp = self.dispositivi[nome] = Dispositivo(nome, registro=self.registro)
+        return disp
+
+    def avvia_protocollo(self, disp, protocollo):
+        """Avvia il protocollo sul dispositivo; uno già in corso sulla stessa stazione viene sostituito."""
+        self._richiedi(self._avvia_protocollo, disp, protocollo)
+
+    def ferma(self):
+        self._ferma = True
+        self._sveglia()
+
+    # ---- ciclo ----
+    def _richiedi(self, funzione, *args):
+        self._richieste.append((funzione, args))
+        self._sveglia()
+
+    def _sveglia(self):
+        try:
+            self._sveglia_w.send(b"\0")
+        except OSError:
+            pass
+
+    def _apri(self, disp):
+        if disp.connesso:
+            return
+        disp.prossimo_tentativo = None
+        try:
+            disp.seriale = self.apri(disp.porta, disp.baud)
+            if not self._registra(disp):
+                disp.lettore = _LettoreThread(self, disp, disp.seriale)
+                disp.lettore.start()
+        except Exception as e:
+            if disp.riconnetti:  # la porta era già stata aperta: si riprova più tardi
+                self._programma_riconnessione(disp, f"Riapertura di {disp.porta} non riuscita ({e})")
+            else:
+                disp.comandi_in_attesa.clear()  # la porta non si aprirà: i comandi non partiranno
+                disp.notifica(("ERRORE", f"Errore apertura seriale {disp.porta}: {e}"))
+            return
+        disp.buff.clear()  # un record troncato dalla caduta non va unito a quelli nuovi
+        disp.frame_atteso_da = None
+        disp.connesso = True
+        disp.riconnetti = True
+        disp.attesa = ATTESA_RICONNESSIONE
+        disp.aperture += 1
+        if self.attesa_reset:  # i dati si leggono già, i comandi aspettano la fine del reset
+            disp.pronto_alle = time.monotonic() + self.attesa_reset
+            disp.notifica(("STATUS", f"Apertura di {disp.porta}: attesa del reset della scheda…"))
+        else:
+            self._pronto(disp)
+        if self.cartella_sessioni and disp.registratore is None:
+            try:
+                disp.registratore = RegistratoreSessione(self._percorso_sessione(disp), self.intervallo_fsync)
+            except OSError as e:
+                disp.notifica(("ERRORE", f"Registrazione sessione non disponibile: {e}"))
+
+    def _registra(self, disp):
+        """Mette la porta nel selettore; False se non ha un file descriptor selezionabile."""
+        if sys.platform == "win32":  # select() su Windows accetta solo socket
+            return False
+        try:
+            fd = disp.seriale.fileno()
+            os.set_blocking(fd, False)
+        except (AttributeError, OSError, ValueError):
+            return False
+        self._selettore.register(fd, selectors.EVENT_READ, disp)
+        return True
+
+    def _consegna(self, lettore, dato):
+        # chiamato dai _LettoreThread: il blocco si elabora nel ciclo del motore
+        self._blocchi.append((lettore, dato))
+        self._sveglia()
+
+    def _percorso_sessione(self, disp):
+        os.makedirs(self.cartella_sessioni, exist_ok=True)
+        nome = re.sub(r"[^A-Za-z0-9_.-]+", "_", disp.porta).strip("_")
+        ora = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        return os.path.join(self.cartella_sessioni, f"{nome}_{ora}{ESTENSIONE}")
+
+    def _pronto(self, disp):
+        disp.pronto_alle = None
+        disp.pronto = True
+        stato = "Riconnesso a" if disp.aperture > 1 else "Connesso a"
+        disp.notifica(("STATUS", f"{stato} {disp.porta} @ {disp.baud}"))
+        try:
+            disp.invia_in_attesa()
+        except (OSError, ValueError) as e:
+            self._perdi(disp, f"Errore scrittura seriale {disp.porta}: {e}")
+
+    def _programma_riconnessione(self, disp, motivo):
+        disp.prossimo_tentativo = time.monotonic() + disp.attesa
+        disp.notifica(("STATUS", f"{motivo}: nuovo tentativo tra {disp.attesa:g} s"))
+        disp.attesa = min(disp.attesa * 2, ATTESA_RICONNESSIONE_MAX)
+
+    def _perdi(self, disp, motivo):
+        # caduta non chiesta dall'utente: si chiude il descrittore ma si tiene tutto il resto
+        self._chiudi(disp, None)
+        self._programma_riconnessione(disp, motivo)
+
+    def _scollega(self, disp, messaggio):
+        disp.riconnetti = False
+        disp.prossimo_tentativo = None
+        disp.pronto_alle = None
+        disp.comandi_in_attesa.clear()
+        p = disp.protocollo
+        if p is not None and p.in_corso:
+            # le fasi successive non devono accodare comandi da inviare alla prossima connessione
+            p.prossima_fase = None
+            p.aggiorna_metriche()
+            disp.notifica(("STATUS", f"Protocollo {p.protocollo['nome']} interrotto: {disp.porta} scollegata"))
+        self._chiudi(disp, messaggio)
+
+    def _chiudi(self, disp, messaggio):
+        disp.pronto = False
+        if disp.connesso:
+            if disp.lettore:
+                disp.lettore.attivo = False  # esce alla prossima lettura (o subito, per la close)
+                disp.lettore = None
+            else:
+                try:
+                    self._selettore.unregister(disp.seriale.fileno())
+                except (KeyError, ValueError, OSError):
+                    pass
+            try:
+                disp.seriale.close()
+            except Exception:
+                pass
+            disp.connesso = False
+        if messaggio:
+            disp.notifica(("STATUS", messaggio))
+
+    def _leggi(self, disp):
+        try:
+            blocco = os.read(disp.seriale.fileno(), DIMENSIONE_LETTURA)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._perdi(disp, f"Errore lettura seriale {disp.porta}: {e}")
+            return
+        if not blocco:  # la porta è stata chiusa dall'altra parte
+            self._perdi(disp, f"Porta {disp.porta} chiusa")
+            return
+        self._elabora(disp, blocco)
+
+    def _elabora(self, disp, blocco):
+        t0 = time.perf_counter()
+        disp.m_byte.inc(len(blocco))
+        disp.m_letture.osserva(len(blocco))
+        disp.buff.extend(blocco)
+        eventi, campioni = [], []
+        grezzi = [] if disp.registratore else None
+        prima = len(disp.buff)
+        disp.righe_lette += estrai_eventi(disp.buff, eventi, campioni, grezzi, disp.errori)
+        if disp.buff.startswith(SYNC):
+            adesso = time.monotonic()
+            if disp.frame_atteso_da is None or len(disp.buff) < prima:  # è un frame nuovo
+                disp.frame_atteso_da = adesso
+            elif adesso - disp.frame_atteso_da > ATTESA_FRAME_MAX:
+                # intestazione plausibile ma il resto non arriva: si risincronizza dal byte dopo
+                disp.errori["frame_non_validi"] += 1
+                del disp.buff[0]
+                disp.frame_atteso_da = None
+                disp.righe_lette += estrai_eventi(disp.buff, eventi, campioni, grezzi, disp.errori)
+        else:
+            disp.frame_atteso_da = None
+        if grezzi:
+            disp.registratore.registra_grezzi(grezzi)
+            if disp.registratore.errore is not None and not disp.errore_registrazione_notificato:
+                disp.errore_registrazione_notificato = True
+                disp.notifica(("ERRORE", f"Registrazione sessione {disp.porta} interrotta: "
+                                         f"{disp.registratore.errore}"))
+        if eventi:
+            disp.applica(eventi)
+        if campioni:
+            disp.elabora_campioni(campioni)
+        disp.m_elaborazione.osserva(time.perf_counter() - t0)
+
+    def _avvia_protocollo(self, disp, protocollo):
+        disp.protocollo = ProtocolloInCorso(protocollo)
+        self._fase(disp, 0)
+
+    def _fase(self, disp, i):
+        p = disp.protocollo
+        fasi = p.protocollo["fasi"]
+        p.fase = i
+        if i >= len(fasi):
+            p.prossima_fase = None
+            p.calcolatore.avanza(time.monotonic())
+            p.aggiorna_metriche()
+            disp.notifica(("STATUS", f"Protocollo {p.protocollo['nome']} completato"))
+            return
+        fase = fasi[i]
+        adesso = time.monotonic()
+        if fase.get("comando"):
+            try:
+                if not disp.invia(fase["comando"]):
+                    disp.notifica(("STATUS", f"{fase['comando']} in coda: {disp.porta} non è ancora pronta"))
+            except (OSError, ValueError) as e:
+                disp.notifica(("ERRORE", f"Fase {fase['nome']}: invio di {fase['comando']} fallito: {e}"))
+        p.calcolatore.inizia_fase(fase["nome"], adesso)
+        p.prossima_fase = adesso + fase["durata"]
+        disp.notifica(("STATUS", f"Fase {i+1}/{len(fasi)}: {fase['nome']} in corso… ({fase['durata']} s)"))
+
+    def _scadenze(self):
+        # riaperture e fasi dei protocolli dovute adesso
+        adesso = time.monotonic()
+        for disp in list(self.dispositivi.values()):
+            if disp.prossimo_tentativo is not None and adesso >= disp.prossimo_tentativo:
+                self._apri(disp)
+            if disp.pronto_alle is not None and disp.connesso and adesso >= disp.pronto_alle:
+                self._pronto(disp)
+            p = disp.protocollo
+            if p is not None and p.in_corso:
+                if adesso >= p.prossima_fase:
+                    self._fase(disp, p.fase + 1)
+                elif adesso >= p.prossimo_aggiornamento:  # tick 1 Hz anche quando non arrivano BPM
+                    p.calcolatore.avanza(adesso)
+                    p.aggiorna_metriche()
+                    p.prossimo_aggiornamento = adesso + INTERVALLO_METRICHE_HOST
+
+    def _attesa_selettore(self):
+        scadenze = [d.prossimo_tentativo for d in list(self.dispositivi.values()) if d.prossimo_tentativo is not None]
+        scadenze += [d.pronto_alle for d in list(self.dispositivi.values()) if d.pronto_alle is not None]
+        for d in list(self.dispositivi.values()):
+            if d.protocollo is not None and d.protocollo.in_corso:
+                # anche il ricalcolo delle metriche provvisorie, che devono avanzare senza BPM
+                scadenze += [d.protocollo.prossima_fase, d.protocollo.prossimo_aggiornamento]
+        if not scadenze:
+            return 1.0
+        return max(0.0, min(1.0, min(scadenze) - time.monotonic()))
+
+    def run(self):
+        while not self._ferma:
+            while self._richieste:
+                funzione, args = self._richieste.popleft()
+                funzione(*args)
+            for chiave, _ in self._selettore.select(timeout=self._attesa_selettore()):
+                disp = chiave.data
+                if disp is None:
+                    try:
+                        while self._sveglia_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    self._leggi(disp)
+            while self._blocchi:
+                lettore, dato = self._blocchi.popleft()
+                disp = lettore.disp
+                if disp.lettore is not lettore:  # porta già chiusa o riaperta con un altro lettore
+                    continue
+                if isinstance(dato, Exception):
+                    self._perdi(disp, f"Errore lettura seriale {disp.porta}: {dato}")
+                else:
+                    self._elabora(disp, dato)
+            self._scadenze()
+        for disp in list(self.dispositivi.values()):
+            self._scollega(disp, "Disconnesso")
+            if disp.registratore:
+                disp.registratore.chiudi()
+        self._selettore.close()
+        self._sveglia_r.close()
+        self._sveglia_w.close()
@@ -0,0 +1,147 @@
+import re, threading
+from collections import deque
+
+from protocollo_binario import SYNC, DTYPE_FRAME_BPM, decodifica_frame, decodifica_lotto_bpm
+
+# Regex per il protocollo che usa il firmware Arduino
+REGEX_RIGA_BPM = re.compile(r"^\s*BPM:\s*([0-9]+(?:\.[0-9]+)?)")
+REGEX_METRICHE  = re.compile(r"METRICS\s+baseline=([0-9.]+)\s+peak=([0-9.]+)\s+dHR=([0-9.]+)\s+tpeak=([0-9.]+)\s+recov60=([0-9.]+)")
+REGEX_ACK = re.compile(r"^\s*ACK:(\w+)")
+
+CAPACITA_CODA = 256  # eventi massimi in attesa della GUI
+ERRORI_PARSER = {  # chiavi del dict errori di estrai_eventi
+    "righe_non_riconosciute": "righe di testo non riconosciute",
+    "frame_non_validi": "frame con CRC o lunghezza non validi",
+    "frammenti_scartati": "frammenti di riga troncati da un frame",
+}
+
+
+def analizza_riga(s):
+    """Converte una riga del firmware in un evento tipizzato, None se non riconosciuta.
+
+    Eventi: ("BPM", float), ("METRICS", (baseline, peak, dHR, tpeak, recov60)), ("ACK", comando).
+    """
+    m = REGEX_RIGA_BPM.match(s)
+    if m:
+        return ("BPM", float(m.group(1)))
+    m = REGEX_METRICHE.search(s)
+    if m:
+        return ("METRICS", tuple(map(float, m.groups())))
+    m = REGEX_ACK.match(s)
+    if m:
+        return ("ACK", m.group(1))
+    return None
+
+
+def estrai_eventi(buff, eventi, campioni=None, grezzi=None, errori=None):
+    """Consuma da buff (bytearray) tutti i record completi e aggiunge a eventi quelli riconosciuti.
+
+    Il flusso può mescolare righe di testo e frame binari (vedi protocollo_binario): un frame
+    inizia con i byte di sync, che non compaiono mai in una riga ASCII. I blocchi di campioni
+    grezzi finiscono in campioni se fornita, altrimenti vengono ignorati. Se grezzi è una lista
+    vi si aggiungono i record così come sono arrivati (righe senza terminatore, frame interi)
+    per la registrazione della sessione. Se errori è un dict (vedi ERRORI_PARSER) vi si contano
+    le righe non riconosciute, i frame non validi e i frammenti di riga scartati.
+    Restituisce il numero di record consumati; l'eventuale record incompleto resta in buff.
+    """
+    if SYNC not in buff:  # solo testo: percorso veloce
+        fine = buff.rfind(b"\n")
+        if fine < 0:
+            return 0
+        righe = bytes(buff[:fine]).split(b"\n")
+        del buff[:fine + 1]
+        if grezzi is not None:
+            grezzi.extend(r.rstrip(b"\r") for r in righe)
+        for linea in righe:
+            s = linea.decode(errors="ignore").strip() # .decode trasforma i byte in stringa e .strip toglie gli spazi
+            evento = analizza_riga(s)
+            if evento:
+                eventi.append(evento)
+            elif errori is not None and s:
+                errori["righe_non_riconosciute"] += 1
+        return len(righe)
+
+    pos = record = 0
+    with memoryview(buff) as mv:
+        while pos < len(buff):
+            if buff.startswith(SYNC, pos):
+                lotto = decodifica_lotto_bpm(buff, pos, eventi, grezzi)
+                if lotto:  # sequenza di BPM: decodificata tutta insieme
+                    pos += lotto * DTYPE_FRAME_BPM.itemsize
+                    record += lotto
+                    continue
+                fine = decodifica_frame(mv, pos, eventi, campioni)
+                if fine == 0:  # frame incompleto, si aspetta il resto
+                    break
+                if fine < 0:   # falso sync o frame corrotto: si risincronizza
+                    if errori is not None:
+                        errori["frame_non_validi"] += 1
+                    pos += 1
+                    continue
+                if grezzi is not None:
+                    grezzi.append(bytes(mv[pos:fine]))
+                pos = fine
+                record += 1
+                continue
+            nl = buff.find(b"\n", pos)
+            sy = buff.find(SYNC, pos)
+            if sy >= 0 and (nl < 0 or sy < nl):  # frammento di riga prima di un frame: scartato
+                if errori is not None:
+                    errori["frammenti_scartati"] += 1
+                pos = sy
+                continue
+            if nl < 0:
+                break
+            linea = bytes(mv[pos:nl])
+            if grezzi is not None:
+                grezzi.append(linea.rstrip(b"\r"))
+            s = linea.decode(errors="ignore").strip()
+            evento = analizza_riga(s)
+            if evento:
+                eventi.append(evento)
+            elif errori is not None and s:
+                errori["righe_non_riconosciute"] += 1
+            pos = nl + 1
+            record += 1
+    del buff[:pos]
+    return record
+
+
+class CodaEventi:
+    """Coda limitata tra il thread seriale e la GUI.
+
+    I BPM consecutivi ancora in attesa collassano nell'ultimo valore; quando la coda
+    è piena si scarta l'evento più vecchio. Il thread seriale inserisce a lotti,
+    la GUI preleva tutto in un colpo solo.
+    """
+
+    def __init__(self, capacita=CAPACITA_CODA):
+        self.capacita = capacita
+        self._eventi = deque()
+        self._lock = threading.Lock()
+        self.scartati = 0  # eventi persi perché la coda era piena
+        self.fusi = 0      # BPM sostituiti dal successivo prima di essere letti
+
+    def put(self, evento):  # stessa firma di queue.Queue.put per i messaggi di stato
+        self.put_lotto((evento,))
+
+    def put_lotto(self, eventi):
+        with self._lock:
+            coda = self._eventi
+            for ev in eventi:
+                if ev[0] == "BPM" and coda and coda[-1][0] == "BPM":
+                    coda[-1] = ev
+                    self.fusi += 1
+                    continue
+                if len(coda) >= self.capacita:
+                    coda.popleft()
+                    self.scartati += 1
+                coda.append(ev)
+
+    def preleva_tutto(self):
+        with self._lock:
+            eventi, self._eventi = self._eventi, deque()
+        return eventi
+
+    def __len__(self):
+        return len(self._eventi)
@@ -0,0 +1,138 @@
+"""Protocollo binario a frame del firmware (attivato con CMD:BIN, disattivato con CMD:TXT).
+
+Ogni frame:  A5 5A | len u16 | tipo u8 | millis u32 | payload (len byte) | crc u16
+Interi little-endian; il CRC è CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF) calcolato
+su tipo + millis + payload, cioè binascii.crc_hqx(..., 0xFFFF).
+
+L'intestazione non ha un CRC proprio: un falso sync si riconosce subito perché tipo e len
+devono essere coerenti (intestazione_plausibile). Se lo sono per caso, il motore smette di
+aspettare il resto dopo ATTESA_FRAME_MAX e riparte dal byte successivo.
+"""
+import struct
+from binascii import crc_hqx
+
+import numpy as np
+
+SYNC = b"\xa5\x5a"
+INTESTAZIONE = struct.Struct("<2sHBI")   # sync, len, tipo, millis
+CRC = struct.Struct("<H")
+LUNGHEZZA_MASSIMA = 1024  # payload più lungo accettato, oltre è sicuramente un falso sync
+
+TIPO_BPM = 0x01       # float32 bpm
+TIPO_METRICHE = 0x02  # 5 float32: baseline, peak, dHR, tpeak (s), recov60
+TIPO_PPG = 0x03       # blocco di campioni grezzi (DTYPE_PPG)
+
+PAYLOAD_BPM = struct.Struct("<f")
+PAYLOAD_METRICHE = struct.Struct("<5f")
+# un campione: millis all'inizio della lettura e somma delle 20 letture ADC di readsensor()
+DTYPE_PPG = np.dtype([("t_ms", "<u4"), ("somma", "<u4")])
+
+# frame BPM completo, per decodificare a lotti le sequenze di BPM consecutivi
+DTYPE_FRAME_BPM = np.dtype([("sync", ">u2"), ("len", "<u2"), ("tipo", "u1"), ("millis", "<u4"),
+                            ("bpm", "<f4"), ("crc", "<u2")])
+LOTTO_MINIMO = 8    # sotto questo numero di frame BPM consecutivi conviene il percorso a frame singolo
+LOTTO_MASSIMO = 512  # frame controllati per volta: un METRICS in mezzo non fa ricontrollare tutto il buffer
+
+
+def _tabella_crc():
+    tabella = np.zeros(256, dtype=np.uint16)
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else crc << 1
+        tabella[i] = crc & 0xFFFF
+    return tabella
+
+
+TABELLA_CRC = _tabella_crc()
+
+
+def crc_righe(righe):
+    """CRC-16/CCITT-FALSE di ogni riga di una matrice uint8, un byte alla volta per tutte le righe."""
+    crc = np.full(len(righe), 0xFFFF, dtype=np.uint16)
+    for j in range(righe.shape[1]):
+        crc = (crc << 8) ^ TABELLA_CRC[(crc >> 8) ^ righe[:, j]]
+    return crc
+
+
+def intestazione_plausibile(tipo, n):
+    """Lunghezza coerente con il tipo: un falso sync quasi mai lo è, e si scarta senza aspettare n byte."""
+    if tipo == TIPO_BPM:
+        return n == PAYLOAD_BPM.size
+    if tipo == TIPO_METRICHE:
+        return n == PAYLOAD_METRICHE.size
+    if tipo == TIPO_PPG:
+        return 0 < n <= LUNGHEZZA_MASSIMA and n % DTYPE_PPG.itemsize == 0
+    return False
+
+
+def codifica_frame(tipo, millis, payload):
+    corpo = struct.pack("<BI", tipo, millis & 0xFFFFFFFF) + payload
+    return SYNC + struct.pack("<H", len(payload)) + corpo + CRC.pack(crc_hqx(corpo, 0xFFFF))
+
+
+def frame_bpm(millis, bpm):
+    return codifica_frame(TIPO_BPM, millis, PAYLOAD_BPM.pack(bpm))
+
+
+def frame_metriche(millis, metriche):
+    return codifica_frame(TIPO_METRICHE, millis, PAYLOAD_METRICHE.pack(*metriche))
+
+
+def frame_ppg(millis, campioni):
+    return codifica_frame(TIPO_PPG, millis, np.asarray(campioni, dtype=DTYPE_PPG).tobytes())
+
+
+def decodifica_frame(mv, pos, eventi, campioni):
+    """Decodifica il frame che inizia in mv[pos] (mv è un memoryview sul buffer di lettura).
+
+    Restituisce la posizione dopo il frame, 0 se il frame è ancora incompleto,
+    -1 se non è valido (CRC errato o lunghezza impossibile).
+    """
+    if len(mv) - pos < INTESTAZIONE.size:
+        return 0
+    _, n, tipo, millis = INTESTAZIONE.unpack_from(mv, pos)
+    if not intestazione_plausibile(tipo, n):
+        return -1
+    fine = pos + INTESTAZIONE.size + n + CRC.size
+    if fine > len(mv):
+        return 0
+    inizio = pos + INTESTAZIONE.size
+    if crc_hqx(mv[pos + 4:inizio + n], 0xFFFF) != CRC.unpack_from(mv, inizio + n)[0]:
+        return -1
+    if tipo == TIPO_BPM and n == PAYLOAD_BPM.size:
+        eventi.append(("BPM", round(PAYLOAD_BPM.unpack_from(mv, inizio)[0], 1)))
+    elif tipo == TIPO_METRICHE and n == PAYLOAD_METRICHE.size:
+        eventi.append(("METRICS", tuple(round(v, 1) for v in PAYLOAD_METRICHE.unpack_from(mv, inizio))))
+    elif tipo == TIPO_PPG and campioni is not None:
+        # copia: il buffer di lettura verrà compattato subito dopo
+        campioni.append(np.frombuffer(mv, DTYPE_PPG, n // DTYPE_PPG.itemsize, inizio).copy())
+    return fine
+
+
+def decodifica_lotto_bpm(buff, pos, eventi, grezzi=None):
+    """Decodifica in blocco i frame BPM consecutivi che iniziano in buff[pos].
+
+    Intestazioni e CRC si controllano con NumPy su tutto il lotto; ci si ferma al primo frame
+    che non è un BPM valido, lasciandolo a decodifica_frame. Restituisce i frame consumati.
+    """
+    k = min((len(buff) - pos) // DTYPE_FRAME_BPM.itemsize, LOTTO_MASSIMO)
+    if k < LOTTO_MINIMO:
+        return 0
+    frame = np.frombuffer(buff, DTYPE_FRAME_BPM, k, pos)
+    validi = (frame["sync"] == 0xA55A) & (frame["len"] == PAYLOAD_BPM.size) & (frame["tipo"] == TIPO_BPM)
+    n = k if validi.all() else int(np.argmin(validi))
+    if n < LOTTO_MINIMO:
+        return 0
+    byte = np.frombuffer(buff, np.uint8, n * DTYPE_FRAME_BPM.itemsize, pos).reshape(n, -1)
+    corretti = crc_righe(byte[:, 4:13]) == frame["crc"][:n]  # tipo + millis + payload
+    if not corretti.all():
+        n = int(np.argmin(corretti))
+        if n < LOTTO_MINIMO:
+            return 0
+    eventi.extend([("BPM", v) for v in np.round(frame["bpm"][:n].astype(np.float64), 1).tolist()])
+    if grezzi is not None:
+        dati = bytes(buff[pos:pos + n * DTYPE_FRAME_BPM.itemsize])
+        passo = DTYPE_FRAME_BPM.itemsize
+        grezzi.extend(dati[i:i + passo] for i in range(0, len(dati), passo))
+    return n
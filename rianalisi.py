@@ -0,0 +1,251 @@
+"""Rianalisi in parallelo di un archivio di sessioni registrate (.kys) o log grezzi del monitor seriale.
+
+Ogni file viene letto in streaming da un processo del pool (mmap per le sessioni, riga per
+riga per i log), quindi la memoria non dipende dalla lunghezza delle registrazioni. Per ogni
+test (da un ACK:START al successivo) si ricostruisce la serie BPM, si ricalcolano le metriche
+del protocollo con CalcolatoreMetriche partendo dagli istanti degli ACK, si riconta il numero
+di battiti dai campioni PPG grezzi se presenti e si rifà la valutazione. Il processo principale
+riceve solo le righe risultato e le scrive in un'unica tabella (CSV, Excel o Parquet).
+
+I log del monitor seriale di Arduino ("12:34:56.789 -> BPM: 72.0") hanno il timestamp in
+testa alla riga e vengono trattati come le sessioni; senza timestamp le metriche host non
+si possono calcolare e restano solo quelle inviate dal dispositivo.
+"""
+import argparse, datetime, os, re, sys, time
+from concurrent.futures import ProcessPoolExecutor
+
+from esportazione import scrivi
+from metriche import PROTOCOLLI, PROTOCOLLO_30_30_120, CalcolatoreMetriche, carica_protocollo, metriche_firmware
+from rilevatore import RilevatoreBattiti
+from sessione import ESTENSIONE, TIPO_RIGA, LettoreSessione, eventi_da_record
+from valutazione import SOGLIE_PREDEFINITE, interpretazione, soglie_da_argomenti, valuta
+
+ESTENSIONI_LOG = (".log", ".txt")
+# prefisso del monitor seriale di Arduino IDE: "HH:MM:SS.mmm -> "
+REGEX_PREFISSO = re.compile(rb"^(\d{2}):(\d{2}):(\d{2})\.(\d{3})\s*->\s?")
+
+METRICHE = ["baseline", "peak", "dHR", "t_peak_s", "recov60"]
+COLONNE_RIANALISI = (["file", "test", "inizio", "origine", "n_bpm", "bpm_medio", "n_battiti_ppg"]
+                     + METRICHE + [f"host_{m}" for m in METRICHE]
+                     + ["esito", "interpretazione"])
+
+
+def record_da_file(percorso):
+    """Genera (tipo, t_mono, t_wall, payload); t_mono e t_wall sono None se il log non ha orari."""
+    if percorso.endswith(ESTENSIONE):
+        lettore = LettoreSessione(percorso)
+        try:
+            yield from lettore
+        finally:
+            lettore.chiudi()
+        return
+    giorno, precedente = 0.0, None
+    with open(percorso, "rb") as f:
+        for linea in f:
+            t = None
+            m = REGEX_PREFISSO.match(linea)
+            if m:
+                hh, mm, ss, ms = map(int, m.groups())
+                t = hh * 3600 + mm * 60 + ss + ms / 1000 + giorno
+                if precedente is not None and t < precedente:  # passata la mezzanotte
+                    giorno += 86400.0
+                    t += 86400.0
+                precedente = t
+                linea = linea[m.end():]
+            yield TIPO_RIGA, t, None, linea.rstrip(b"\r\n")
+
+
+class _Test:
+    """Stato di un singolo test dentro un file: serie BPM, metriche host e dispositivo."""
+
+    def __init__(self, protocollo, indice, t_mono, t_wall, soglie=None):
+        self.protocollo = protocollo
+        self.soglie = soglie
+        self.indice = indice
+        self.t_wall = t_wall
+        self.calcolatore = CalcolatoreMetriche(protocollo) if t_mono is not None else None
+        self.rilevatore = RilevatoreBattiti()
+        self.n_bpm = 0
+        self.somma_bpm = 0.0
+        self.n_battiti_ppg = 0
+        self.metriche_dispositivo = None
+
+    def comando(self, ack, t_mono):
+        """Inizia le fasi che partono con il comando confermato e quelle senza comando che seguono."""
+        if self.calcolatore is None:
+            return
+        fasi = self.protocollo["fasi"]
+        for i, fase in enumerate(fasi):
+            if fase.get("comando") != "CMD:" + ack:
+                continue
+            t = t_mono
+            self.calcolatore.inizia_fase(fase["nome"], t)
+            j = i + 1
+            while j < len(fasi) and not fasi[j].get("comando"):
+                t += fasi[j - 1]["durata"]
+                self.calcolatore.inizia_fase(fasi[j]["nome"], t)
+                j += 1
+
+    def bpm(self, t_mono, valore):
+        self.n_bpm += 1
+        self.somma_bpm += valore
+        if self.calcolatore is not None and t_mono is not None:
+            self.calcolatore.aggiungi(t_mono, valore)
+
+    def ppg(self, blocchi):
+        for blocco in blocchi:
+            self.n_battiti_ppg += len(self.rilevatore.elabora(blocco["t_ms"], blocco["somma"]).t_ms)
+
+    def riga(self, nome_file, t_fine):
+        if self.calcolatore is not None and t_fine is not None:
+            self.calcolatore.avanza(t_fine)
+        riga = {"file": nome_file, "test": self.indice, "n_bpm": self.n_bpm,
+                "bpm_medio": round(self.somma_bpm / self.n_bpm, 1) if self.n_bpm else "",
+                "n_battiti_ppg": self.n_battiti_ppg,
+                "inizio": (datetime.datetime.fromtimestamp(self.t_wall).isoformat(timespec="seconds")
+                           if self.t_wall is not None else "")}
+        host = None
+        if self.calcolatore is not None:
+            valori, provvisorie = self.calcolatore.metriche()
+            host = metriche_firmware(valori) if not provvisorie else None
+        if host is not None:
+            riga.update({f"host_{m}": round(v, 1) for m, v in zip(METRICHE, host)})
+        if self.metriche_dispositivo is not None:
+            riga.update({m: round(v, 1) for m, v in zip(METRICHE, self.metriche_dispositivo)})
+        # il verdetto usa le metriche del dispositivo se ci sono, altrimenti quelle ricalcolate
+        metriche, origine = ((self.metriche_dispositivo, "dispositivo") if self.metriche_dispositivo
+                             else (host, "host") if host else (None, ""))
+        riga["origine"] = origine
+        if metriche is not None:
+            b, p, d, tp, r = metriche
+            reasons = valuta(b, p, d, r, tp, self.soglie)
+            riga["esito"] = "OK" if not reasons else "ATTENZIONE"
+            riga["interpretazione"] = interpretazione(reasons)
+        return riga
+
+
+def analizza_file(percorso, protocollo=PROTOCOLLO_30_30_120, soglie=None):
+    """Rianalizza un file e restituisce una riga risultato per ogni test trovato."""
+    nome = os.path.basename(percorso)
+    righe, test = [], None
+    eventi, campioni = [], []
+    t_ultimo = None
+    for tipo, t_mono, t_wall, payload in record_da_file(percorso):
+        eventi_da_record(tipo, payload, eventi, campioni)
+        if t_mono is not None:
+            t_ultimo = t_mono
+        for typ, valore in eventi:
+            if typ == "ACK" and valore == "START":
+                if test is not None:
+                    righe.append(test.riga(nome, t_mono))
+                test = _Test(protocollo, len(righe) + 1, t_mono, t_wall, soglie)
+                test.comando(valore, t_mono)
+            elif typ == "ACK" and valore == "RESET":
+                if test is not None:
+                    righe.append(test.riga(nome, t_mono))
+                test = None
+            elif typ == "ACK":
+                if test is not None:
+                    test.comando(valore, t_mono)
+            elif test is None and typ in ("BPM", "METRICS"):
+                # dati prima di un qualunque START (registrazione iniziata a test in corso)
+                test = _Test(protocollo, len(righe) + 1, t_mono, t_wall, soglie)
+            if test is not None and typ == "BPM":
+                test.bpm(t_mono, valore)
+            elif test is not None and typ == "METRICS":
+                test.metriche_dispositivo = valore
+        if campioni and test is not None:
+            test.ppg(campioni)
+        eventi.clear()
+        campioni.clear()
+    if test is not None:
+        righe.append(test.riga(nome, t_ultimo))
+    return righe
+
+
+def trova_file(percorsi, ricorsivo=False):
+    """Espande cartelle e file in un elenco ordinato di sessioni e log."""
+    trovati = []
+    for percorso in percorsi:
+        if os.path.isfile(percorso):
+            trovati.append(percorso)
+            continue
+        for radice, cartelle, nomi in os.walk(percorso):
+            trovati.extend(os.path.join(radice, n) for n in nomi
+                           if n.endswith(ESTENSIONE) or n.lower().endswith(ESTENSIONI_LOG))
+            if not ricorsivo:
+                cartelle.clear()
+    return sorted(trovati)
+
+
+def _analizza(argomenti):
+    percorso, protocollo, soglie = argomenti
+    try:
+        return percorso, analizza_file(percorso, protocollo, soglie), None
+    except (OSError, ValueError) as e:
+        return percorso, [], str(e)
+    except Exception as e:  # archivio corrotto (struct.error, IndexError, ...): si salta solo questo file
+        return percorso, [], f"{type(e).__name__}: {e}"
+
+
+def rianalizza(percorsi, uscita, protocollo=PROTOCOLLO_30_30_120, processi=None, progresso=None, soglie=None):
+    """Analizza i file nel pool e scrive la tabella combinata; restituisce (righe, errori)."""
+    errori = []
+
+    def righe():
+        with ProcessPoolExecutor(max_workers=processi) as pool:
+            # map mantiene l'ordine dei file; i risultati arrivano man mano che i processi finiscono
+            for i, (percorso, risultato, errore) in enumerate(
+                    pool.map(_analizza, ((p, protocollo, soglie) for p in percorsi)), 1):
+                if errore:
+                    errori.append((percorso, errore))
+                if progresso:
+                    progresso(i, len(percorsi))
+                yield from risultato
+
+    n = scrivi(righe(), uscita, colonne=COLONNE_RIANALISI)
+    return n, errori
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Rianalisi in parallelo di sessioni registrate e log seriali")
+    ap.add_argument("percorsi", nargs="+", help="file o cartelle con sessioni .kys e log .log/.txt")
+    ap.add_argument("-o", "--uscita", default="rianalisi.csv", help="tabella risultati (.csv, .xlsx, .parquet)")
+    ap.add_argument("-p", "--processi", type=int, default=None, help="processi del pool (default: CPU)")
+    ap.add_argument("-r", "--ricorsivo", action="store_true", help="scende nelle sottocartelle")
+    ap.add_argument("--protocollo", default=PROTOCOLLO_30_30_120["nome"],
+                    help=f"nome ({', '.join(PROTOCOLLI)}) o file JSON")
+    ap.add_argument("--soglia", action="append", default=[], metavar="NOME=VALORE",
+                    help=f"sovrascrive una soglia ({', '.join(SOGLIE_PREDEFINITE)}); ripetibile")
+    args = ap.parse_args()
+
+    try:
+        soglie = soglie_da_argomenti(args.soglia)
+    except ValueError as e:
+        ap.error(f"--soglia: {e}")
+    protocollo = PROTOCOLLI.get(args.protocollo)
+    if protocollo is None:
+        try:
+            protocollo = carica_protocollo(args.protocollo)
+        except FileNotFoundError:
+            ap.error(f"--protocollo: {args.protocollo!r} non è né un protocollo noto ({', '.join(PROTOCOLLI)}) "
+                     "né un file JSON")
+        except (OSError, ValueError, KeyError) as e:
+            ap.error(f"--protocollo: file {args.protocollo!r} non valido: {e}")
+    percorsi = trova_file(args.percorsi, args.ricorsivo)
+    if not percorsi:
+        sys.exit("nessuna sessione o log trovato")
+
+    def progresso(i, totale):
+        print(f"\r{i}/{totale} file", end="", file=sys.stderr, flush=True)
+
+    t0 = time.perf_counter()
+    n, errori = rianalizza(percorsi, args.uscita, protocollo, args.processi, progresso, soglie)
+    print(file=sys.stderr)
+    for percorso, errore in errori:
+        print(f"saltato {percorso}: {errore}", file=sys.stderr)
+    print(f"{n} test da {len(percorsi)} file in {time.perf_counter() - t0:.1f} s → {args.uscita}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""Rilevatore di battiti lato host: stessa catena di acquisizione2.ino, vettoriale con NumPy.
+
+Ingresso: i campioni grezzi del firmware (frame PPG, vedi protocollo_binario), cioè il
+millis() di inizio lettura e la somma delle 20 letture ADC. La catena è quella del firmware:
+media su 20 letture, EMA ALPHA, baseline ed EMA del rumore, soglie con isteresi
+(K_NOISE / HYST_FRAC / MIN_AMP) e refrattario adattivo.
+
+Le EMA sono filtri lineari e si calcolano a blocchi con un prodotto matrice; la parte
+sequenziale (armato/refrattario) salta da un attraversamento di soglia al successivo con
+searchsorted, quindi costa O(battiti) e non O(campioni). I conti sono in float64 mentre
+il firmware usa float32: i battiti coincidono tranne quando un campione cade entro
+l'errore di arrotondamento float32 da una soglia. rileva_riferimento() replica il
+firmware campione per campione in float32 per verificarlo.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+# stessi parametri di acquisizione2.ino
+N_LETTURE      = 20
+ALPHA          = 0.75
+BASELINE_ALPHA = 0.01
+NOISE_ALPHA    = 0.10
+K_NOISE        = 1.5
+MIN_AMP        = 4.0
+HYST_FRAC      = 0.45
+REF_BASE_MS    = 240
+IBI_MIN        = 300    # 30 BPM
+IBI_MAX        = 2000   # 200 BPM
+
+# t_ms: istante di ogni battito; ibi_ms: intervallo dal precedente (0 se il primo);
+# bpm: valore smussato inviato dal firmware, NaN se l'IBI era fuori intervallo
+Battiti = namedtuple("Battiti", ["t_ms", "ibi_ms", "bpm"])
+
+
+def ema(x, alpha, y0, blocco=128):
+    """y[k] = alpha*x[k] + (1-alpha)*y[k-1] con y[-1] = y0, calcolata a blocchi."""
+    x = np.asarray(x, dtype=np.float64)
+    n = len(x)
+    if n == 0:
+        return x.copy()
+    b = min(blocco, n)
+    nb = -(-n // b)
+    xp = np.zeros(nb * b)
+    xp[:n] = x
+    k = np.arange(b)
+    d = 1.0 - alpha
+    ritardo = k[:, None] - k[None, :]
+    W = np.where(ritardo >= 0, alpha * d ** np.maximum(ritardo, 0), 0.0)
+    R = xp.reshape(nb, b) @ W.T            # risposta di ogni blocco partendo da stato nullo
+    # stato all'ingresso di ogni blocco: ricorrenza sui soli nb blocchi
+    iniziali = np.empty(nb)
+    s, d_b = y0, d ** b
+    for i, fine in enumerate(R[:, -1]):
+        iniziali[i] = s
+        s = fine + d_b * s
+    return (R + iniziali[:, None] * d ** (k + 1)).ravel()[:n]
+
+
+class RilevatoreBattiti:
+    """Rilevatore incrementale: elabora() accetta blocchi consecutivi di campioni."""
+
+    def __init__(self, k_noise=K_NOISE, min_amp=MIN_AMP, hyst_frac=HYST_FRAC,
+                 ref_base_ms=REF_BASE_MS, ibi_min=IBI_MIN, ibi_max=IBI_MAX):
+        self.k_noise = k_noise
+        self.min_amp = min_amp
+        self.hyst_frac = hyst_frac
+        self.ref_base_ms = ref_base_ms
+        self.ibi_min = ibi_min
+        self.ibi_max = ibi_max
+        self.last = 0.0  # stato di readsensor(): il firmware non lo azzera mai
+        self.reset()
+
+    def reset(self):
+        # come CMD:RESET / CMD:START nel firmware
+        self.baseline = 0.0
+        self.noise = 0.0
+        self.prev_y = 0.0
+        self.armato = True
+        self.ultimo_battito = 0
+        self.ultimo_ibi = 800
+        self.ultimo_toggle = 0
+        self.bpm = 0.0
+
+    def segnale(self, somma):
+        """Catena lineare su un blocco: restituisce y, y_ac, soglia alta e bassa."""
+        y = ema(np.asarray(somma, dtype=np.float64) / N_LETTURE, ALPHA, self.last)
+        self.last = y[-1]
+        b0 = self.baseline if self.baseline != 0.0 else y[0]
+        base = ema(y, BASELINE_ALPHA, b0)
+        dy = np.abs(np.diff(y, prepend=self.prev_y))
+        noise = ema(dy, NOISE_ALPHA, self.noise)
+        self.baseline, self.noise, self.prev_y = base[-1], noise[-1], y[-1]
+        hi = np.maximum(self.min_amp, self.k_noise * np.maximum(noise, 0.5))
+        lo = np.maximum(0.5, hi * (1.0 - self.hyst_frac))
+        return y, y - base, hi, lo
+
+    def elabora(self, t_ms, somma):
+        t_ms = np.asarray(t_ms, dtype=np.int64)
+        if len(t_ms) == 0:
+            return Battiti(np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0))
+        _, y_ac, hi, lo = self.segnale(somma)
+        sopra = np.flatnonzero(y_ac > hi)   # candidati al trigger
+        sotto = np.flatnonzero(y_ac < lo)   # campioni che riarmano
+        t_out, ibi_out, bpm_out = [], [], []
+        pos = 0
+        while True:
+            if self.armato:
+                ref = max(self.ref_base_ms, int(0.45 * self.ultimo_ibi))
+                inizio = max(pos, int(np.searchsorted(t_ms, self.ultimo_toggle + ref)))
+                j = np.searchsorted(sopra, inizio)
+                if j == len(sopra):
+                    break
+                k = int(sopra[j])
+                now = int(t_ms[k])
+                self.ultimo_toggle = now
+                ibi, bpm = 0, np.nan
+                if self.ultimo_battito > 0:
+                    ibi = now - self.ultimo_battito
+                    if self.ibi_min <= ibi <= self.ibi_max:
+                        self.ultimo_ibi = ibi
+                        self.bpm = 0.6 * self.bpm + 0.4 * (60000.0 / ibi)
+                        bpm = self.bpm
+                t_out.append(now); ibi_out.append(ibi); bpm_out.append(bpm)
+                self.ultimo_battito = now
+                self.armato = False
+                pos = k + 1
+            else:
+                j = np.searchsorted(sotto, pos)
+                if j == len(sotto):
+                    break
+                self.armato = True
+                pos = int(sotto[j]) + 1
+        return Battiti(np.array(t_out, dtype=np.int64), np.array(ibi_out, dtype=np.int64),
+                       np.array(bpm_out, dtype=np.float64))
+
+
+def rileva(t_ms, somma, blocco=1 << 16, **parametri):
+    """Rielabora un'intera registrazione a blocchi e concatena i battiti."""
+    ril = RilevatoreBattiti(**parametri)
+    parti = [ril.elabora(t_ms[i:i + blocco], somma[i:i + blocco]) for i in range(0, len(t_ms), blocco)]
+    if not parti:
+        return ril.elabora([], [])
+    return Battiti(*(np.concatenate(col) for col in zip(*parti)))
+
+
+def rileva_riferimento(t_ms, somma):
+    """Replica campione per campione del loop() del firmware in float32 (lenta, per verifica)."""
+    f = np.float32
+    last = baseline = noise = prev_y = bpm_s = f(0)
+    armato, ultimo_battito, ultimo_ibi, ultimo_toggle = True, 0, 800, 0
+    t_out, ibi_out, bpm_out = [], [], []
+    for now, s in zip(np.asarray(t_ms, dtype=np.int64).tolist(), np.asarray(somma).tolist()):
+        last = f(ALPHA) * (f(s) / f(N_LETTURE)) + (f(1) - f(ALPHA)) * last
+        y = last
+        dy = y - prev_y
+        if baseline == f(0):
+            baseline = y
+        baseline += f(BASELINE_ALPHA) * (y - baseline)
+        noise += f(NOISE_ALPHA) * (abs(dy) - noise)
+        prev_y = y
+        y_ac = y - baseline
+        sigma = noise if noise > f(0.5) else f(0.5)
+        hi = max(f(MIN_AMP), f(K_NOISE) * sigma)
+        lo = max(f(0.5), hi * (f(1) - f(HYST_FRAC)))
+        ref = max(REF_BASE_MS, int(f(0.45) * f(ultimo_ibi)))
+        if armato and y_ac > hi and now - ultimo_toggle >= ref:
+            ultimo_toggle = now
+            ibi, bpm = 0, np.nan
+            if ultimo_battito > 0:
+                ibi = now - ultimo_battito
+                if IBI_MIN <= ibi <= IBI_MAX:
+                    ultimo_ibi = ibi
+                    bpm_s = f(0.6) * bpm_s + f(0.4) * (f(60000) / f(ibi))
+                    bpm = float(bpm_s)
+            t_out.append(now); ibi_out.append(ibi); bpm_out.append(bpm)
+            ultimo_battito = now
+            armato = False
+        elif not armato and y_ac < lo:
+            armato = True
+    return Battiti(np.array(t_out, dtype=np.int64), np.array(ibi_out, dtype=np.int64),
+                   np.array(bpm_out, dtype=np.float64))
@@ -0,0 +1,144 @@
+"""Storia BPM a più risoluzioni con memoria fissa, indicizzata sull'orario dell'host.
+
+Il livello 0 tiene gli ultimi valori a piena risoluzione; i livelli successivi riassumono
+tutti i valori in secchi di durata crescente (5 s, 1 min, 10 min) conservando minimo,
+massimo e media, così ore di monitoraggio occupano poche migliaia di punti per livello.
+Ogni livello è un anello preallocato: la memoria non cresce con la durata della sessione.
+
+finestra() sceglie il livello più fine che copre l'intervallo richiesto senza superare il
+numero di punti che il grafico può mostrare: lo zoom su un minuto usa i valori grezzi,
+la vista di una giornata i secchi da 10 minuti. Scrive un solo thread (il motore), legge
+la GUI: un lock protegge aggiornamenti e copie, che durano pochi microsecondi.
+"""
+import threading
+
+import numpy as np
+
+PUNTI_RECENTI = 8192                   # valori a piena risoluzione (oltre due ore a 1 BPM al secondo)
+LIVELLI = (5.0, 60.0, 600.0)           # durata in secondi dei secchi dei livelli ridotti
+CAPACITA_LIVELLO = 4096                # secchi per livello: 10 min × 4096 ≈ 28 giorni
+
+
+class _Anello:
+    """Ultime n righe di alcune colonne float, ognuna scritta due volte in un array lungo 2n
+    così le righe dalla più vecchia alla più recente sono sempre una vista contigua."""
+
+    def __init__(self, n, colonne):
+        self.n = n
+        self._colonne = [np.zeros(2 * n) for _ in range(colonne)]
+        self._pos = 0
+        self._len = 0
+        self.scartati = 0  # righe uscite dall'anello: se > 0 l'inizio della storia non c'è più
+
+    def aggiungi(self, *valori):
+        for c, v in zip(self._colonne, valori):
+            c[self._pos] = v
+            c[self._pos + self.n] = v
+        self._pos = (self._pos + 1) % self.n
+        if self._len == self.n:
+            self.scartati += 1
+        else:
+            self._len += 1
+
+    def colonne(self):
+        inizio = self._pos if self._len == self.n else 0
+        return [c[inizio:inizio + self._len] for c in self._colonne]
+
+    def svuota(self):
+        self._pos = self._len = self.scartati = 0
+
+    def __len__(self):
+        return self._len
+
+
+class _Secchio:
+    """Secchio aperto di un livello ridotto: minimo, massimo e somma dei valori arrivati."""
+    __slots__ = ("indice", "minimo", "massimo", "somma", "n")
+
+    def __init__(self, indice, v):
+        self.indice = indice
+        self.minimo = self.massimo = self.somma = v
+        self.n = 1
+
+
+class SerieTemporale:
+    def __init__(self, recenti=PUNTI_RECENTI, livelli=LIVELLI, capacita=CAPACITA_LIVELLO):
+        self.livelli = tuple(livelli)
+        self._grezzi = _Anello(recenti, 2)                            # t, valore
+        self._ridotti = [_Anello(capacita, 4) for _ in self.livelli]  # t centro, minimo, massimo, media
+        self._aperti = [None] * len(self.livelli)
+        self._lock = threading.Lock()
+        self.t_primo = None
+        self.t_ultimo = None
+        self.ultimo = None
+        self.versione = 0  # cambia a ogni modifica, il grafico la confronta
+
+    def aggiungi(self, t, v):
+        with self._lock:
+            if self.t_ultimo is not None and t < self.t_ultimo:
+                t = self.t_ultimo  # orologio spostato indietro (NTP): la serie resta ordinata
+            if self.t_primo is None:
+                self.t_primo = t
+            self._grezzi.aggiungi(t, v)
+            for i, durata in enumerate(self.livelli):
+                indice = int(t // durata)
+                s = self._aperti[i]
+                if s is not None and s.indice == indice:
+                    s.n += 1
+                    s.somma += v
+                    if v < s.minimo: s.minimo = v
+                    if v > s.massimo: s.massimo = v
+                    continue
+                if s is not None:  # il secchio precedente è completo
+                    self._ridotti[i].aggiungi((s.indice + 0.5) * durata, s.minimo, s.massimo, s.somma / s.n)
+                self._aperti[i] = _Secchio(indice, v)
+            self.t_ultimo = t
+            self.ultimo = v
+            self.versione += 1
+
+    def estendi(self, tempi, valori):
+        for t, v in zip(tempi, valori):
+            self.aggiungi(t, v)
+
+    def svuota(self):
+        with self._lock:
+            self._grezzi.svuota()
+            for a in self._ridotti:
+                a.svuota()
+            self._aperti = [None] * len(self.livelli)
+            self.t_primo = self.t_ultimo = self.ultimo = None
+            self.versione += 1
+
+    def finestra(self, t0, t1, punti_max):
+        """Punti tra t0 e t1 (più uno per parte, così la linea arriva ai bordi).
+
+        Restituisce (t, minimo, massimo, media, livello) come array nuovi; livello 0 sono i
+        valori grezzi (minimo = massimo = media), gli altri indicano LIVELLI[livello - 1].
+        """
+        with self._lock:
+            for livello in range(len(self.livelli) + 1):
+                if livello == 0:
+                    t, v = self._grezzi.colonne()
+                    colonne = [t, v, v, v]
+                    anello = self._grezzi
+                else:
+                    anello = self._ridotti[livello - 1]
+                    colonne = anello.colonne()
+                    s = self._aperti[livello - 1]
+                    if s is not None:  # il secchio in corso si mostra già, con i valori parziali
+                        durata = self.livelli[livello - 1]
+                        aperto = ((s.indice + 0.5) * durata, s.minimo, s.massimo, s.somma / s.n)
+                        colonne = [np.append(c, x) for c, x in zip(colonne, aperto)]
+                t = colonne[0]
+                i0 = max(0, int(np.searchsorted(t, t0)) - 1)
+                i1 = min(len(t), int(np.searchsorted(t, t1, "right")) + 1)
+                copre = not anello.scartati or (len(t) and t[0] <= t0)
+                if (copre and i1 - i0 <= punti_max) or livello == len(self.livelli):
+                    return tuple(np.array(c[i0:i1]) for c in colonne) + (livello,)
+
+    def nbyte(self):
+        """Memoria occupata dagli anelli (costante dalla creazione)."""
+        return sum(c.nbytes for a in [self._grezzi] + self._ridotti for c in a._colonne)
+
+    def __len__(self):
+        return len(self._grezzi)
@@ -0,0 +1,253 @@
+"""Registrazione append-only delle sessioni e riproduzione veloce.
+
+File .kys:  MAGIC | record*
+record:     crc32 u32 | len u16 | tipo u8 | t_mono f64 | t_wall f64 | payload (len byte)
+Il crc32 copre tutto il record dopo sé stesso: un record troncato da un crash si riconosce
+e la lettura si ferma lì. Accanto c'è l'indice .kys.idx, anch'esso append-only, con una
+voce (offset, t_mono) circa ogni BLOCCO_INDICE byte; se manca si ricostruisce scorrendo il file.
+"""
+import os, mmap, struct, threading, time, zlib
+
+import numpy as np
+
+from parser_seriale import analizza_riga
+from protocollo_binario import SYNC, decodifica_frame
+
+MAGIC = b"KY039SES\x01\n"
+MAGIC_INDICE = b"KY039IDX\x01\n"
+RECORD = struct.Struct("<IHBdd")  # crc, len, tipo, t_mono, t_wall
+LUNGHEZZA_MAX = 0xFFFF  # il campo len è u16: i payload più lunghi si troncano
+DTYPE_INDICE = np.dtype([("offset", "<u8"), ("t_mono", "<f8")])
+BLOCCO_INDICE = 64 * 1024
+ESTENSIONE = ".kys"
+
+TIPO_RIGA = 0   # riga di testo del firmware, senza terminatore
+TIPO_FRAME = 1  # frame binario completo (vedi protocollo_binario)
+
+
+def codifica_record(tipo, payload, t_mono, t_wall):
+    corpo = RECORD.pack(0, len(payload), tipo, t_mono, t_wall)[4:] + payload
+    return struct.pack("<I", zlib.crc32(corpo)) + corpo
+
+
+def eventi_da_record(tipo, payload, eventi, campioni=None):
+    """Ricostruisce gli eventi di un record registrato, come farebbe estrai_eventi."""
+    if tipo == TIPO_RIGA:
+        evento = analizza_riga(bytes(payload).decode(errors="ignore").strip())
+        if evento:
+            eventi.append(evento)
+    elif tipo == TIPO_FRAME:
+        decodifica_frame(memoryview(payload), 0, eventi, campioni)
+
+
+class RegistratoreSessione:
+    """Scrive i record in un thread a parte: registra() non blocca mai il percorso seriale.
+
+    I record si accumulano in memoria e ogni intervallo_fsync secondi vengono scritti
+    in un'unica write seguita da fsync, insieme alle nuove voci dell'indice.
+    Se una scrittura fallisce (disco pieno, supporto rimosso) la registrazione si ferma:
+    l'eccezione resta in errore, i record successivi non vengono più accumulati ma solo
+    contati in record_persi, e chi usa il registratore lo segnala all'utente.
+    """
+
+    def __init__(self, percorso, intervallo_fsync=1.0):
+        self.percorso = percorso
+        self.intervallo_fsync = intervallo_fsync
+        self._file = open(percorso, "ab")
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self._indice = open(percorso + ".idx", "ab")
+        if self._indice.tell() == 0:
+            self._indice.write(MAGIC_INDICE)
+        self._offset = self._file.tell()
+        self._prossimo_blocco = self._offset  # la prima voce d'indice punta al primo record
+        self._pendenti = []
+        self._in_scrittura = 0  # record del lotto in corso di scrittura
+        self._lock = threading.Lock()
+        self._ferma = threading.Event()
+        self.record_scritti = 0
+        self.record_persi = 0     # non scritti per un errore di scrittura
+        self.record_troncati = 0  # payload oltre LUNGHEZZA_MAX
+        self.errore = None        # eccezione che ha fermato la registrazione
+        self._thread = threading.Thread(target=self._ciclo, daemon=True)
+        self._thread.start()
+
+    def registra(self, payload, tipo=TIPO_RIGA, t_mono=None, t_wall=None):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        if t_mono is None:
+            t_mono = time.monotonic()
+        if t_wall is None:
+            t_wall = time.time()
+        with self._lock:
+            if self.errore is not None:
+                self.record_persi += 1
+                return
+            self._pendenti.append((tipo, t_mono, payload, t_wall))
+
+    def registra_grezzi(self, grezzi, t_mono=None, t_wall=None):
+        """Registra i record raccolti da estrai_eventi: i frame iniziano con SYNC, il resto sono righe."""
+        t_mono = time.monotonic() if t_mono is None else t_mono
+        t_wall = time.time() if t_wall is None else t_wall
+        with self._lock:
+            if self.errore is not None:
+                self.record_persi += len(grezzi)
+                return
+            self._pendenti.extend((TIPO_FRAME if p.startswith(SYNC) else TIPO_RIGA, t_mono, p, t_wall)
+                                  for p in grezzi if p)
+
+    def _scarica(self):
+        with self._lock:
+            pendenti, self._pendenti = self._pendenti, []
+        if not pendenti:
+            return
+        self._in_scrittura = len(pendenti)
+        parti, voci = [], []
+        offset = self._offset
+        for tipo, t_mono, payload, t_wall in pendenti:
+            if len(payload) > LUNGHEZZA_MAX:  # riga senza terminatore per troppo tempo: se ne tiene l'inizio
+                payload = payload[:LUNGHEZZA_MAX]
+                self.record_troncati += 1
+            if offset >= self._prossimo_blocco:
+                voci.append((offset, t_mono))
+                self._prossimo_blocco = offset + BLOCCO_INDICE
+            rec = codifica_record(tipo, payload, t_mono, t_wall)
+            parti.append(rec)
+            offset += len(rec)
+        self._file.write(b"".join(parti))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._offset = offset
+        self.record_scritti += len(pendenti)
+        self._in_scrittura = 0
+        if voci:
+            # l'indice si scrive dopo i dati: ogni voce punta sempre a byte già su disco
+            self._indice.write(np.array(voci, dtype=DTYPE_INDICE).tobytes())
+            self._indice.flush()
+            os.fsync(self._indice.fileno())
+
+    def _ciclo(self):
+        while not self._ferma.wait(self.intervallo_fsync):
+            if not self._scarica_protetto():
+                return
+        self._scarica_protetto()
+
+    def _scarica_protetto(self):
+        try:
+            self._scarica()
+            return True
+        except (OSError, ValueError, struct.error) as e:
+            with self._lock:
+                self.errore = e
+                # i record del lotto fallito e quelli ancora in attesa non arriveranno su disco
+                self.record_persi += len(self._pendenti) + self._in_scrittura
+                self._pendenti = []
+            return False
+
+    def chiudi(self):
+        self._ferma.set()
+        self._thread.join()
+        for f in (self._file, self._indice):
+            try:
+                f.close()
+            except OSError:  # stesso errore che ha fermato la registrazione
+                pass
+
+
+class LettoreSessione:
+    """Legge una sessione con mmap, senza caricarla in memoria."""
+
+    def __init__(self, percorso):
+        self.percorso = percorso
+        self._f = open(percorso, "rb")
+        dimensione = os.fstat(self._f.fileno()).st_size
+        if dimensione < len(MAGIC):
+            raise ValueError(f"{percorso}: file di sessione vuoto")
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            self.chiudi()
+            raise ValueError(f"{percorso}: non è un file di sessione")
+        self.indice = self._carica_indice(dimensione)
+
+    def _carica_indice(self, dimensione):
+        try:
+            with open(self.percorso + ".idx", "rb") as f:
+                dati = f.read()
+        except OSError:
+            dati = b""
+        if dati.startswith(MAGIC_INDICE):
+            corpo = dati[len(MAGIC_INDICE):]
+            corpo = corpo[:len(corpo) - len(corpo) % DTYPE_INDICE.itemsize]
+            indice = np.frombuffer(corpo, DTYPE_INDICE)
+            indice = indice[indice["offset"] < dimensione]
+            if len(indice):
+                return indice
+        return self._ricostruisci_indice()
+
+    def _ricostruisci_indice(self):
+        voci, prossimo = [], 0
+        for offset, _, t_mono, _, _ in self._scorri(len(MAGIC), dati=False):
+            if offset >= prossimo:
+                voci.append((offset, t_mono))
+                prossimo = offset + BLOCCO_INDICE
+        return np.array(voci, dtype=DTYPE_INDICE)
+
+    def _scorri(self, offset, dati=True):
+        mm, fine = self._mm, len(self._mm)
+        while offset + RECORD.size <= fine:
+            crc, n, tipo, t_mono, t_wall = RECORD.unpack_from(mm, offset)
+            fine_rec = offset + RECORD.size + n
+            if fine_rec > fine or zlib.crc32(memoryview(mm)[offset + 4:fine_rec]) != crc:
+                return  # coda troncata o danneggiata: la sessione valida finisce qui
+            yield offset, tipo, t_mono, t_wall, (mm[offset + RECORD.size:fine_rec] if dati else None)
+            offset = fine_rec
+
+    def record(self, da_t_mono=None):
+        """Genera (tipo, t_mono, t_wall, payload) a partire dal primo record con t_mono >= da_t_mono."""
+        offset = len(MAGIC)
+        if da_t_mono is not None and len(self.indice):
+            i = int(np.searchsorted(self.indice["t_mono"], da_t_mono, side="right")) - 1
+            if i >= 0:
+                offset = int(self.indice["offset"][i])
+        for _, tipo, t_mono, t_wall, payload in self._scorri(offset):
+            if da_t_mono is None or t_mono >= da_t_mono:
+                yield tipo, t_mono, t_wall, payload
+
+    def __iter__(self):
+        return self.record()
+
+    @property
+    def t_inizio(self):
+        return float(self.indice["t_mono"][0]) if len(self.indice) else None
+
+    def chiudi(self):
+        self._mm.close()
+        self._f.close()
+
+
+class RiproduzioneSessione:
+    """Distribuisce i record di una sessione nel tempo: a velocità reale (o multipla) o al massimo."""
+
+    def __init__(self, lettore, velocita=1.0, da_t_mono=None):
+        self.lettore = lettore
+        self.velocita = velocita  # None = massima velocità
+        self._record = lettore.record(da_t_mono)
+        self._prossimo = next(self._record, None)
+        self._t0_sessione = self._prossimo[1] if self._prossimo else 0.0
+        self._t0 = time.monotonic()
+
+    @property
+    def finita(self):
+        return self._prossimo is None
+
+    def prossimi(self, massimo=5000):
+        """Restituisce i record dovuti adesso (al massimo `massimo`)."""
+        if self.velocita is None:
+            limite = float("inf")
+        else:
+            limite = self._t0_sessione + (time.monotonic() - self._t0) * self.velocita
+        dovuti = []
+        while self._prossimo is not None and self._prossimo[1] <= limite and len(dovuti) < massimo:
+            dovuti.append(self._prossimo)
+            self._prossimo = next(self._record, None)
+        return dovuti
@@ -0,0 +1,291 @@
+"""Simulatore del firmware su pseudo-terminale, per prove di carico e di durata senza ESP32.
+
+Uso:  python simulatore.py [--velocita 100] [--ciclo] [--spazzatura 0.01] ...
+Stampa il percorso del pty da aprire nell'interfaccia (o da passare al motore di acquisizione).
+
+Parla lo stesso protocollo di acquisizione2.ino: risponde a CMD:START / CMD:STAND / CMD:RESET
+(e CMD:BIN / CMD:TXT / CMD:RAW / CMD:NORAW) con le righe ACK, invia una riga BPM: per ogni
+battito e la riga METRICS a 120 s dallo STAND, con le stesse finestre del firmware.
+L'orologio del dispositivo può essere compresso (--velocita 100 esegue il 30–30–120 in 1.8 s,
+--velocita 0 salta da un evento al successivo senza attese, campioni PPG compresi)
+e si possono iniettare guasti: byte spazzatura, righe spezzate e disconnessione a metà sessione.
+"""
+import argparse, math, os, random, select, threading, time, tty
+from collections import deque
+
+import numpy as np
+
+from protocollo_binario import frame_bpm, frame_metriche, frame_ppg, DTYPE_PPG
+
+TS_MS = 20          # periodo di campionamento del firmware
+PPG_BLOCCO = 25     # campioni per frame PPG, come PPG_BLOCK nel firmware
+IBI_MIN, IBI_MAX = 300, 2000
+SECONDI_SERIE = 240  # MAX_SEC del firmware: hrSeries è un anello di 240 campioni a 1 Hz
+
+
+def curva_ortostatica(baseline=70.0, picco=95.0, t_picco=12.0, recupero=76.0, tau=15.0):
+    """Frequenza attesa in funzione dei secondi dallo STAND (None prima dello STAND)."""
+    def hr(t_stand):
+        if t_stand is None or t_stand < 0:
+            return baseline
+        if t_stand < t_picco:
+            return baseline + (picco - baseline) * math.sin(0.5 * math.pi * t_stand / t_picco)
+        return recupero + (picco - recupero) * math.exp(-(t_stand - t_picco) / tau)
+    return hr
+
+
+class SimulatoreFirmware(threading.Thread):
+    def __init__(self, curva=None, rumore=1.0, jitter_ms=15.0, velocita=1.0, spazzatura=0.0,
+                 parziali=0.0, disconnetti_dopo=None, ciclo=False, seed=None):
+        super().__init__(daemon=True)
+        self.curva = curva or curva_ortostatica()
+        self.rumore = rumore            # deviazione standard sugli HR della curva (bpm)
+        self.jitter_ms = jitter_ms      # deviazione standard sugli IBI (ms)
+        self.velocita = velocita        # fattore di compressione del tempo, 0 = più veloce possibile
+        self.spazzatura = spazzatura    # probabilità per record di byte casuali prima del record
+        self.parziali = parziali        # probabilità per record di spezzarlo in due scritture
+        self.disconnetti_dopo = disconnetti_dopo  # secondi (del dispositivo) dopo START
+        self.ciclo = ciclo              # ripete da solo START / STAND / RESET
+        self._rng = random.Random(seed)
+        self._ferma = False
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.percorso = os.ttyname(self.slave)
+        self.record_inviati = 0
+        self._reset()
+        self.bin_mode = self.raw_mode = False
+        self._ppg = []
+        self._prossimo_campione = 0
+
+    # ---- stato del firmware ----
+    def _reset(self):
+        self.stato = "IDLE"
+        self.t_start = self.t_stand = None
+        self.serie = deque(maxlen=SECONDI_SERIE)  # (t_ms, bpm) al tick 1 Hz, come hrSeries/tsSeries
+        self.bpm = 0.0
+        self.ultimo_battito = 0
+        self._fine_sessione = None
+
+    def _ms(self):
+        if self.velocita <= 0:
+            return self._ms_virtuali
+        return int((time.monotonic() - self._t0) * 1000 * self.velocita)
+
+    def _hr(self, t_ms):
+        t_stand = None if self.t_stand is None else (t_ms - self.t_stand) / 1000
+        return max(30.0, self.curva(t_stand) + self._rng.gauss(0, self.rumore))
+
+    def _battito(self, t_ms, uscita):
+        if self.ultimo_battito > 0:
+            ibi = t_ms - self.ultimo_battito
+            if IBI_MIN <= ibi <= IBI_MAX:
+                self.bpm = 0.6 * self.bpm + 0.4 * (60000.0 / ibi)
+                if self.bin_mode:
+                    uscita.append(frame_bpm(t_ms, self.bpm))
+                else:
+                    uscita.append(b"BPM: %.1f\r\n" % self.bpm)
+        self.ultimo_battito = t_ms
+        ibi = 60000.0 / self._hr(t_ms) + self._rng.gauss(0, self.jitter_ms)
+        self._prossimo_battito = t_ms + max(IBI_MIN, int(ibi))
+
+    def _tick(self, t_ms, uscita):
+        if 0 < self.bpm < 220:
+            self.serie.append((t_ms, self.bpm))
+        if self.stato != "POST_STAND" or t_ms - self.t_stand < 120000:
+            return
+        ts = self.t_stand
+
+        def finestra(a, b):
+            return [(t, v) for t, v in self.serie if ts + a <= t < ts + b]
+        base, pic, rec = finestra(-30000, 0), finestra(0, 30000), finestra(60000, 120000)
+        if len(base) < 5 or not pic or len(rec) < 5:
+            return
+        hr_base = sum(v for _, v in base) / len(base)
+        t_at, hr_picco = max(reversed(pic), key=lambda p: p[1])  # a parità il più recente, come maxHRwindow
+        hr_rec = sum(v for _, v in rec) / len(rec)
+        metriche = (hr_base, hr_picco, hr_picco - hr_base, (t_at - ts) / 1000, hr_rec)
+        if self.bin_mode:
+            uscita.append(frame_metriche(t_ms, metriche))
+        else:
+            uscita.append(b"METRICS baseline=%.1f peak=%.1f dHR=%.1f tpeak=%.1f recov60=%.1f\r\n" % metriche)
+        self.stato = "DONE"
+        self._fine_sessione = t_ms
+
+    def _campione(self, t_ms, uscita):
+        # forma d'onda PPG sintetica: un impulso dopo ogni battito su una linea di base costante
+        dt = (t_ms - self.ultimo_battito) / 1000
+        somma = int(40000 + 1200 * math.exp(-((dt - 0.08) / 0.06) ** 2) + self._rng.gauss(0, 30))
+        self._ppg.append((t_ms, somma))
+        if len(self._ppg) == PPG_BLOCCO:
+            uscita.append(frame_ppg(t_ms, np.array(self._ppg, dtype=DTYPE_PPG)))
+            self._ppg = []
+
+    def comando(self, cmd, t_ms, uscita):
+        if cmd == "CMD:RESET":
+            self._reset()
+            uscita.append(b"ACK:RESET\r\n")
+        elif cmd == "CMD:START":
+            self._reset()
+            self.stato, self.t_start = "BASELINE", t_ms
+            uscita.append(b"ACK:START\r\n")
+        elif cmd == "CMD:STAND" and self.stato == "BASELINE":
+            self.stato, self.t_stand = "POST_STAND", t_ms
+            uscita.append(b"ACK:STAND\r\n")
+        elif cmd == "CMD:BIN":
+            uscita.append(b"ACK:BIN\r\n")
+            self.bin_mode = True
+        elif cmd == "CMD:TXT":
+            self.bin_mode = self.raw_mode = False
+            uscita.append(b"ACK:TXT\r\n")
+        elif cmd == "CMD:RAW":
+            self.raw_mode, self._ppg = True, []
+            self._prossimo_campione = t_ms
+            uscita.append(b"ACK:RAW\r\n")
+        elif cmd == "CMD:NORAW":
+            self.raw_mode = False
+            uscita.append(b"ACK:NORAW\r\n")
+
+    # ---- guasti e scrittura ----
+    def _scrivi(self, uscita):
+        blocchi, corrente = [], bytearray()
+        for rec in uscita:
+            if self.spazzatura and self._rng.random() < self.spazzatura:
+                corrente += bytes(self._rng.getrandbits(8) for _ in range(self._rng.randint(1, 16)))
+            if self.parziali and self._rng.random() < self.parziali:
+                taglio = self._rng.randint(1, len(rec) - 1)
+                corrente += rec[:taglio]
+                blocchi.append(bytes(corrente))
+                corrente = bytearray(rec[taglio:])
+            else:
+                corrente += rec
+        blocchi.append(bytes(corrente))
+        for i, blocco in enumerate(blocchi):
+            if i:
+                time.sleep(0.001)  # il resto della riga arriva in una lettura successiva
+            vista = memoryview(blocco)
+            while vista and not self._ferma:
+                _, scrivibili, _ = select.select([], [self.master], [], 1.0)
+                if not scrivibili:
+                    continue
+                vista = vista[os.write(self.master, vista):]
+        self.record_inviati += len(uscita)
+
+    def _comandi_in_arrivo(self, t_ms, uscita):
+        try:
+            dati = os.read(self.master, 4096)
+        except OSError:
+            return
+        self._cmd_buff += dati
+        *righe, self._cmd_buff = self._cmd_buff.replace(b"\r", b"\n").split(b"\n")
+        for riga in righe:
+            if riga:
+                self.comando(riga.decode(errors="ignore").strip(), t_ms, uscita)
+
+    def _comandi_automatici(self, t_ms, uscita):
+        if self.stato == "IDLE":
+            self.comando("CMD:START", t_ms, uscita)
+        elif self.stato == "BASELINE" and t_ms - self.t_start >= 30000:
+            self.comando("CMD:STAND", t_ms, uscita)
+        elif self.stato == "DONE" and t_ms - self._fine_sessione >= 5000:
+            self.comando("CMD:RESET", t_ms, uscita)
+
+    def _prossimo_evento(self, prossimo_tick):
+        # battito, tick 1 Hz o campione PPG (solo in modalità binaria grezza), il primo dei tre
+        return min(self._prossimo_battito, prossimo_tick,
+                   self._prossimo_campione if self.raw_mode and self.bin_mode else float("inf"))
+
+    def run(self):
+        self._t0 = time.monotonic()
+        self._ms_virtuali = 0
+        self._cmd_buff = b""
+        self._prossimo_battito = 800
+        prossimo_tick = 1000
+        while not self._ferma:
+            ora = self._ms()
+            uscita = []
+            while True:  # eventi in ordine di tempo fino a "ora"
+                prossimo = self._prossimo_evento(prossimo_tick)
+                if prossimo > ora:
+                    break
+                if prossimo == self._prossimo_battito:
+                    self._battito(prossimo, uscita)
+                elif prossimo == prossimo_tick:
+                    self._tick(prossimo, uscita)
+                    if self.ciclo:
+                        self._comandi_automatici(prossimo, uscita)
+                    prossimo_tick += 1000
+                else:
+                    self._campione(prossimo, uscita)
+                    self._prossimo_campione = prossimo + TS_MS
+            if (self.disconnetti_dopo is not None and self.t_start is not None
+                    and ora - self.t_start >= self.disconnetti_dopo * 1000):
+                self.chiudi()
+                return
+            if uscita:
+                self._scrivi(uscita)
+            prossimo = self._prossimo_evento(prossimo_tick)
+            if self.velocita <= 0:  # orologio virtuale: salta direttamente al prossimo evento
+                attesa = 0
+                self._ms_virtuali = prossimo
+            else:
+                attesa = max(0.0, (prossimo - self._ms()) / 1000 / self.velocita)
+                attesa = min(attesa, 0.05)
+            leggibili, _, _ = select.select([self.master], [], [], attesa)
+            if leggibili:
+                uscita = []
+                self._comandi_in_arrivo(self._ms(), uscita)
+                if uscita:
+                    self._scrivi(uscita)
+
+    def ferma(self):
+        self._ferma = True
+
+    def chiudi(self):
+        # chiudere entrambi i lati fa vedere all'host una porta sparita (EIO / EOF)
+        self._ferma = True
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+def _velocita(s):
+    v = float(s)
+    if v < 0:
+        raise argparse.ArgumentTypeError(f"non può essere negativa: {s}")
+    return v
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Simulatore del firmware KY-039 su pseudo-terminale")
+    ap.add_argument("--velocita", type=_velocita, default=1.0, help="compressione del tempo (0 = massima)")
+    ap.add_argument("--baseline", type=float, default=70.0)
+    ap.add_argument("--picco", type=float, default=95.0)
+    ap.add_argument("--t-picco", type=float, default=12.0, help="secondi dallo STAND al picco")
+    ap.add_argument("--recupero", type=float, default=76.0)
+    ap.add_argument("--rumore", type=float, default=1.0, help="bpm di rumore sulla curva")
+    ap.add_argument("--jitter", type=float, default=15.0, help="ms di jitter sugli IBI")
+    ap.add_argument("--spazzatura", type=float, default=0.0, help="probabilità di byte casuali per record")
+    ap.add_argument("--parziali", type=float, default=0.0, help="probabilità di spezzare un record")
+    ap.add_argument("--disconnetti-dopo", type=float, default=None, help="secondi dopo START")
+    ap.add_argument("--ciclo", action="store_true", help="esegue START/STAND/RESET da solo, a ripetizione")
+    ap.add_argument("--seed", type=int, default=None)
+    args = ap.parse_args()
+
+    sim = SimulatoreFirmware(curva_ortostatica(args.baseline, args.picco, args.t_picco, args.recupero),
+                             rumore=args.rumore, jitter_ms=args.jitter, velocita=args.velocita,
+                             spazzatura=args.spazzatura, parziali=args.parziali,
+                             disconnetti_dopo=args.disconnetti_dopo, ciclo=args.ciclo, seed=args.seed)
+    print(sim.percorso, flush=True)
+    sim.start()
+    try:
+        while sim.is_alive():
+            sim.join(0.5)
+    except KeyboardInterrupt:
+        sim.ferma()
+    print(f"record inviati: {sim.record_inviati}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+import os, sys
+
+# i moduli sono al primo livello del repository, come per gli script in benchmark/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,156 @@
+import base64, hashlib, json, os, selectors, socket, struct, threading, time
+
+import pytest
+
+from diagnostica import Registro
+from diffusione import Diffusore, GUID_WS, _Cliente
+
+
+def aspetta(condizione, timeout=5.0):
+    fine = time.monotonic() + timeout
+    while not condizione():
+        if time.monotonic() > fine:
+            raise AssertionError("condizione non verificata entro il timeout")
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def diffusore():
+    creati = []
+
+    def crea(**opzioni):
+        d = Diffusore("127.0.0.1", 0, 0, registro=Registro(), **opzioni)
+        d.start()
+        creati.append(d)
+        return d
+    yield crea
+    for d in creati:
+        d.ferma()
+        d.join(5)
+
+
+def pronti(d, n):
+    aspetta(lambda: sum(c.pronto for c in list(d.clienti)) == n)
+
+
+def leggi_esatti(sock, n):
+    dati = b""
+    while len(dati) < n:
+        blocco = sock.recv(n - len(dati))
+        assert blocco, "connessione chiusa"
+        dati += blocco
+    return dati
+
+
+def handshake(indirizzo):
+    sock = socket.create_connection(indirizzo, timeout=5)
+    chiave = base64.b64encode(os.urandom(16))
+    sock.sendall(b"GET / HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                 b"Sec-WebSocket-Key: " + chiave + b"\r\nSec-WebSocket-Version: 13\r\n\r\n")
+    risposta = b""
+    while b"\r\n\r\n" not in risposta:
+        risposta += sock.recv(1)
+    return sock, chiave, risposta
+
+
+def leggi_frame(sock):
+    b0, b1 = leggi_esatti(sock, 2)
+    n = b1 & 0x7F
+    if n == 126:
+        n = struct.unpack("!H", leggi_esatti(sock, 2))[0]
+    elif n == 127:
+        n = struct.unpack("!Q", leggi_esatti(sock, 8))[0]
+    return b0 & 0x0F, leggi_esatti(sock, n)
+
+
+def test_tcp_stesso_evento_a_tutti(diffusore):
+    d = diffusore()
+    clienti = [socket.create_connection(d.indirizzi["tcp"], timeout=5) for _ in range(3)]
+    pronti(d, 3)
+    d.pubblica("/dev/a", [("BPM", 72.4), ("METRICS", (70.0, 95.0, 25.0, 12.0, 78.0))])
+    for sock in clienti:
+        with sock, sock.makefile("rb") as f:
+            bpm, metriche = json.loads(f.readline()), json.loads(f.readline())
+        assert (bpm["porta"], bpm["tipo"], bpm["valore"]) == ("/dev/a", "BPM", 72.4)
+        assert metriche["valore"] == {"baseline": 70.0, "peak": 95.0, "dHR": 25.0, "t_peak_s": 12.0,
+                                      "recov60": 78.0}
+
+
+def test_websocket_handshake_e_frame_di_testo(diffusore):
+    d = diffusore()
+    sock, chiave, risposta = handshake(d.indirizzi["ws"])
+    with sock:
+        assert risposta.startswith(b"HTTP/1.1 101")
+        accetta = base64.b64encode(hashlib.sha1(chiave + GUID_WS).digest())
+        assert b"Sec-WebSocket-Accept: " + accetta + b"\r\n" in risposta
+        pronti(d, 1)
+        d.pubblica("/dev/a", [("ACK", "START"), ("STATUS", "x" * 300)])  # il secondo usa la lunghezza a 16 bit
+        opcode, dati = leggi_frame(sock)
+        assert opcode == 0x1 and json.loads(dati)["valore"] == "START"
+        opcode, dati = leggi_frame(sock)
+        assert json.loads(dati)["valore"] == "x" * 300
+
+
+def test_websocket_senza_chiave_rifiutato(diffusore):
+    d = diffusore()
+    with socket.create_connection(d.indirizzi["ws"], timeout=5) as sock:
+        sock.sendall(b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        assert sock.recv(100).startswith(b"HTTP/1.1 400")
+        assert sock.recv(100) == b""
+
+
+def test_cliente_lento_perde_i_piu_vecchi_senza_rallentare_gli_altri(diffusore):
+    d = diffusore(capacita_cliente=64)
+    lento = socket.socket()
+    lento.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    lento.connect(d.indirizzi["tcp"])
+    veloce = socket.create_connection(d.indirizzi["tcp"], timeout=5)
+    pronti(d, 2)
+    n = 5000
+    ricevute = []
+
+    def leggi_veloce():
+        with veloce.makefile("rb") as f:
+            for _ in range(n):
+                ricevute.append(json.loads(f.readline()))
+    lettore = threading.Thread(target=leggi_veloce)
+    lettore.start()
+    for i in range(0, n, 32):  # al ritmo del client veloce: la sua coda non si riempie mai
+        aspetta(lambda: len(ricevute) >= i - 32)
+        d.pubblica("/dev/a", [("STATUS", f"{j:06d}" + "x" * 2000) for j in range(i, i + 32)])
+    lettore.join(10)
+    assert [r["valore"][:6] for r in ricevute] == [f"{j:06d}" for j in range(n)]
+    aspetta(lambda: d.scartati > 0)
+
+    # il lento ritrova uno stream valido: righe intere, in ordine, fino all'ultimo evento
+    lento.settimeout(5)
+    with lento, lento.makefile("rb") as f:
+        indici = []
+        while not indici or indici[-1] != n - 1:
+            indici.append(int(json.loads(f.readline())["valore"][:6]))
+    assert indici == sorted(indici) and len(indici) < n
+
+
+def test_handshake_non_scartato_dalla_coda_piena():
+    d = Diffusore("127.0.0.1", None, None, capacita_cliente=2, registro=Registro())
+    server, client = socket.socketpair()
+    server.setblocking(False)
+    riempimento = 0
+    try:
+        while True:  # buffer di invio pieno: la risposta 101 non parte subito
+            riempimento += server.send(b"\0" * 65536)
+    except BlockingIOError:
+        pass
+    cliente = _Cliente(server, True, 2)
+    d.clienti.add(cliente)
+    d._selettore.register(server, selectors.EVENT_READ, cliente)
+    cliente.ingresso.extend(b"GET / HTTP/1.1\r\nSec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n\r\n")
+    d._handshake(cliente)
+    for i in range(10):  # eventi arrivati prima che il client legga: la coda scarta i più vecchi
+        cliente.accoda(b"evento %d" % i)
+    client.settimeout(5)
+    leggi_esatti(client, riempimento)
+    d._scrivi(cliente)
+    with client, server:
+        assert leggi_esatti(client, 12) == b"HTTP/1.1 101"
+    d._selettore.close()
@@ -0,0 +1,21 @@
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+import pyarrow.parquet as pq
+
+from esportazione import scrivi_parquet
+
+
+def test_parquet_colonne_numeriche_dichiarate(tmp_path):
+    colonne = ["file", "test", "baseline", "host_baseline", "host_peak", "esito"]
+    righe = [{"file": "a.kys", "test": 1, "baseline": 70.0, "host_baseline": "", "esito": "OK"},
+             {"file": "a.kys", "test": 2, "baseline": 72.0, "host_baseline": 71.3, "host_peak": 94.0}]
+    percorso = tmp_path / "r.parquet"
+    assert scrivi_parquet(iter(righe), str(percorso), colonne=colonne, blocco=1) == 2
+    tabella = pq.read_table(percorso)
+    tipi = dict(zip(tabella.column_names, tabella.schema.types))
+    assert tipi["host_baseline"] == pa.float64() and tipi["test"] == pa.float64()
+    assert tipi["file"] == pa.string() and tipi["esito"] == pa.string()
+    assert tabella.column("host_baseline").to_pylist() == [None, 71.3]
+    assert tabella.column("host_peak").to_pylist() == [None, 94.0]
+    assert tabella.column("esito").to_pylist() == ["OK", None]
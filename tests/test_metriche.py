@@ -0,0 +1,48 @@
+import random
+
+from metriche import MassimoMobile, CalcolatoreMetriche, PROTOCOLLO_30_30_120
+
+
+def max_hr_window(serie, t0, t1):
+    """maxHRwindow di acquisizione2.ino: dal campione più recente al più vecchio, confronto stretto."""
+    mx, t_at = None, None
+    for t, v in reversed(serie):
+        if t0 <= t < t1 and (mx is None or v > mx):
+            mx, t_at = v, t
+    return t_at, mx
+
+
+def test_massimo_a_parita_vince_il_piu_recente():
+    m = MassimoMobile()
+    for t, v in [(0, 90.0), (1, 95.0), (2, 95.0), (3, 93.0), (4, 95.0), (5, 80.0)]:
+        m.aggiungi(t, v)
+    assert m.valore() == (4, 95.0)
+
+
+def test_massimo_come_firmware_con_plateau():
+    rng = random.Random(3)
+    # valori ripetuti come il campionamento 1 Hz che mantiene l'ultimo BPM
+    serie = [(t, float(rng.choice([88, 92, 95, 95, 95]))) for t in range(120)]
+    for durata in (None, 10, 30):
+        m = MassimoMobile(durata)
+        for i, (t, v) in enumerate(serie):
+            m.aggiungi(t, v)
+            t0 = -1 if durata is None else t - durata + 1
+            assert m.valore() == max_hr_window(serie[:i + 1], t0, t + 1)
+
+
+def test_t_peak_su_plateau():
+    c = CalcolatoreMetriche(PROTOCOLLO_30_30_120)
+    c.inizia_fase("baseline", 0.0)
+    bpm = [70.0] * 30 + [80.0, 88.0, 95.0] + [95.0] * 8 + [90.0] * 100
+    for i, v in enumerate(bpm):
+        if i == 30:
+            c.inizia_fase("stand", 30.0)
+        c.aggiungi(float(i) + 0.5, v)
+    valori, _ = c.metriche()
+    assert valori["peak"] == 95.0
+    # il tick 1 Hz successivo a ogni BPM lo conserva, come storeHR1Hz
+    serie = [(i + 1.5, v) for i, v in enumerate(bpm)]
+    t_at, _ = max_hr_window(serie, 30.0, 60.0)
+    assert t_at == 41.5  # ultimo campione del plateau, non il primo
+    assert valori["t_peak"] == t_at - 30.0
@@ -0,0 +1,175 @@
+import os, select, time
+
+import pytest
+
+pytest.importorskip("tty")  # pseudo-terminali: solo POSIX
+import tty
+
+import motore_acquisizione
+from diagnostica import Registro
+from motore_acquisizione import MotoreAcquisizione
+from protocollo_binario import frame_bpm, frame_metriche
+
+
+class PortePty:
+    """apri() per il motore: ogni apertura della stessa porta logica crea un pty nuovo."""
+
+    def __init__(self):
+        self.master = []
+
+    def apri(self, _porta, _baud):
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        self.master.append(master)
+        return os.fdopen(slave, "r+b", buffering=0)
+
+    def scrivi(self, dati):
+        os.write(self.master[-1], dati)
+
+    def leggi_righe(self, n, timeout=5.0):
+        """Prime n righe scritte dal motore sull'ultimo pty aperto."""
+        dati, fine = b"", time.monotonic() + timeout
+        while dati.count(b"\n") < n and time.monotonic() < fine:
+            pronti, _, _ = select.select([self.master[-1]], [], [], 0.05)
+            if pronti:
+                dati += os.read(self.master[-1], 4096)
+        return dati.decode().splitlines()
+
+    def cadi(self):
+        # chiudere il lato master fa leggere EIO al motore, come una porta USB staccata
+        os.close(self.master[-1])
+
+    def chiudi(self):
+        for m in self.master:
+            try:
+                os.close(m)
+            except OSError:
+                pass
+
+
+def aspetta(condizione, timeout=5.0):
+    fine = time.monotonic() + timeout
+    while not condizione():
+        if time.monotonic() > fine:
+            raise AssertionError("condizione non verificata entro il timeout")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def motore():
+    creati = []
+
+    def crea(attesa_reset=0):
+        porte = PortePty()
+        m = MotoreAcquisizione(apri=porte.apri, registro=Registro(), attesa_reset=attesa_reset)
+        m.start()
+        creati.append((m, porte))
+        return m, porte
+    yield crea
+    for m, porte in creati:
+        m.ferma()
+        m.join(5)
+        porte.chiudi()
+
+
+def eventi(disp):
+    return [ev for ev in disp.coda.preleva_tutto() if ev[0] != "STATUS"]
+
+
+def test_righe_di_testo_anche_spezzate(motore):
+    m, porte = motore()
+    disp = m.aggiungi("/dev/finta")
+    aspetta(lambda: disp.connesso)
+    porte.scrivi(b"BPM: 72.0\r\nBPM: 7")
+    aspetta(lambda: disp.ultimo_bpm == 72.0)
+    time.sleep(0.05)
+    porte.scrivi(b"3.5\r\nMETRICS baseline=70.0 peak=95.0 dHR=25.0 tpeak=12.0 recov60=78.0\r\n")
+    aspetta(lambda: disp.metriche is not None)
+    assert disp.ultimo_bpm == 73.5
+    assert disp.metriche == (70.0, 95.0, 25.0, 12.0, 78.0)
+    assert eventi(disp)[-1] == ("METRICS", (70.0, 95.0, 25.0, 12.0, 78.0))
+    assert len(disp.righe) == 1
+
+
+def test_frame_binari_e_testo_mescolati(motore):
+    m, porte = motore()
+    disp = m.aggiungi("/dev/finta")
+    aspetta(lambda: disp.connesso)
+    frame = frame_bpm(1000, 81.5)
+    porte.scrivi(b"ACK:BIN\r\n" + frame[:5])  # frame spezzato tra due letture
+    time.sleep(0.05)
+    porte.scrivi(frame[5:] + frame_metriche(2000, (70.0, 95.0, 25.0, 12.0, 78.0)))
+    aspetta(lambda: disp.metriche is not None)
+    assert disp.ultimo_bpm == 81.5
+    assert [e[0] for e in eventi(disp)] == ["ACK", "BPM", "METRICS"]
+    assert not any(disp.errori.values())
+
+
+def test_comandi_in_coda_fino_alla_fine_del_reset(motore):
+    m, porte = motore(attesa_reset=0.3)
+    disp = m.aggiungi("/dev/finta")
+    assert disp.invia("CMD:BIN") is False  # la porta non è ancora pronta: in coda
+    disp.invia("CMD:START")
+    aspetta(lambda: disp.connesso)
+    assert not disp.pronto and porte.leggi_righe(1, timeout=0.1) == []
+    assert porte.leggi_righe(2) == ["CMD:BIN", "CMD:START"]
+    assert disp.pronto and disp.invia("CMD:STAND") is True
+    assert porte.leggi_righe(1) == ["CMD:STAND"]
+
+
+def test_riconnessione_dopo_una_caduta(motore, monkeypatch):
+    monkeypatch.setattr(motore_acquisizione, "ATTESA_RICONNESSIONE", 0.1)
+    m, porte = motore()
+    disp = m.aggiungi("/dev/finta")
+    aspetta(lambda: disp.connesso)
+    porte.scrivi(b"BPM: 70.0\r\nBPM: 7")  # l'ultima riga resta a metà
+    aspetta(lambda: disp.ultimo_bpm == 70.0)
+    porte.cadi()
+    aspetta(lambda: not disp.connesso)
+    assert disp.invia("CMD:START") is False  # chiesto durante la caduta: parte alla riapertura
+    aspetta(lambda: disp.connesso and disp.aperture == 2)
+    assert porte.leggi_righe(1) == ["CMD:START"]
+    porte.scrivi(b"1.0\r\nBPM: 75.0\r\n")  # il pezzo vecchio non si unisce a quello nuovo
+    aspetta(lambda: disp.ultimo_bpm == 75.0)
+    assert 71.0 not in [v for t, v in eventi(disp) if t == "BPM"]
+
+
+def test_scollega_ferma_la_riconnessione_e_il_protocollo(motore):
+    from metriche import PROTOCOLLO_30_30_120
+    m, porte = motore()
+    disp = m.aggiungi("/dev/finta")
+    aspetta(lambda: disp.connesso)
+    m.avvia_protocollo(disp, PROTOCOLLO_30_30_120)
+    assert porte.leggi_righe(1) == ["CMD:START"]
+    m.scollega("/dev/finta")
+    aspetta(lambda: not disp.connesso)
+    assert not disp.protocollo.in_corso and not disp.comandi_in_attesa
+    time.sleep(0.3)
+    assert disp.aperture == 1 and disp.prossimo_tentativo is None
+
+
+def test_battiti_host_dai_campioni_grezzi():
+    from simulatore import SimulatoreFirmware
+    sim = SimulatoreFirmware(velocita=20, seed=1)
+    sim.start()
+    m = MotoreAcquisizione(apri=lambda porta, _baud: open(porta, "r+b", buffering=0),
+                           registro=Registro(), attesa_reset=0)
+    m.start()
+    try:
+        disp = m.aggiungi(sim.percorso)
+        disp.invia("CMD:BIN")
+        disp.invia("CMD:RAW")
+        battiti = []
+        fine = time.monotonic() + 5
+        while len(battiti) < 10 and time.monotonic() < fine:
+            battiti += [p for t, p in disp.coda.preleva_tutto() if t == "BATTITO"]
+            time.sleep(0.05)
+        assert len(battiti) >= 10
+        tempi = [t for t, _, _ in battiti]
+        assert tempi == sorted(tempi)
+        assert all(300 <= ibi <= 2000 for _, ibi, bpm in battiti if bpm is not None)
+        assert 50 < battiti[-1][2] < 100  # la curva del simulatore parte da 70 bpm
+    finally:
+        m.ferma()
+        m.join(5)
+        sim.chiudi()
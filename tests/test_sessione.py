@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+from protocollo_binario import frame_bpm, frame_metriche
+from sessione import (MAGIC, TIPO_FRAME, TIPO_RIGA, LettoreSessione, RegistratoreSessione,
+                      RiproduzioneSessione, eventi_da_record)
+
+
+def registra(percorso, n=500):
+    r = RegistratoreSessione(str(percorso), intervallo_fsync=0.05)
+    for i in range(n):
+        if i % 2:
+            r.registra(frame_bpm(i, 60.0 + i / 10), TIPO_FRAME, t_mono=float(i), t_wall=1e9 + i)
+        else:
+            r.registra(b"BPM: %.1f" % (60.0 + i / 10), TIPO_RIGA, t_mono=float(i), t_wall=1e9 + i)
+    r.registra(frame_metriche(n, (70.0, 95.0, 25.0, 12.0, 78.0)), TIPO_FRAME, t_mono=float(n), t_wall=1e9 + n)
+    r.chiudi()
+    assert r.errore is None and r.record_persi == 0
+
+
+def eventi(lettore):
+    ev = []
+    for tipo, _, _, payload in lettore:
+        eventi_da_record(tipo, payload, ev)
+    return ev
+
+
+def test_andata_e_ritorno(tmp_path):
+    percorso = tmp_path / "a.kys"
+    registra(percorso)
+    lettore = LettoreSessione(str(percorso))
+    ev = eventi(lettore)
+    assert len(ev) == 501
+    assert ev[:2] == [("BPM", 60.0), ("BPM", 60.1)]
+    assert ev[-1] == ("METRICS", (70.0, 95.0, 25.0, 12.0, 78.0))
+    assert [t for _, t, _, _ in lettore.record(da_t_mono=250.0)][:2] == [250.0, 251.0]
+    lettore.chiudi()
+
+
+@pytest.mark.parametrize("taglio", [1, 7, 30])
+def test_coda_troncata(tmp_path, taglio):
+    percorso = tmp_path / "a.kys"
+    registra(percorso)
+    with open(percorso, "r+b") as f:  # crash a metà dell'ultima scrittura: l'ultimo record è incompleto
+        f.truncate(os.path.getsize(percorso) - taglio)
+    lettore = LettoreSessione(str(percorso))
+    ev = eventi(lettore)
+    assert len(ev) == 500 and ev[-1] == ("BPM", 60.0 + 499 / 10)
+    riproduzione = RiproduzioneSessione(lettore, velocita=None)
+    assert len(riproduzione.prossimi()) == 500 and riproduzione.finita
+    lettore.chiudi()
+
+
+def test_indice_mancante_si_ricostruisce(tmp_path):
+    percorso = tmp_path / "a.kys"
+    registra(percorso)
+    os.remove(str(percorso) + ".idx")
+    lettore = LettoreSessione(str(percorso))
+    assert lettore.indice["offset"][0] == len(MAGIC) and len(eventi(lettore)) == 501
+    lettore.chiudi()
+
+
+def test_file_non_di_sessione(tmp_path):
+    percorso = tmp_path / "x.kys"
+    percorso.write_bytes(b"BPM: 70.0\n" * 10)
+    with pytest.raises(ValueError):
+        LettoreSessione(str(percorso))
@@ -0,0 +1,210 @@
+import datetime
+
+import numpy as np
+
+# colonne delle righe risultato, nell'ordine usato per l'export
+COLONNE_RISULTATI = ["timestamp","baseline","peak","dHR","t_peak_s","recov60","esito","interpretazione","dispositivo"]
+
+# soglie delle regole; il pannello "Soglie e allerta" ne sovrascrive una parte
+SOGLIE_PREDEFINITE = {
+    "baseline_min": 50.0,
+    "baseline_max": 100.0,
+    "dhr_min": 10.0,
+    "dhr_max": 40.0,
+    "picco_max": 120.0,
+    "tpeak_max": 30.0,
+    "margine_recupero": 15.0,
+}
+
+# soglia -> (grandezza confrontata, True se la regola scatta sotto la soglia, False se sopra)
+# "recupero" è recov60 - baseline
+REGOLE = {
+    "baseline_min": ("baseline", True),
+    "baseline_max": ("baseline", False),
+    "dhr_min": ("dHR", True),
+    "dhr_max": ("dHR", False),
+    "picco_max": ("peak", False),
+    "tpeak_max": ("t_peak_s", False),
+    "margine_recupero": ("recupero", False),
+}
+
+MESSAGGI = {
+    "baseline_min": "Bradicardia (<{:g} bpm)",
+    "baseline_max": "Tachicardia a riposo (>{:g} bpm)",
+    "dhr_min": "ΔHR troppo basso (<{:g}) → sospetta ipotensione/disautonomia",
+    "dhr_max": "ΔHR troppo alto (>{:g}) → possibile POTS/ansia",
+    "picco_max": "Peak >{:g} bpm → iper-adrenergico",
+    "tpeak_max": "t_peak >{:g}s → reattività simpatica lenta",
+    "margine_recupero": "Recupero lento (>{:g} bpm sopra baseline a 60–120s)",
+}
+
+
+def soglie_complete(soglie=None):
+    """Soglie predefinite aggiornate con quelle date (chiavi sconosciute: ValueError)."""
+    soglie = dict(soglie or {})
+    sconosciute = set(soglie) - set(SOGLIE_PREDEFINITE)
+    if sconosciute:
+        raise ValueError(f"soglie sconosciute: {', '.join(sorted(sconosciute))}")
+    return {**SOGLIE_PREDEFINITE, **soglie}
+
+
+def soglie_da_argomenti(argomenti):
+    """Soglie complete da stringhe "NOME=VALORE" (le opzioni --soglia); forma o valore errati: ValueError."""
+    soglie = {}
+    for a in argomenti:
+        nome, uguale, valore = a.partition("=")
+        if not uguale or not nome.strip():
+            raise ValueError(f"{a!r} non è nella forma NOME=VALORE")
+        try:
+            soglie[nome.strip()] = float(valore)
+        except ValueError:
+            raise ValueError(f"{a!r}: {valore!r} non è un numero") from None
+    return soglie_complete(soglie)
+
+
+def valuta(baseline, peak, dhr, recov60, tpeak, soglie=None):
+    """Confronta le metriche ortostatiche con le soglie e restituisce la lista dei motivi di allerta."""
+    s = soglie_complete(soglie)
+    valori = {"baseline": baseline, "peak": peak, "dHR": dhr, "t_peak_s": tpeak, "recupero": recov60 - baseline}
+    reasons = []
+    for regola, (grandezza, sotto) in REGOLE.items():
+        v = valori[grandezza]
+        if (v < s[regola]) if sotto else (v > s[regola]):
+            reasons.append(MESSAGGI[regola].format(s[regola]))
+    return reasons
+
+
+def interpretazione(reasons):
+    return " | ".join(reasons) if reasons else "Risposta normale"
+
+
+def riga_risultato(metriche, dispositivo="", timestamp=None, soglie=None):
+    """Costruisce la riga per l'export a partire dalla tupla (baseline, peak, dHR, tpeak, recov60)."""
+    b, p, d, tp, r = metriche
+    reasons = valuta(b, p, d, r, tp, soglie)
+    if timestamp is None:
+        timestamp = datetime.datetime.now().isoformat(timespec="seconds")
+    return {
+        "timestamp": timestamp,
+        "baseline": round(b, 1),
+        "peak": round(p, 1),
+        "dHR": round(d, 1),
+        "t_peak_s": round(tp, 1),
+        "recov60": round(r, 1),
+        "esito": "OK" if not reasons else "ATTENZIONE",
+        "interpretazione": interpretazione(reasons),
+        "dispositivo": dispositivo,
+    }
+
+
+# ===== valutazione vettoriale su tabelle di risultati =====
+
+def _numeri(valori):
+    try:
+        return np.asarray(valori, dtype=np.float64)
+    except (TypeError, ValueError):  # celle vuote ("" o None) nelle righe lette da CSV/Excel
+        return np.array([np.nan if v in ("", None) else float(v) for v in valori], dtype=np.float64)
+
+
+def _grandezze(tabella):
+    """Array delle grandezze usate dalle regole; tabella è un DataFrame, un dict di colonne o una lista di righe."""
+    if isinstance(tabella, list):
+        tabella = {c: [riga.get(c) for riga in tabella] for c in ("baseline", "peak", "dHR", "t_peak_s", "recov60")}
+    g = {c: _numeri(tabella[c]) for c in ("baseline", "peak", "dHR", "t_peak_s")}
+    g["recupero"] = _numeri(tabella["recov60"]) - g["baseline"]
+    return g
+
+
+def _scatta(grandezze, regola, soglia):
+    grandezza, sotto = REGOLE[regola]
+    v = grandezze[grandezza]
+    return v < soglia if sotto else v > soglia
+
+
+def valuta_tabella(tabella, soglie=None):
+    """Applica le soglie a tutte le righe in un colpo: restituisce (attenzione, motivi).
+
+    attenzione è un array bool per riga, motivi un dict regola -> array bool. Le righe con
+    metriche mancanti (NaN) non fanno scattare nessuna regola.
+    """
+    s = soglie_complete(soglie)
+    g = _grandezze(tabella)
+    motivi = {regola: _scatta(g, regola, s[regola]) for regola in REGOLE}
+    attenzione = np.logical_or.reduce(list(motivi.values()))
+    return attenzione, motivi
+
+
+def rivaluta_righe(righe, soglie=None):
+    """Copia delle righe risultato con esito e interpretazione ricalcolati con le soglie date."""
+    if not righe:
+        return []
+    s = soglie_complete(soglie)
+    attenzione, motivi = valuta_tabella(righe, s)
+    scattate = np.flatnonzero(attenzione)
+    nuove = [dict(riga, esito="OK", interpretazione=interpretazione([])) for riga in righe]
+    # solo le righe in allerta hanno bisogno del testo dei motivi
+    for i in scattate.tolist():
+        reasons = [MESSAGGI[r].format(s[r]) for r in REGOLE if motivi[r][i]]
+        nuove[i]["esito"] = "ATTENZIONE"
+        nuove[i]["interpretazione"] = interpretazione(reasons)
+    return nuove
+
+
+def _conta_bit(a):
+    if hasattr(np, "bitwise_count"):  # NumPy >= 2.0
+        return np.bitwise_count(a).sum(axis=1, dtype=np.int64)
+    return np.unpackbits(a, axis=1).sum(axis=1, dtype=np.int64)
+
+
+def esplora_soglie(tabella, griglia, soglie=None, memoria_max=1 << 26):
+    """Conta OK/ATTENZIONE su tutta la tabella per ogni combinazione di soglie della griglia.
+
+    griglia: {regola: valori da provare}; le regole non in griglia usano soglie (o i
+    predefiniti). Le combinazioni sono il prodotto cartesiano, con l'ultima regola che varia
+    più in fretta. Restituisce un dict di colonne (una per regola della griglia più "OK" e
+    "ATTENZIONE"), pronto per pandas.DataFrame. Le righe con metriche mancanti sono escluse.
+
+    Ogni regola dipende da una sola soglia, quindi per ogni valore della griglia basta una
+    maschera bit-packed delle righe che la superano; una combinazione è l'AND delle sue
+    maschere e il conteggio un popcount. Il costo è O(combinazioni × righe / 8) byte, a
+    blocchi di al più memoria_max byte.
+    """
+    if not griglia:
+        raise ValueError("griglia di soglie vuota")
+    s = soglie_complete(soglie)
+    soglie_complete(griglia)  # controlla i nomi
+    g = _grandezze(tabella)
+    complete = np.logical_and.reduce([np.isfinite(v) for v in g.values()])
+    g = {k: v[complete] for k, v in g.items()}
+    n = int(complete.sum())
+
+    base = np.ones(n, dtype=bool)  # righe OK per le regole fisse
+    for regola in REGOLE:
+        if regola not in griglia:
+            base &= ~_scatta(g, regola, s[regola])
+    base = np.packbits(base)
+
+    nomi = list(griglia)
+    valori = [np.asarray(griglia[r], dtype=np.float64) for r in nomi]
+    maschere = [np.packbits(~_scatta(g, r, v[:, None]), axis=1) for r, v in zip(nomi, valori)]
+    forma = tuple(len(v) for v in valori)
+    totale = int(np.prod(forma, dtype=np.int64))
+
+    ok = np.empty(totale, dtype=np.int64)
+    blocco = max(1, memoria_max // max(1, base.size))
+    for inizio in range(0, totale, blocco):
+        fine = min(totale, inizio + blocco)
+        combinate = np.tile(base, (fine - inizio, 1))
+        for m, idx in zip(maschere, np.unravel_index(np.arange(inizio, fine), forma)):
+            combinate &= m[idx]
+        ok[inizio:fine] = _conta_bit(combinate)
+
+    colonne = {r: c.ravel() for r, c in zip(nomi, np.meshgrid(*valori, indexing="ij"))}
+    colonne["OK"] = ok
+    colonne["ATTENZIONE"] = n - ok
+    return colonne
+
+
+def griglia_intorno(soglie, passi, n=2):
+    """Griglia di 2n+1 valori centrata su ogni soglia: {regola: [s - n·passo, …, s + n·passo]}."""
+    return {r: [soglie[r] + k * passo for k in range(-n, n + 1)] for r, passo in passi.items()}